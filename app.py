@@ -4,61 +4,98 @@ LGURT Dashboard v5.1 - Flask Backend
 import os
 import json
 import uuid
-import sqlite3
+import zipfile
 from datetime import datetime, timedelta
 from functools import wraps
 
-from flask import Flask, request, jsonify, session, redirect, url_for, render_template, send_from_directory
+import click
+
+from flask import Flask, Response, abort, request, jsonify, session, redirect, url_for, render_template, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import backfill
+import batch
+import benchmark
+import db
+import exports
+import http_cache
+import jobs
+import metrics
+import replenishment
+import roles
+import run_store
+import scenarios
+import startup
+import trends
+from db import DB_PATH, get_db, transaction
+from pipeline import PIPELINE_PARAMS, check_params, rerun_with_params, run_delta, run_pipeline
+from sku_table import to_records
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'lgurt-dev-secret-key-2024')
 app.permanent_session_lifetime = timedelta(days=7)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# 上传请求体上限 (工作簿流式解析、大文件落盘，不再整份读入内存)；批量上传另按 MAX_BATCH_UPLOAD_MB
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', 128)) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = max(MAX_UPLOAD_BYTES, batch.MAX_BATCH_UPLOAD_BYTES)
+db.init_app(app)
+metrics.init_app(app)
 
-DB_PATH = os.environ.get('DATABASE_PATH', 'lgurt_dashboard.db')
 ALGO_VERSION = 'v5.1'
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def create_tables(cur):
+    """建表 (不含迁移/初始用户)"""
+    cur.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    )''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS runs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_name TEXT,
+        days INTEGER,
+        algo_version TEXT DEFAULT 'v5.1',
+        params_json TEXT,
+        checksum_rev REAL,
+        checksum_op REAL,
+        source_hash TEXT,
+        parent_run_id TEXT,
+        batch_id TEXT
+    )''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS run_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT NOT NULL,
+        summary_json TEXT,
+        skus_json TEXT,
+        ads_json TEXT,
+        inventory_json TEXT,
+        diagnostics_json TEXT,
+        config_json TEXT,
+        bundle_blob BLOB
+    )''')
+
+    cur.execute(jobs.JOBS_SCHEMA)
+    cur.execute(roles.ROLES_SCHEMA)
+    cur.execute(replenishment.LEAD_TIMES_SCHEMA)
+    for ddl in run_store.RUN_TABLES_SCHEMA + trends.TRENDS_SCHEMA:
+        cur.execute(ddl)
 
 def init_db():
     try:
         conn = get_db()
         cur = conn.cursor()
+        # 未使用 --preload 时各worker同时启动：写锁串行化，后到的worker看到已是最新版本，迁移为空操作
+        cur.execute('BEGIN IMMEDIATE')
         
-        cur.execute('''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS runs (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            file_name TEXT,
-            days INTEGER,
-            algo_version TEXT DEFAULT 'v5.1',
-            params_json TEXT,
-            checksum_rev REAL,
-            checksum_op REAL
-        )''')
-        
-        cur.execute('''CREATE TABLE IF NOT EXISTS run_results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            run_id TEXT NOT NULL,
-            summary_json TEXT,
-            skus_json TEXT,
-            ads_json TEXT,
-            inventory_json TEXT,
-            diagnostics_json TEXT,
-            config_json TEXT
-        )''')
+        create_tables(cur)
+        migrated = run_store.migrate(conn)
+        if migrated:
+            print(f"✅ Migrated {migrated} runs")
         
         cur.execute("SELECT id FROM users WHERE username = ?", ('demo',))
         if not cur.fetchone():
@@ -66,11 +103,26 @@ def init_db():
                         ('demo', generate_password_hash('demo123')))
         
         conn.commit()
-        conn.close()
+        startup.mark('schema')
         print("✅ Database initialized")
     except Exception as e:
+        # 未提交的事务在应用上下文结束归还连接时回滚
+        startup.mark('schema', e)
         print(f"❌ Database init error: {e}")
 
+def request_size_limit():
+    return batch.MAX_BATCH_UPLOAD_BYTES if request.endpoint == 'upload_batch' else MAX_UPLOAD_BYTES
+
+@app.before_request
+def check_request_size():
+    # 全局 MAX_CONTENT_LENGTH 取两者较大值 (兜底无Content-Length的请求)，这里按路由细分
+    if request.content_length is not None and request.content_length > request_size_limit():
+        abort(413)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': f"上传文件超过大小上限 ({request_size_limit() // (1024 * 1024)}MB)"}), 413
+
 # 登录检查
 def login_required(f):
     @wraps(f)
@@ -103,6 +155,18 @@ def standalone():
 def health():
     return jsonify({'status': 'ok', 'version': ALGO_VERSION})
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus抓取：阶段耗时/行数字节数/按路由请求延迟 (设置 METRICS_DIR 时汇总全部worker)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    """就绪检查 (负载均衡/滚动发布用)：建表迁移与预热完成、数据库可用才返回200；/health 只表示进程存活"""
+    is_ready, detail = startup.readiness(get_db())
+    return jsonify({'status': 'ready' if is_ready else 'not-ready', 'version': ALGO_VERSION, **detail}), \
+        200 if is_ready else 503
+
 # ==================== 认证API ====================
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -122,7 +186,6 @@ def register():
                     (username, generate_password_hash(password)))
         user_id = cur.lastrowid
         conn.commit()
-        conn.close()
         
         session.permanent = True
         session['user_id'] = user_id
@@ -141,7 +204,6 @@ def login():
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE username = ?", (username,))
     user = cur.fetchone()
-    conn.close()
     
     if not user or not check_password_hash(user['password_hash'], password):
         return jsonify({'error': '用户名或密码错误'}), 401
@@ -167,11 +229,6 @@ def me():
 @app.route('/api/runs/upload', methods=['POST'])
 @login_required
 def upload_run():
-    try:
-        from data_processor import process_excel_file, generate_ad_plan, generate_diagnostics, calc_inventory
-    except ImportError as e:
-        return jsonify({'error': f'模块导入失败: {e}'}), 500
-    
     if 'file' not in request.files:
         return jsonify({'error': '未上传文件'}), 400
     
@@ -179,90 +236,558 @@ def upload_run():
     if not file.filename.endswith(('.xlsx', '.xls')):
         return jsonify({'error': '仅支持Excel文件'}), 400
     
-    days = int(request.form.get('days', 31))
-    lead_time = int(request.form.get('lead_time', 35))
+    # 增量模式：工作簿只含部分sheet (如每日库存)，其余沿用最近一次run，只重算受影响的阶段
+    if request.form.get('delta') in ('1', 'true'):
+        return upload_delta(file)
     
-    params = {
-        'days': days,
-        'lead_time_days': lead_time,
-        'safety_days': 30,
-        'target_cover_days': 90,
-        'low_stock_threshold': 7,
-        'overstock_threshold': 120
-    }
+    params = upload_params()
+    
+    # 异步模式：立即返回job_id，由进程池计算并落库
+    if request.form.get('async') in ('1', 'true'):
+        job_id = jobs.submit_job(get_db(), DB_PATH, session['user_id'], file, file.filename, params)
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
     try:
-        result = process_excel_file(file, params)
-        summary = result['summary']
-        skus = result['skus']
-        ads_plan = generate_ad_plan(summary, skus)
-        inventory = calc_inventory(skus, params)
-        diagnostics = generate_diagnostics(skus, params)
+        bundle = run_pipeline(file, params, demand=replenishment.demand_prior(get_db(), session['user_id']))
+        summary = bundle['summary']
+        skus = bundle['skus']
+        ads_plan = bundle['ads']
+        inventory = bundle['inventory']
+        diagnostics = bundle['diagnostics']
         
         run_id = 'run_' + uuid.uuid4().hex[:12]
         
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('INSERT INTO runs (id, user_id, file_name, days, algo_version, params_json) VALUES (?, ?, ?, ?, ?, ?)',
-                    (run_id, session['user_id'], file.filename, days, ALGO_VERSION, json.dumps(params)))
-        cur.execute('INSERT INTO run_results (run_id, summary_json, skus_json, ads_json, inventory_json, diagnostics_json, config_json) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                    (run_id, json.dumps(summary), json.dumps(skus), json.dumps(ads_plan), json.dumps(inventory), json.dumps(diagnostics), json.dumps(params)))
-        conn.commit()
-        conn.close()
+        transaction(get_db(), run_store.save_run, run_id, session['user_id'], file.filename, params, bundle, ALGO_VERSION)
         
         return jsonify({'success': True, 'run_id': run_id, 'result': {
-            'run_id': run_id, 'summary': summary, 'skus': skus, 'ads': ads_plan,
-            'inventory': inventory, 'diagnostics': diagnostics
+            'run_id': run_id, 'summary': summary, 'skus': to_records(skus), 'ads': ads_plan,
+            'inventory': to_records(inventory), 'diagnostics': to_records(diagnostics)
         }})
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        metrics.report_error('upload', f"Upload failed {file.filename}: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/runs')
+def upload_delta(file):
+    conn = get_db()
+    # 同一秒内的run按写入顺序 (rowid)
+    run = conn.execute("SELECT * FROM runs WHERE user_id = ? ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                       (session['user_id'],)).fetchone()
+    if not run:
+        return jsonify({'error': '还没有可合并的run，请先上传完整工作簿'}), 409
+    try:
+        new_run_id, sheets, recomputed, bundle = derive_delta(conn, run, file, session['user_id'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 409
+    # 完整结果通过 GET /api/runs/<new_run_id> 获取 (带ETag缓存)
+    return jsonify({'success': True, 'run_id': new_run_id, 'parent_run_id': run['id'], 'sheets': sheets,
+                    'recomputed': recomputed, 'summary': bundle['summary']})
+
+# 由用户设置快照进params的参数 (不能通过 PATCH params 直接修改，改设置后 PATCH 即重新快照)
+SNAPSHOT_PARAMS = ('sku_roles', 'category_lead_times')
+
+def snapshot_params(conn, user_id):
+    return {'sku_roles': roles.snapshot(conn, user_id),
+            'category_lead_times': replenishment.get_lead_times(conn, user_id)}
+
+def make_params(conn, user_id, days=31, lead_time=35):
+    """计算参数 (附当前SKU角色/类目头程快照)"""
+    return {
+        'days': days,
+        'lead_time_days': lead_time,
+        'safety_days': 30,
+        'target_cover_days': 90,
+        'low_stock_threshold': 7,
+        'overstock_threshold': 120,
+        **snapshot_params(conn, user_id)
+    }
+
+def upload_params():
+    """上传表单 → 计算参数"""
+    return make_params(get_db(), session['user_id'], int(request.form.get('days', 31)),
+                       int(request.form.get('lead_time', 35)))
+
+@app.route('/api/runs/batch', methods=['POST'])
 @login_required
-def list_runs():
+def upload_batch():
+    """多店铺批量上传：files 为多个Excel或zip，作为后台任务并行计算，每个文件一个run，另存一个组合run"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': '未上传文件'}), 400
+    
+    try:
+        job_id, batch_id = batch.submit_batch(get_db(), DB_PATH, session['user_id'], files, upload_params())
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    # 进度与结果通过 GET /api/jobs/<job_id> 获取
+    return jsonify({'success': True, 'job_id': job_id, 'batch_id': batch_id}), 202
+
+def derive_run(conn, run, changes, user_id):
+    """
+    按修改后的参数 (并刷新角色/类目头程快照) 派生新run，只重算受影响的阶段
+    返回 (新run_id, 参数, 实际执行的阶段, ResultBundle)；参数无变化时新run_id为None
+    原始sheet已不在缓存而又需要重新聚合时抛LookupError
+    """
+    old_params = json.loads(run['params_json'] or '{}')
+    params = {**old_params, **changes, **snapshot_params(conn, user_id)}
+    if params == old_params:
+        return None, params, [], None
+    
+    bundle, recomputed = rerun_with_params(run['source_hash'] or f"run:{run['id']}", old_params, params,
+                                           stored_loader(conn, run), demand=root_demand(conn, run, user_id))
+    new_run_id = 'run_' + uuid.uuid4().hex[:12]
+    transaction(conn, run_store.save_run, new_run_id, user_id, run['file_name'], params, bundle, ALGO_VERSION, run['id'])
+    return new_run_id, params, recomputed, bundle
+
+def derive_delta(conn, run, file, user_id):
+    """
+    部分工作簿合并到 run (用户最近一次run) 派生新run，只重算受影响的阶段
+    返回 (新run_id, 增量包含的sheet, 实际执行的阶段, ResultBundle)
+    """
+    old_params = json.loads(run['params_json'] or '{}')
+    params = {**old_params, **snapshot_params(conn, user_id)}
+    bundle, sheets, recomputed = run_delta(file, run['source_hash'] or f"run:{run['id']}", old_params, params,
+                                           stored_loader(conn, run), demand=root_demand(conn, run, user_id))
+    new_run_id = 'run_' + uuid.uuid4().hex[:12]
+    transaction(conn, run_store.save_run, new_run_id, user_id, file.filename, params, bundle, ALGO_VERSION, run['id'])
+    return new_run_id, sheets, recomputed, bundle
+
+def stored_loader(conn, run):
+    """load_stored(输出名列表) → 已落库run的结果 (旧算法版本或缺少某个输出时为None)"""
+    def load_stored(names):
+        # 旧算法版本的结果不复用
+        if run['algo_version'] != ALGO_VERSION:
+            return None
+        stored = run_store.load_tables(conn, run['id'], [n for n in names if n in run_store.BUNDLE_TABLES], missing=None)
+        row = conn.execute("SELECT summary_json, ads_json FROM run_results WHERE run_id = ?", (run['id'],)).fetchone()
+        if row is None or None in stored.values():
+            return None
+        stored.update({'summary': json.loads(row['summary_json']), 'ads': json.loads(row['ads_json'])})
+        return {n: stored[n] for n in names}
+    return load_stored
+
+def root_demand(conn, run, user_id):
+    """历史日均取原始上传时的口径 (派生链的根run之前写入的run；根run已删除时取链上最早的run)"""
+    root_id = conn.execute(
+        "WITH RECURSIVE chain(id, parent_run_id, depth) AS (SELECT id, parent_run_id, 0 FROM runs WHERE id = ? "
+        "UNION ALL SELECT r.id, r.parent_run_id, c.depth + 1 FROM runs r JOIN chain c ON r.id = c.parent_run_id) "
+        "SELECT id FROM chain ORDER BY depth DESC LIMIT 1", (run['id'],)).fetchone()[0]
+    return replenishment.demand_prior(conn, user_id, before_run=root_id)
+
+@app.route('/api/runs/<run_id>/params', methods=['PATCH'])
+@login_required
+def patch_run_params(run_id):
+    """修改参数并派生新run：只重算受影响的阶段 (改lead_time只重算库存，改低库存阈值重算库存/诊断，改days需原始sheet仍在缓存)"""
+    
     conn = get_db()
     cur = conn.cursor()
-    cur.execute('SELECT id, created_at, file_name, days FROM runs WHERE user_id = ? ORDER BY created_at DESC LIMIT 50', (session['user_id'],))
-    runs = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return jsonify({'runs': runs})
+    cur.execute("SELECT * FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    run = cur.fetchone()
+    if not run:
+        return jsonify({'error': '记录不存在'}), 404
+    
+    changes = request.json or {}
+    try:
+        check_params(changes, [p for p in PIPELINE_PARAMS if p not in SNAPSHOT_PARAMS])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        new_run_id, params, recomputed, bundle = derive_run(conn, run, changes, session['user_id'])
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 409
+    if new_run_id is None:
+        return jsonify({'success': True, 'run_id': run_id, 'recomputed': []})
+    # 完整结果通过 GET /api/runs/<new_run_id> 获取 (带ETag缓存)
+    return jsonify({'success': True, 'run_id': new_run_id, 'parent_run_id': run_id, 'recomputed': recomputed,
+                    'params': params, 'summary': bundle['summary']})
+
+# ==================== Jobs API ====================
+@app.route('/api/jobs')
+@login_required
+def list_jobs():
+    return jsonify({'jobs': jobs.list_jobs(get_db(), session['user_id'])})
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def get_job(job_id):
+    job = jobs.get_job(get_db(), job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/runs')
+@login_required
+def list_runs():
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    try:
+        runs, next_cursor = run_store.list_runs(get_db(), session['user_id'], request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'runs': runs, 'next_cursor': next_cursor})
 
 @app.route('/api/runs/<run_id>')
 @login_required
 def get_run(run_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    cur.execute("SELECT algo_version, checksum_rev, checksum_op FROM runs WHERE id = ? AND user_id = ?",
+                (run_id, session['user_id']))
     run = cur.fetchone()
     if not run:
-        conn.close()
         return jsonify({'error': '记录不存在'}), 404
-    cur.execute("SELECT * FROM run_results WHERE run_id = ?", (run_id,))
-    result = cur.fetchone()
-    conn.close()
     
-    return jsonify({'success': True, 'result': {
-        'run_id': run_id,
-        'summary': json.loads(result['summary_json']) if result else {},
-        'skus': json.loads(result['skus_json']) if result else [],
-    }})
+    def build():
+        result = run_store.load_run(conn, run_id, run)
+        if not result['checksum']['is_consistent']:
+            metrics.report_error('checksum', f"Checksum mismatch {run_id}: {result['checksum']['difference']}")
+        return {'success': True, 'result': result}
+    
+    # run落库后不可变：ETag命中返回304，否则取预序列化/预压缩的响应体
+    return http_cache.cached_json_response(run_id, http_cache.run_etag(run_id, run['algo_version']), build)
 
-@app.route('/api/runs/<run_id>', methods=['DELETE'])
+@app.route('/api/runs/<run_id>/verify')
 @login_required
-def delete_run(run_id):
+def verify_run(run_id):
+    """一致性校验：落库checksum vs summary vs SKU列合计 (只解码 rev/op 两列)"""
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("DELETE FROM run_results WHERE run_id = ?", (run_id,))
-    cur.execute("DELETE FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
-    conn.commit()
-    conn.close()
+    cur.execute("SELECT id FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    if not cur.fetchone():
+        return jsonify({'error': '记录不存在'}), 404
+    return jsonify({'success': True, 'run_id': run_id, **run_store.verify_run(conn, run_id)})
+
+@app.route('/api/runs/<run_id>/skus')
+@login_required
+def list_run_skus(run_id):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    if not cur.fetchone():
+        return jsonify({'error': '记录不存在'}), 404
+    
+    args = request.args
+    fields = [f for f in args.get('fields', '').split(',') if f] or None
+    limit = min(max(args.get('limit', 100, type=int), 1), 1000)
+    try:
+        skus, total, next_cursor = run_store.query_skus(
+            conn, run_id, sku_filters(args), sort=args.get('sort', 'op'), order=args.get('order', 'desc'),
+            fields=fields, cursor=args.get('cursor'), limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'skus': skus, 'total': total, 'next_cursor': next_cursor})
+
+def sku_filters(args):
+    """SKU查询/导出共用的筛选参数"""
+    return {
+        'cat': args.get('category'),
+        'quadrant': args.get('quadrant'),
+        'status': args.get('status'),
+        'min_rev': args.get('min_rev', type=float),
+        'role': args.get('role')
+    }
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf'
+}
+
+@app.route('/api/runs/<run_id>/export')
+@login_required
+def export_run(run_id):
+    """
+    服务端导出 ?format=csv|xlsx|pdf，筛选/排序参数同 /skus (csv另可 ?fields= 指定列)
+    CSV逐块流式生成；XLSX/PDF写入临时文件后分块返回
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, algo_version, checksum_rev, checksum_op FROM runs WHERE id = ? AND user_id = ?",
+                (run_id, session['user_id']))
+    run = cur.fetchone()
+    if not run:
+        return jsonify({'error': '记录不存在'}), 404
+    
+    args = request.args
+    fmt = args.get('format', 'xlsx')
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+    columns = [(f, f) for f in args.get('fields', '').split(',') if f] or exports.CSV_COLUMNS
+    fields = {'csv': [f for _, f in columns], 'xlsx': exports.XLSX_FIELDS, 'pdf': exports.PDF_FIELDS}[fmt]
+    try:
+        export = exports.open_export(conn, run, sku_filters(args), sort=args.get('sort', 'op'),
+                                     order=args.get('order', 'desc'), fields=fields)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    headers = {'Content-Disposition': f'attachment; filename={exports.file_name(run, fmt)}',
+               'X-Checksum-Consistent': str(export.verify['is_consistent']).lower()}
+    if fmt == 'csv':
+        return Response(exports.csv_chunks(export, columns), mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+    path = exports.temp_path(f'.{fmt}')
+    try:
+        (exports.write_xlsx if fmt == 'xlsx' else exports.write_pdf)(export, path)
+    except RuntimeError as e:
+        os.remove(path)
+        return jsonify({'error': str(e)}), 501
+    except Exception:
+        os.remove(path)
+        raise
+    headers['Content-Length'] = str(os.path.getsize(path))
+    return Response(exports.stream_file(path), mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+
+@app.route('/api/runs/<run_id>/inventory')
+@login_required
+def run_inventory(run_id):
+    """库存页：各状态计数 + 按预先算好的断货优先顺序分页 (?status= &limit= &cursor=)"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    if not cur.fetchone():
+        return jsonify({'error': '记录不存在'}), 404
+    
+    args = request.args
+    limit = min(max(args.get('limit', 100, type=int), 1), 1000)
+    fields = ('sku', 'ful', 'inb', 'rsv', 'du') + tuple(k for k, _ in run_store.INVENTORY_COLUMNS[1:]) + \
+        run_store.REPLENISHMENT_FIELDS
+    try:
+        skus, total, next_cursor = run_store.query_skus(
+            conn, run_id, {'status': args.get('status')}, sort='priority', order='asc', fields=fields,
+            cursor=args.get('cursor'), limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'counts': run_store.inventory_counts(conn, run_id), 'skus': skus,
+                    'total': total, 'next_cursor': next_cursor})
+
+@app.route('/api/runs/<run_id>/diagnostics')
+@login_required
+def run_diagnostics(run_id):
+    """诊断查询：按倒排索引取命中的SKU (?quadrant= &flag=a,b &min_critical= &limit= &cursor=)，文本只为本页生成"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM runs WHERE id = ? AND user_id = ?", (run_id, session['user_id']))
+    if not cur.fetchone():
+        return jsonify({'error': '记录不存在'}), 404
+    
+    args = request.args
+    flags = [f for f in args.get('flag', '').split(',') if f]
+    limit = min(max(args.get('limit', 100, type=int), 1), 1000)
+    try:
+        items, total, next_cursor = run_store.query_diagnostics(
+            conn, run_id, quadrant=args.get('quadrant'), flags=flags, min_critical=args.get('min_critical', type=int),
+            cursor=args.get('cursor'), limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'counts': run_store.diagnostic_counts(conn, run_id), 'diagnostics': items,
+                    'total': total, 'next_cursor': next_cursor})
+
+@app.route('/api/runs/<run_id>/scenarios', methods=['POST'])
+@login_required
+def run_scenarios(run_id):
+    """What-if扫描：{"scenarios": [{"lead_time_days": 45, ...}, ...]} → 场景×指标对比矩阵"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT r.params_json, rr.summary_json, rr.ads_json FROM runs r "
+                "JOIN run_results rr ON rr.run_id = r.id WHERE r.id = ? AND r.user_id = ?",
+                (run_id, session['user_id']))
+    row = cur.fetchone()
+    if not row:
+        return jsonify({'error': '记录不存在'}), 404
+    
+    try:
+        grid = scenarios.scenario_grid(json.loads(row['params_json'] or '{}'), (request.json or {}).get('scenarios'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    tables = run_store.load_columns(conn, run_id, ('skus', 'inventory', 'roles'),
+                                    scenarios.SKU_FIELDS + ('cat', 'demandRate') + scenarios.ROLE_FIELDS)
+    n, columns = tables.get('skus', (0, {}))
+    _, inventory = tables.get('inventory', (0, {}))
+    columns = {**{k: columns.get(k, [0] * n) for k in scenarios.SKU_FIELDS}, 'cat': columns.get('cat', [None] * n),
+               # 旧run没有平滑后的日均，按本期日均
+               'demandRate': inventory.get('demandRate') or columns.get('du', [0] * n)}
+    roles = tables['roles'][1] if 'roles' in tables else None
+    result = scenarios.run_scenarios(json.loads(row['summary_json']), json.loads(row['ads_json']), columns, grid, roles)
+    return jsonify({'success': True, 'scenarios': grid, **result})
+
+# ==================== Roles API ====================
+@app.route('/api/roles')
+@login_required
+def get_roles():
+    from data_processor import SKU_ROLE_CONFIG
+    return jsonify({'success': True, 'roles': roles.get_roles(get_db(), session['user_id']),
+                    'config': SKU_ROLE_CONFIG, 'default': roles.DEFAULT_ROLE})
+
+@app.route('/api/roles', methods=['PUT'])
+@login_required
+def set_roles():
+    """批量设置 {"SKU-001": "traffic", ...}，设为profit即恢复默认；新角色在下次上传或 PATCH params 时生效"""
+    data = request.json or {}
+    if not isinstance(data, dict) or not all(isinstance(k, str) for k in data):
+        return jsonify({'error': '格式应为 {sku: role}'}), 400
+    try:
+        transaction(get_db(), roles.set_roles, session['user_id'], data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'roles': roles.get_roles(get_db(), session['user_id'])})
+
+# ==================== Inventory API ====================
+@app.route('/api/inventory/lead-times')
+@login_required
+def get_lead_times():
+    return jsonify({'success': True, 'lead_times': replenishment.get_lead_times(get_db(), session['user_id'])})
+
+@app.route('/api/inventory/lead-times', methods=['PUT'])
+@login_required
+def set_lead_times():
+    """按类目覆盖头程 {"CatA": 60, "CatB": null}，null即恢复默认；在下次上传或 PATCH params 时生效"""
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': '格式应为 {类目: 天数}'}), 400
+    try:
+        transaction(get_db(), replenishment.set_lead_times, session['user_id'], data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'lead_times': replenishment.get_lead_times(get_db(), session['user_id'])})
+
+# ==================== Trends API ====================
+@app.route('/api/skus/<path:sku>/history')
+@login_required
+def sku_history(sku):
+    limit = request.args.get('limit', type=int)
+    return jsonify({'success': True, 'sku': sku,
+                    'series': trends.sku_history(get_db(), session['user_id'], sku, limit)})
+
+@app.route('/api/skus/<path:sku>/runs')
+@login_required
+def sku_runs(sku):
+    """单个SKU在最近N个run (含派生/批量run) 中的关键指标 (?limit=，默认12)，走逐SKU行表索引"""
+    limit = min(max(request.args.get('limit', run_store.SKU_RUNS_LIMIT, type=int), 1), 200)
+    return jsonify({'success': True, 'sku': sku, 'runs': run_store.sku_runs(get_db(), session['user_id'], sku, limit)})
+
+@app.route('/api/trends/portfolio')
+@login_required
+def portfolio_trend():
+    limit = request.args.get('limit', type=int)
+    return jsonify({'success': True, 'series': trends.portfolio_history(get_db(), session['user_id'], limit)})
+
+@app.route('/api/runs/<run_id>', methods=['DELETE'])
+@login_required
+def delete_run(run_id):
+    transaction(get_db(), run_store.delete_run, run_id, session['user_id'])
+    http_cache.RUN_PAYLOAD_CACHE.discard(run_id)
     return jsonify({'success': True})
 
+# ==================== 命令行 ====================
+@app.cli.command('compact-db')
+def compact_db():
+    """执行存储迁移 (旧JSON/宽行表 → 压缩blob) 并VACUUM回收空间"""
+    conn = get_db()
+    before = os.path.getsize(DB_PATH)
+    migrated = transaction(conn, run_store.migrate)
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    print(f"✅ Compacted {migrated} runs: {before / 1e6:.1f}MB → {os.path.getsize(DB_PATH) / 1e6:.1f}MB")
+
+@app.cli.command('verify')
+def verify_db():
+    """全库一致性校验 (按批流式扫描，每个run只解码 rev/op 两列)，有不一致的run时退出码为1"""
+    checked = failed = 0
+    for run_id, result in run_store.verify_all(get_db()):
+        checked += 1
+        if not result['is_consistent']:
+            failed += 1
+            print(f"❌ {run_id}: {result['difference']}")
+    print(f"✅ Verified {checked} runs, {failed} inconsistent")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('bench')
+@click.option('--skus', default=','.join(map(str, benchmark.BENCH_SCALES)), help='SKU规模，逗号分隔')
+@click.option('--ad-rows-per-sku', default=benchmark.BENCH_AD_ROWS_PER_SKU, help='每个SKU的广告行数')
+@click.option('--repeat', default=benchmark.BENCH_REPEAT, help='计时重复次数 (取最小值)')
+@click.option('--seed', default=0, help='合成数据随机种子')
+@click.option('--out', default='bench_report.json', help='JSON报告路径')
+@click.option('--baseline', default=None, help='基线报告；有回退时退出码为1')
+@click.option('--threshold', default=benchmark.REGRESSION_THRESHOLD, help='回退判定比例')
+def bench(skus, ad_rows_per_sku, repeat, seed, out, baseline, threshold):
+    """性能基准：合成工作簿逐阶段计时+内存峰值 (使用临时数据库，不影响现有数据)"""
+    scales = [int(n) for n in skus.split(',')]
+    report = benchmark.run_benchmark(create_tables, scales, ad_rows_per_sku, repeat, seed,
+                                     progress=lambda n: print(f"⏱️  {n} SKUs ..."))
+    benchmark.write_report(report, out)
+    for scale in report['scales']:
+        stages = ' '.join(f"{name}={s['seconds']:.3f}s" for name, s in scale['stages'].items())
+        print(f"✅ {scale['skus']} SKUs / {scale['ad_rows']} ad rows: {scale['total_seconds']:.2f}s "
+              f"peak {scale['peak_mb']}MB ({stages})")
+    print(f"✅ Report written to {out}")
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = benchmark.compare(json.load(f), report, threshold)
+        for r in regressions:
+            print(f"❌ {r['skus']} SKUs {r['stage']} {r['metric']}: {r['baseline']} → {r['current']} (x{r['ratio']})")
+        if regressions:
+            raise SystemExit(1)
+        print(f"✅ No regressions vs {baseline}")
+
+@app.cli.command('apply-roles')
+def apply_roles():
+    """按当前SKU角色批量刷新所有用户的最新run (派生新run，只重算角色/广告计划/诊断)"""
+    conn = get_db()
+    latest = conn.execute("SELECT r.* FROM runs r WHERE r.created_at = (SELECT MAX(created_at) FROM runs "
+                          "WHERE user_id = r.user_id)").fetchall()
+    derived = skipped = 0
+    for run in latest:
+        try:
+            new_run_id, _, _, _ = derive_run(conn, run, {}, run['user_id'])
+        except LookupError:
+            skipped += 1
+            continue
+        derived += new_run_id is not None
+    print(f"✅ Derived {derived} runs, {len(latest) - derived - skipped} unchanged, {skipped} need re-upload")
+
+@app.cli.command('backfill')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--user', 'username', default='demo', help='run归属的用户名')
+@click.option('--days', default=31, help='统计天数')
+@click.option('--lead-time', default=35, help='头程天数')
+@click.option('--workers', default=backfill.BACKFILL_WORKERS, help='进程数 (默认CPU核数)')
+@click.option('--commit-every', default=backfill.BACKFILL_COMMIT_EVERY, help='每个事务落库的run数')
+@click.option('--period', default=None, help='数据所属期 YYYY-MM[-DD] (默认取文件名中的日期，没有则取修改时间)')
+def backfill_runs(paths, username, days, lead_time, workers, commit_every, period):
+    """历史工作簿批量回填：PATHS 为目录/文件/通配符 (通配符需加引号)；同内容文件已入库则跳过，中断后重跑即续传"""
+    if period is not None:
+        try:
+            period = backfill.parse_period(period)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--period')
+    conn = get_db()
+    user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    if not user:
+        raise click.BadParameter(f'用户不存在: {username}', param_hint='--user')
+    files = backfill.find_workbooks(paths)
+    if not files:
+        raise click.UsageError('未找到Excel文件')
+
+    def report(path, run_id, error):
+        print(f"✅ {path} → {run_id}" if error is None else f"❌ {path}: {error}")
+
+    result = backfill.run_backfill(conn, user['id'], files, make_params(conn, user['id'], days, lead_time),
+                                   workers, commit_every, report, period=period)
+    print(f"✅ Backfilled {result['ingested']} runs ({result['batch_id']}), {result['skipped']} already ingested, "
+          f"{len(result['failed'])} failed")
+    if result['failed']:
+        raise SystemExit(1)
+
 # ==================== 启动时初始化数据库 ====================
+# gunicorn --preload 时只在master执行一次 (建表/迁移 + 计算链路预热)，worker fork后继承
 with app.app_context():
     init_db()
+startup.warm_up()
+# 不把master的数据库连接带进fork出的worker
+db.POOL.close_all()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
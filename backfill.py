@@ -0,0 +1,171 @@
+"""
+LGURT Dashboard v5.1 - Backfill
+历史工作簿批量回填 (命令行入口，不经过Web服务)：目录/通配符下的Excel在进程池中并行解析计算并编码结果包，
+主进程按数据所属期 (created_at) 从早到晚按批事务落库；按内容哈希跳过已入库的文件，每批提交即为检查点，
+中断后重跑从未落库的文件继续
+"""
+import glob
+import multiprocessing
+import os
+import re
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import metrics
+from batch import EXCEL_SUFFIXES
+from db import transaction
+from result_cache import file_digest
+
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', os.cpu_count() or 1))
+# 每个事务落库的run数
+BACKFILL_COMMIT_EVERY = int(os.environ.get('BACKFILL_COMMIT_EVERY', 20))
+
+# 文件名中的期：2024-03 / 2024_03_15 / 20240315 等
+PERIOD_PATTERN = re.compile(r'(?<!\d)(20\d{2})[-_.]?(0[1-9]|1[0-2])(?:[-_.]?(0[1-9]|[12]\d|3[01]))?(?!\d)')
+# 与 runs.created_at (CURRENT_TIMESTAMP) 相同的格式
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def find_workbooks(patterns):
+    """目录 (递归) / 文件 / 通配符 → 去重后按路径排序的Excel文件列表"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*')
+        for path in glob.glob(pattern, recursive=True):
+            name = os.path.basename(path)
+            if os.path.isfile(path) and name.lower().endswith(EXCEL_SUFFIXES) and not name.startswith(('.', '~$')):
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def parse_period(text):
+    """--period 参数 (YYYY-MM / YYYY-MM-DD / YYYY-MM-DD HH:MM:SS) → created_at，无法识别时抛ValueError"""
+    for fmt in (TIMESTAMP_FORMAT, '%Y-%m-%d', '%Y-%m'):
+        try:
+            return datetime.strptime(text, fmt).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f'无法识别的日期: {text} (应为 YYYY-MM 或 YYYY-MM-DD)')
+
+
+def file_period(path):
+    """文件的数据所属期 → created_at：取文件名中的日期 (只有年月时为当月1日)，没有时取文件修改时间 (UTC)"""
+    match = PERIOD_PATTERN.search(os.path.basename(path))
+    if match:
+        year, month, day = match.groups()
+        try:
+            return datetime(int(year), int(month), int(day or 1)).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def pending_files(conn, user_id, paths):
+    """
+    → ([(路径, 内容哈希)], 跳过数)
+    已有同内容run (runs.source_hash，含此前中断的回填已提交的部分) 的文件、本次列表中内容重复的文件跳过
+    """
+    seen = {r[0] for r in conn.execute('SELECT DISTINCT source_hash FROM runs WHERE user_id = ? '
+                                       'AND source_hash IS NOT NULL', (user_id,))}
+    pending = []
+    for path in paths:
+        digest = file_digest(path)
+        if digest not in seen:
+            seen.add(digest)
+            pending.append((path, digest))
+    return pending, len(paths) - len(pending)
+
+
+def run_backfill(conn, user_id, paths, params, workers=BACKFILL_WORKERS, commit_every=BACKFILL_COMMIT_EVERY,
+                 report=None, executor=None, period=None):
+    """
+    回填：待处理文件按所属期 (period 给出时全部取该值，否则见 file_period) 从早到晚提交到进程池
+    (在途数限制为2倍进程数，控制内存)，按提交顺序收集结果，每 commit_every 个run一个事务落库；
+    中断 (Ctrl-C) 时已算完的文件先落库再退出
+    report(路径, run_id, 错误) 在每个文件落库或失败后回调
+    返回 {'batch_id', 'total', 'skipped', 'ingested', 'failed': [(路径, 错误)]}
+    """
+    report = report or (lambda path, run_id, error: None)
+    pending, skipped = pending_files(conn, user_id, paths)
+    pending = sorted((period or file_period(path), path) for path, _ in pending)
+    batch_id = 'backfill_' + uuid.uuid4().hex[:12]
+    result = {'batch_id': batch_id, 'total': len(paths), 'skipped': skipped, 'ingested': 0, 'failed': []}
+    done = []
+
+    def commit():
+        if not done:
+            return
+        run_ids = transaction(conn, save_runs, user_id, params, batch_id, done)
+        for (path, _, _, _), run_id in zip(done, run_ids):
+            report(path, run_id, None)
+        result['ingested'] += len(done)
+        done.clear()
+
+    def collect(path, created_at, future):
+        try:
+            bundle, blob = future.result()
+        except Exception as e:
+            result['failed'].append((path, str(e)))
+            report(path, None, str(e))
+            return
+        done.append((path, created_at, bundle, blob))
+        if len(done) >= commit_every:
+            commit()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    inflight = deque()
+    try:
+        for created_at, path in pending:
+            inflight.append((path, created_at, executor.submit(process_file, path, params)))
+            if len(inflight) >= workers * 2:
+                collect(*inflight.popleft())
+        while inflight:
+            collect(*inflight.popleft())
+    finally:
+        commit()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return result
+
+
+def save_runs(conn, user_id, params, batch_id, done):
+    """
+    一批计算结果按期落库 (调用方负责commit)，返回各自的run_id
+    历史日均取该期之前的run (含本次回填中更早的期：同一连接可见未提交的写入)，有历史时只重算库存/诊断并重新编码
+    """
+    from data_processor import ALGO_VERSION
+    from pipeline import rerun_with_params
+    from replenishment import demand_prior
+    from run_store import save_run
+
+    run_ids = []
+    for path, created_at, bundle, blob in done:
+        demand = demand_prior(conn, user_id, before=created_at)
+        if demand:
+            stored = bundle
+            bundle, _ = rerun_with_params(stored['source_hash'], params, params,
+                                          lambda names: {n: stored[n] for n in names}, demand=demand, old_demand={})
+            blob = None
+        run_id = 'run_' + uuid.uuid4().hex[:12]
+        save_run(conn, run_id, user_id, os.path.basename(path), params, bundle, ALGO_VERSION, batch_id=batch_id,
+                 blob=blob, created_at=created_at)
+        run_ids.append(run_id)
+    return run_ids
+
+
+# ==================== 进程池内执行 ====================
+def process_file(path, params):
+    """在工作进程中执行：run_pipeline (不含历史日均，落库时按期补算) → 列式编码，返回 (ResultBundle, blob)"""
+    from pipeline import run_pipeline
+    from run_store import encode_bundle
+
+    try:
+        bundle = run_pipeline(path, params, demand={})
+        return bundle, encode_bundle(bundle)
+    finally:
+        metrics.flush()
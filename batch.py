@@ -0,0 +1,188 @@
+"""
+LGURT Dashboard v5.1 - Batch Upload
+多店铺/站点批量上传：请求内只保存文件并写入任务队列，N个Excel (或zip) 在任务进程池中并行解析计算，
+每个文件落库一个run，再合并为一个组合run；总耗时约等于最慢的单个文件
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import zipfile
+
+import jobs
+import metrics
+import trends
+from db import connect, transaction
+from jobs import JOB_UPLOAD_DIR
+
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 50))
+# zip解压后的总大小上限
+MAX_BATCH_BYTES = int(os.environ.get('MAX_BATCH_MB', 500)) * 1024 * 1024
+# 批量上传的请求体上限 (其余请求为 MAX_UPLOAD_MB)
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get('MAX_BATCH_UPLOAD_MB', 500)) * 1024 * 1024
+
+EXCEL_SUFFIXES = ('.xlsx', '.xls')
+# 任务目录中的文件清单 [(文件名, 路径)]，重启后恢复任务时使用
+MANIFEST = 'files.json'
+
+
+def save_uploads(files, dest_dir):
+    """
+    上传的文件 (Excel或zip) 保存到 dest_dir，zip内的Excel逐个解出
+    返回 [(文件名, 路径)]，文件类型/数量/大小不合法时抛ValueError
+    """
+    saved = []
+
+    def target(name):
+        if len(saved) >= MAX_BATCH_FILES:
+            raise ValueError(f'单批最多{MAX_BATCH_FILES}个文件')
+        path = os.path.join(dest_dir, f'{len(saved):03d}{os.path.splitext(name)[1]}')
+        saved.append((name, path))
+        return path
+
+    for file in files:
+        name = file.filename or ''
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as zf:
+                members = [m for m in zf.infolist() if not m.is_dir() and m.filename.lower().endswith(EXCEL_SUFFIXES)
+                           and not os.path.basename(m.filename).startswith(('.', '~$'))
+                           and not m.filename.startswith('__MACOSX/')]
+                if sum(m.file_size for m in members) > MAX_BATCH_BYTES:
+                    raise ValueError('zip解压后超过大小上限')
+                for member in members:
+                    with zf.open(member) as src, open(target(os.path.basename(member.filename)), 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+        elif name.lower().endswith(EXCEL_SUFFIXES):
+            file.save(target(name))
+        else:
+            raise ValueError(f'仅支持Excel或zip文件: {name}')
+
+    if not saved:
+        raise ValueError('未上传Excel文件')
+    return saved
+
+
+def submit_batch(conn, db_path, user_id, files, params):
+    """
+    保存/校验上传的文件并写入任务队列 (jobs.batch_id)，启动协调线程后返回 (job_id, batch_id)
+    文件类型/数量/大小不合法时抛ValueError
+    """
+    batch_id = 'batch_' + uuid.uuid4().hex[:12]
+    job_id = 'job_' + uuid.uuid4().hex[:12]
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=batch_id, dir=JOB_UPLOAD_DIR)
+    try:
+        uploads = save_uploads(files, work_dir)
+        with open(os.path.join(work_dir, MANIFEST), 'w') as f:
+            json.dump(uploads, f)
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    transaction(conn, lambda c: c.execute(
+        'INSERT INTO jobs (id, user_id, file_name, file_path, params_json, batch_id) VALUES (?, ?, ?, ?, ?, ?)',
+        (job_id, user_id, f'批量上传 ({len(uploads)}个文件)', work_dir, json.dumps(params), batch_id)))
+    start_batch(db_path, job_id)
+    return job_id, batch_id
+
+
+def start_batch(db_path, job_id):
+    """协调线程：等待各文件的计算结果再合并 (只占一个线程，计算在任务进程池中)"""
+    threading.Thread(target=run_batch, args=(db_path, job_id), daemon=True, name=job_id).start()
+
+
+def run_batch(db_path, job_id, executor=None):
+    """
+    执行批量任务：认领 → 各文件提交到任务进程池并各自落库 → 成功的文件 (≥2个) 合并落库为组合run → 回写状态
+    任务结果 {'batch_id', 'runs': [{'file_name', 'run_id'} 或 {'file_name', 'error'}], 'portfolio_run_id', 'summary'}
+    写入 jobs.result_json，run_id 为组合run (只有一个文件成功时为该文件的run)；全部失败时任务为failed
+    """
+    conn = connect(db_path)
+    job = jobs.claim_job(conn, job_id)
+    if job is None:
+        conn.close()
+        return None
+    try:
+        result = process_batch(conn, db_path, job, executor or jobs.get_executor(db_path))
+        if not any('run_id' in r for r in result['runs']):
+            jobs.fail_job(conn, job_id, '全部文件处理失败', result)
+            return result
+        run_id = result['portfolio_run_id'] or next(r['run_id'] for r in result['runs'] if 'run_id' in r)
+        transaction(conn, lambda c: c.execute(
+            "UPDATE jobs SET status = 'done', stage = NULL, progress = 1, run_id = ?, result_json = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?", (run_id, json.dumps(result), job_id)))
+        return result
+    except Exception as e:
+        metrics.report_error('batch', f"Batch job {job_id} failed: {e}", exc_info=True)
+        jobs.fail_job(conn, job_id, str(e))
+        return None
+    finally:
+        conn.close()
+        shutil.rmtree(job['file_path'], ignore_errors=True)
+
+
+def process_batch(conn, db_path, job, executor):
+    """各文件并行计算落库并回写进度，再合并组合run，返回任务结果"""
+    from data_processor import ALGO_VERSION
+    from pipeline import run_portfolio
+    from replenishment import demand_prior, demand_rates
+    from run_store import save_run
+
+    user_id, batch_id, params = job['user_id'], job['batch_id'], json.loads(job['params_json'])
+    with open(os.path.join(job['file_path'], MANIFEST)) as f:
+        uploads = json.load(f)
+    # 历史日均在提交前取一次，同批文件互不影响
+    demand = demand_prior(conn, user_id)
+    futures = [executor.submit(process_file, db_path, user_id, path, name, params, batch_id, demand)
+               for name, path in uploads]
+
+    runs, parts = [], []
+    for i, ((name, _), future) in enumerate(zip(uploads, futures)):
+        try:
+            part = future.result()
+        except Exception as e:
+            runs.append({'file_name': name, 'error': str(e)})
+        else:
+            runs.append({'file_name': name, 'run_id': part['run_id']})
+            parts.append(part)
+        jobs.update_progress(conn, job['id'], 'files', round((i + 1) / (len(uploads) + 1), 2))
+
+    result = {'batch_id': batch_id, 'runs': runs, 'portfolio_run_id': None,
+              'summary': parts[0]['summary'] if len(parts) == 1 else None}
+    if len(parts) > 1:
+        jobs.update_progress(conn, job['id'], 'portfolio', round(len(uploads) / (len(uploads) + 1), 2))
+        bundle = run_portfolio(parts, params, demand=demand)
+        run_id = 'run_' + uuid.uuid4().hex[:12]
+        transaction(conn, save_run, run_id, user_id, f'组合汇总 ({len(parts)}个文件)', params, bundle, ALGO_VERSION,
+                    batch_id=batch_id)
+        result.update({'portfolio_run_id': run_id, 'summary': bundle['summary']})
+    elif parts:
+        # 只有一个文件成功时没有组合run，由该文件的run代表本期
+        part = parts[0]
+        rates = demand_rates(part['skus'], demand).tolist()
+        transaction(conn, lambda c: trends.record_run(c.cursor(), part['run_id'], user_id, part['summary'], part['skus'],
+                                                      rates))
+    return result
+
+
+# ==================== 进程池内执行 ====================
+def process_file(db_path, user_id, path, file_name, params, batch_id, demand=None):
+    """在工作进程中执行：run_pipeline → 落库，返回组合run需要的 run_id/source_hash/summary/skus"""
+    from data_processor import ALGO_VERSION
+    from pipeline import run_pipeline
+    from run_store import save_run
+
+    bundle = run_pipeline(path, params, demand=demand)
+    run_id = 'run_' + uuid.uuid4().hex[:12]
+    conn = connect(db_path)
+    try:
+        # 趋势点由组合run写入
+        transaction(conn, save_run, run_id, user_id, file_name, params, bundle, ALGO_VERSION, batch_id=batch_id,
+                    trend=False)
+    finally:
+        conn.close()
+        metrics.flush()
+    return {'run_id': run_id, 'source_hash': bundle['source_hash'], 'summary': bundle['summary'],
+            'skus': bundle['skus']}
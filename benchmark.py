@@ -0,0 +1,274 @@
+"""
+LGURT Dashboard v5.1 - Benchmark
+性能基准：按 SHEET_LAYOUT 生成指定规模的合成工作簿，逐阶段计时
+(解析 → 聚合 → 角色 → 广告计划 → 库存 → 诊断 → 落库 → 回放读取) 并记录内存峰值，
+输出可在版本间diff的JSON报告
+"""
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from flask import current_app
+from openpyxl import Workbook
+
+import http_cache
+import pipeline
+import run_store
+from data_processor import ALGO_VERSION
+from db import connect
+from excel_reader import SHEET_LAYOUT
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_SCALES = tuple(int(n) for n in os.environ.get('BENCH_SCALES', '1000,10000').split(','))
+# 每个SKU的广告行数 (关键词/投放粒度)
+BENCH_AD_ROWS_PER_SKU = int(os.environ.get('BENCH_AD_ROWS_PER_SKU', 5))
+BENCH_REPEAT = int(os.environ.get('BENCH_REPEAT', 3))
+# 与基线比较：耗时/内存增长超过该比例，且超过绝对下限时视为回退
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_SECONDS = 0.05
+REGRESSION_MIN_MB = 1.0
+
+# 计时阶段 (pipeline各阶段 + 落库 + 回放)
+STAGES = tuple(stage.name for stage in pipeline.PIPELINE) + ('store', 'read')
+BENCH_PARAMS = {
+    'days': 31,
+    'lead_time_days': 35,
+    'safety_days': 30,
+    'target_cover_days': 90,
+    'low_stock_threshold': 7,
+    'overstock_threshold': 120,
+    'sku_roles': {},
+    'category_lead_times': {}
+}
+BENCH_USER_ID = 0
+CATEGORIES = ('Kitchen', 'Home', 'Outdoor', 'Pet', 'Toys', 'Beauty')
+
+
+# ==================== 合成工作簿 ====================
+def write_workbook(path, n_skus, ad_rows=None, seed=0):
+    """
+    生成与上传格式一致的工作簿 (各sheet表头行数/列位置取自 SHEET_LAYOUT)
+    数据覆盖盈利/亏损、广告零归因、低库存/积压、无主数据/无库存等情况，同一seed结果相同
+    """
+    rng = random.Random(seed)
+    ad_rows = n_skus * BENCH_AD_ROWS_PER_SKU if ad_rows is None else ad_rows
+    skus = [f'BM-{i:06d}' for i in range(n_skus)]
+    asins = [f'B0{i:08d}' for i in range(n_skus)]
+    # 约5%的SKU本期无销量 (聚合时被过滤)，其余长尾/主力各半
+    units = [0 if rng.random() < 0.05 else rng.choice((rng.randint(1, 20), rng.randint(20, 600)))
+             for _ in range(n_skus)]
+    price = [round(rng.uniform(8, 80), 2) for _ in range(n_skus)]
+
+    wb = Workbook(write_only=True)
+
+    def sheet(name):
+        skip, cols = SHEET_LAYOUT[name]
+        ws = wb.create_sheet(name)
+        width = max(cols) + 1
+        for i in range(skip):
+            ws.append([f'{name} 说明 {i + 1}'] + [None] * (width - 1))
+        return ws, width
+
+    def row(width, values):
+        cells = [None] * width
+        for idx, value in values.items():
+            cells[idx] = value
+        return cells
+
+    ws, width = sheet('sales_data')
+    for i, sku in enumerate(skus):
+        rev = round(units[i] * price[i], 2)
+        ws.append(row(width, {1: asins[i], 2: sku, 5: units[i], 6: rev, 8: -round(rev * 0.15, 2),
+                              9: round(rev * rng.uniform(0, 0.05), 2), 10: round(units[i] * rng.uniform(3, 8), 2)}))
+
+    ws, width = sheet('sku_master')
+    for i, sku in enumerate(skus):
+        if rng.random() < 0.03:
+            continue
+        ws.append(row(width, {0: sku, 2: f'Product {i}', 3: rng.choice(CATEGORIES),
+                              4: round(price[i] * rng.uniform(0.15, 0.45), 2), 5: round(rng.uniform(0.3, 3), 2)}))
+
+    ws, width = sheet('ad_data')
+    for _ in range(ad_rows):
+        i = rng.randrange(n_skus)
+        spend = round(rng.uniform(0, 40), 2)
+        clk = rng.randint(0, 200)
+        sales = round(rng.choice((0, spend * rng.uniform(0.5, 6))), 2)
+        # 约1/5的行只有ASIN (按ASIN前缀归属)
+        ws.append(row(width, {1: asins[i] + rng.choice(('', '-US')), 2: skus[i] if rng.random() > 0.2 else None,
+                              4: sales, 7: clk * rng.randint(20, 200), 8: clk, 10: spend}))
+
+    ws, width = sheet('inventory_data')
+    for i, sku in enumerate(skus):
+        if rng.random() < 0.05:
+            continue
+        daily = units[i] / BENCH_PARAMS['days']
+        ful = int(daily * rng.choice((rng.uniform(0, 10), rng.uniform(10, 90), rng.uniform(90, 400))))
+        ws.append(row(width, {1: sku, 5: ful, 6: rng.choice((0, int(daily * 30))), 7: rng.randint(0, 20)}))
+
+    ws, width = sheet('fixed_costs')
+    for month in range(1, 4):
+        ws.append(row(width, {0: f'2026-{month:02d}', 1: 8000, 2: 3000, 3: 500, 4: 200, 5: 100}))
+
+    wb.save(path)
+    return path
+
+
+# ==================== 计时 ====================
+def run_stages(path, conn, on_stage):
+    """
+    执行一遍全部阶段 (不经过结果缓存)；on_stage(阶段名, 执行函数) 负责计时/测内存
+    返回落库的run_id
+    """
+    values = pipeline.run_stages({'source': path, 'demand': {}}, BENCH_PARAMS, on_stage)
+
+    run_id = f'bench_{datetime.now(timezone.utc):%H%M%S}_{os.urandom(3).hex()}'
+
+    def store():
+        run_store.save_run(conn, run_id, BENCH_USER_ID, os.path.basename(path), BENCH_PARAMS, values, ALGO_VERSION)
+        conn.commit()
+
+    def read():
+        run = conn.execute("SELECT checksum_rev, checksum_op FROM runs WHERE id = ?", (run_id,)).fetchone()
+        payload = {'success': True, 'result': run_store.load_run(conn, run_id, run)}
+        return http_cache.encode_body(current_app.json.dumps(payload).encode())
+
+    on_stage('store', store)
+    on_stage('read', read)
+    return run_id
+
+
+def timed(name, fn, times):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    times.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def traced(name, fn, peaks):
+    """阶段内Python/numpy分配的内存峰值 (tracemalloc会拖慢执行，与计时分开跑)"""
+    gc.collect()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peaks[name] = tracemalloc.get_traced_memory()[1] - base
+    return result
+
+
+def bench_scale(conn, work_dir, n_skus, ad_rows, repeat, seed):
+    """单个规模：生成工作簿 → repeat次计时 (取最小值与中位数) → 1次内存追踪"""
+    path = write_workbook(os.path.join(work_dir, f'bench_{n_skus}.xlsx'), n_skus, ad_rows, seed)
+    times = {}
+    for _ in range(repeat):
+        run_stages(path, conn, lambda name, fn: timed(name, fn, times))
+
+    peaks = {}
+    tracemalloc.start()
+    try:
+        run_stages(path, conn, lambda name, fn: traced(name, fn, peaks))
+    finally:
+        tracemalloc.stop()
+
+    stages = {name: {
+        'seconds': round(min(times[name]), 4),
+        'median_seconds': round(statistics.median(times[name]), 4),
+        'peak_mb': round(peaks[name] / 1e6, 2)
+    } for name in STAGES}
+    total = sum(s['seconds'] for s in stages.values())
+    return {
+        'skus': n_skus,
+        'ad_rows': ad_rows,
+        'workbook_bytes': os.path.getsize(path),
+        'stages': stages,
+        'total_seconds': round(total, 4),
+        'skus_per_second': round(n_skus / total, 1) if total else None,
+        'peak_mb': max(s['peak_mb'] for s in stages.values())
+    }
+
+
+def run_benchmark(create_tables, scales=BENCH_SCALES, ad_rows_per_sku=BENCH_AD_ROWS_PER_SKU, repeat=BENCH_REPEAT,
+                  seed=0, progress=None):
+    """
+    按各规模跑基准，返回JSON报告 (在Flask应用上下文中调用，读取阶段按接口的方式序列化)
+    create_tables(cur): 建表函数；落库/回放使用临时数据库，结束后删除
+    """
+    progress = progress or (lambda n_skus: None)
+    work_dir = tempfile.mkdtemp(prefix='lgurt_bench_')
+    conn = connect(os.path.join(work_dir, 'bench.db'))
+    try:
+        create_tables(conn.cursor())
+        conn.commit()
+        results = []
+        for n_skus in scales:
+            progress(n_skus)
+            results.append(bench_scale(conn, work_dir, n_skus, n_skus * ad_rows_per_sku, repeat, seed))
+    finally:
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'algo_version': ALGO_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'repeat': repeat,
+        'seed': seed,
+        'scales': results,
+        'max_rss_mb': max_rss_mb()
+    }
+
+
+def max_rss_mb():
+    """进程常驻内存峰值 (Windows没有resource模块时为None)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return round(rss / 1e6 if platform.system() == 'Darwin' else rss / 1e3, 1)
+
+
+# ==================== 报告 ====================
+def write_report(report, path):
+    """键排序+缩进写出，便于直接diff"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write('\n')
+
+
+def compare(baseline, report, threshold=REGRESSION_THRESHOLD):
+    """
+    与基线报告逐规模/逐阶段比较耗时 (seconds) 与内存峰值 (peak_mb)
+    返回回退列表 [{'skus', 'ad_rows', 'stage', 'metric', 'baseline', 'current', 'ratio'}]
+    """
+    floors = {'seconds': REGRESSION_MIN_SECONDS, 'peak_mb': REGRESSION_MIN_MB}
+    previous = {(s['skus'], s['ad_rows']): s['stages'] for s in baseline.get('scales', [])}
+    regressions = []
+    for scale in report['scales']:
+        before = previous.get((scale['skus'], scale['ad_rows']))
+        if before is None:
+            continue
+        for stage, current in scale['stages'].items():
+            for metric, floor in floors.items():
+                old, new = before.get(stage, {}).get(metric), current[metric]
+                if old is None or new - old <= floor or new <= old * (1 + threshold):
+                    continue
+                regressions.append({'skus': scale['skus'], 'ad_rows': scale['ad_rows'], 'stage': stage,
+                                    'metric': metric, 'baseline': old, 'current': new,
+                                    'ratio': round(new / old, 2) if old else None})
+    return regressions
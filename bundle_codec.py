@@ -0,0 +1,214 @@
+"""
+LGURT Dashboard v5.1 - Bundle Codec
+ResultBundle的列式二进制存储格式：每个字段一列，数值列按字节重排后整体压缩
+
+格式: MAGIC(4) | 格式版本(1) | 压缩算法(1) | 保留(2) | 压缩后的payload
+payload: meta长度(4) | meta JSON | 各列数据依次拼接
+完整性由压缩层校验：zlib自带adler32，zstd帧写入校验和 (早期未写校验和的zstd记录照常读取)
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+import sku_table
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'LGRB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sBBH')
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 6
+
+
+def encode(tables):
+    """{表名: 记录列表或SkuTable} → bytes"""
+    meta = {}
+    buffers = []
+    seen = {}
+    for name, records in tables.items():
+        columns = []
+        keys = list(records[0].keys()) if records else []
+        for key in keys:
+            values = sku_table.values(records, key)
+            # 与前面表中同名列完全相同 (如各表的sku列) 时只存引用
+            if key in seen and seen[key][1] == values:
+                kind, data = 'ref', seen[key][0].encode()
+            else:
+                kind, data = encode_column(values)
+                seen.setdefault(key, (name, values))
+            columns.append([key, kind, len(data)])
+            buffers.append(data)
+        meta[name] = {'n': len(records), 'columns': columns}
+
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode()
+    payload = b''.join([struct.pack('>I', len(meta_bytes)), meta_bytes] + buffers)
+    if zstandard is not None:
+        codec, body = CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL, write_checksum=True).compress(payload)
+    else:
+        codec, body = CODEC_ZLIB, zlib.compress(payload, ZLIB_LEVEL)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, codec, 0) + body
+
+
+def decode_columns(blob, names=None, keys=None):
+    """
+    bytes → {表名: (记录数, {字段: 值列表})}，字段顺序与写入一致
+    names: 只解码指定的表；keys: 只解码指定的字段
+    """
+    if len(blob) < HEADER.size:
+        raise ValueError('不是ResultBundle数据')
+    magic, version, codec, _ = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError('不是ResultBundle数据')
+    if not 1 <= version <= FORMAT_VERSION:
+        raise ValueError(f'不支持的存储格式版本: {version}')
+    payload = decompress(codec, memoryview(blob)[HEADER.size:])
+
+    meta_len = struct.unpack_from('>I', payload)[0]
+    meta = json.loads(payload[4:4 + meta_len])
+    offset = 4 + meta_len
+    slices = {}
+    for name, info in meta.items():
+        for key, kind, size in info['columns']:
+            slices[name, key] = (kind, offset, size, info['n'])
+            offset += size
+
+    decoded = {}
+
+    def column(name, key):
+        if (name, key) not in decoded:
+            kind, start, size, n = slices[name, key]
+            data = payload[start:start + size]
+            if kind == 'ref':
+                decoded[name, key] = column(bytes(data).decode(), key)
+            else:
+                decoded[name, key] = decode_column(kind, data, n)
+        return decoded[name, key]
+
+    return {name: (info['n'], {key: column(name, key) for key, _, _ in info['columns'] if keys is None or key in keys})
+            for name, info in meta.items() if names is None or name in names}
+
+
+def decompress(codec, body):
+    """按头部的压缩算法解压，校验失败 (数据损坏) 或算法未知时抛ValueError"""
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError('读取该记录需要安装 zstandard')
+        try:
+            return zstandard.ZstdDecompressor().decompress(body)
+        except zstandard.ZstdError as e:
+            raise ValueError(f'ResultBundle数据已损坏: {e}')
+    if codec == CODEC_ZLIB:
+        try:
+            return zlib.decompress(body)
+        except zlib.error as e:
+            raise ValueError(f'ResultBundle数据已损坏: {e}')
+    raise ValueError(f'不支持的压缩算法: {codec}')
+
+
+def decode(blob, names=None):
+    """bytes → {表名: 记录列表}"""
+    return {name: columns_to_records(n, columns) for name, (n, columns) in decode_columns(blob, names).items()}
+
+
+def columns_to_records(n, columns):
+    keys = list(columns)
+    if not keys:
+        return [{} for _ in range(n)]
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+# ==================== 列编码 ====================
+# 定点列的空值标记
+NULL_INT = np.iinfo(np.int64).min
+MAX_SCALE = 6
+NUMBER_TYPES = {int, float, type(None)}
+
+
+def encode_column(values):
+    """按值类型选择编码：d<k>定点 / f8 / bool / json (文本与嵌套结构)"""
+    types = set(map(type, values))
+    if types == {bool}:
+        return 'bool', bytes(values)
+    if types and types <= NUMBER_TYPES:
+        encoded = encode_number(values)
+        if encoded is not None:
+            return encoded
+    return 'json', json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def encode_number(values):
+    """
+    数值列：round(x, k) 得到的浮点数可由 整数/10^k 精确还原，存为定点int64；否则存原始float64
+    两种情况都按字节重排 (同一字节位连续存放)，利于压缩
+    列中含int时类型后缀'i'，并在末尾附加int位置的位图，解码后保持int/float原样
+    含NaN或超出float64精确整数范围时返回None (改用json)
+    """
+    arr = np.array([np.nan if v is None else v for v in values], dtype='<f8')
+    nulls = np.isnan(arr)
+    finite = arr[~nulls]
+    if len(finite) and np.abs(finite).max() >= 2 ** 53:
+        return None
+    if nulls.sum() != values.count(None):
+        return None
+    suffix, mask = '', b''
+    if int in set(map(type, values)):
+        suffix, mask = 'i', np.packbits([type(v) is int for v in values]).tobytes()
+
+    # 定点无法表示-0.0，含-0.0时直接存float64
+    scales = range(MAX_SCALE + 1) if not (np.signbit(finite) & (finite == 0)).any() else ()
+    for k in scales:
+        scaled = np.round(finite * 10 ** k)
+        if len(finite) and np.abs(scaled).max() >= 2 ** 53:
+            break
+        if np.array_equal(scaled / 10 ** k, finite):
+            ints = np.full(len(arr), NULL_INT, dtype='<i8')
+            ints[~nulls] = scaled.astype(np.int64)
+            return f'd{k}{suffix}', shuffle(ints) + mask
+    return f'f8{suffix}', shuffle(arr) + mask
+
+
+def shuffle(arr):
+    return arr.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def unshuffle(data, n, dtype):
+    return np.frombuffer(bytes(data), dtype=np.uint8).reshape(8, n).T.copy().view(dtype).ravel()
+
+
+def decode_column(kind, data, n):
+    if kind == 'bool':
+        return [b != 0 for b in data]
+    if kind[0] in 'fd':
+        int_mask = None
+        if kind.endswith('i'):
+            kind = kind[:-1]
+            int_mask = np.unpackbits(np.frombuffer(bytes(data[8 * n:]), dtype=np.uint8), count=n).astype(bool)
+            data = data[:8 * n]
+        if kind == 'f8':
+            arr = unshuffle(data, n, '<f8')
+            nulls = np.isnan(arr)
+        else:
+            ints = unshuffle(data, n, '<i8')
+            nulls = ints == NULL_INT
+            arr = ints.astype(np.float64) / 10 ** int(kind[1:])
+        values = arr.tolist()
+        if int_mask is not None:
+            for i in np.flatnonzero(int_mask).tolist():
+                values[i] = int(values[i])
+        if nulls.any():
+            for i in np.flatnonzero(nulls).tolist():
+                values[i] = None
+        return values
+    if kind == 'json':
+        return json.loads(bytes(data))
+    raise ValueError(f'未知列类型: {kind}')
@@ -2,8 +2,12 @@
 LGURT Dashboard v5.1 - Data Processor
 Excel处理 + 计算逻辑 + Phase1/Phase2生成 + 诊断生成
 """
+import numpy as np
 import pandas as pd
-from io import BytesIO
+
+import sku_table
+from excel_reader import read_workbook
+from sku_table import SkuTable
 
 ALGO_VERSION = 'v5.1'
 
@@ -15,179 +19,81 @@ SKU_ROLE_CONFIG = {
     'test': {'name': '测试款', 'allowedLoss': -0.30, 'stopLoss': -0.50, 'windowWeeks': 8}
 }
 
+# ==================== Phase1浪费规则配置 ====================
+# 规则按顺序判定，同一SKU只取第一条命中的规则
+AD_WASTE_RULES = {
+    'zeroAttributionMinSpend': 30,   # 1) 高花费零归因：花费下限
+    'highAcos': 3.0,                 # 2) ACOS极高：ACOS阈值
+    'highAcosMinSpend': 20,          #    花费下限
+    'overspendMarginMultiple': 2,    # 3) 广告占比 > 毛利率×倍数
+    'overspendMinSpend': 30          #    花费下限
+}
+
 def process_excel_file(file, params):
     """
     处理上传的Excel文件，返回计算结果
     """
+    # 流式读取各sheet (只读模式，仅取用到的列)
+    return process_frames(read_workbook(file), params)
+
+
+def process_frames(frames, params):
+    """
+    基于已解析的sheet计算SKU明细与汇总 (仅依赖 params['days'])
+    """
     days = params.get('days', 31)
     
-    # 读取Excel
-    if hasattr(file, 'read'):
-        content = file.read()
-        file_obj = BytesIO(content)
-    else:
-        file_obj = file
-    
-    xl = pd.ExcelFile(file_obj)
+    sales_df = frames['sales_data']
+    master_df = frames['sku_master']
+    ads_df = frames['ad_data']
+    inv_df = frames['inventory_data']
+    fc_df = frames['fixed_costs']
     
-    # 解析各sheet
-    sales_df = parse_sheet(xl, 'sales_data', skip=19)
-    master_df = parse_sheet(xl, 'sku_master', skip=18)
-    ads_df = parse_sheet(xl, 'ad_data', skip=18)
-    inv_df = parse_sheet(xl, 'inventory_data', skip=15)
-    fc_df = parse_sheet(xl, 'fixed_costs', skip=12)
-    
-    # 构建SKU信息映射
-    sku_info = {}
-    if master_df is not None and len(master_df) > 0:
-        for _, row in master_df.iterrows():
-            sku = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ''
-            if sku:
-                sku_info[sku] = {
-                    'name': str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else sku,
-                    'cat': str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else '未分类',
-                    'cost': safe_float(row.iloc[4]) if len(row) > 4 else 0,
-                    'freight': safe_float(row.iloc[5]) if len(row) > 5 else 0
-                }
-    
-    # 构建广告数据映射
-    ad_by_sku = {}
-    ad_by_asin = {}
-    if ads_df is not None and len(ads_df) > 0:
-        for _, row in ads_df.iterrows():
-            asin = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
-            sku = str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else ''
-            ad = {
-                'spend': safe_float(row.iloc[10]) if len(row) > 10 else 0,
-                'imp': safe_float(row.iloc[7]) if len(row) > 7 else 0,
-                'clk': safe_float(row.iloc[8]) if len(row) > 8 else 0,
-                'sales': safe_float(row.iloc[4]) if len(row) > 4 else 0
-            }
-            if sku:
-                if sku not in ad_by_sku:
-                    ad_by_sku[sku] = {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0}
-                ad_by_sku[sku]['spend'] += ad['spend']
-                ad_by_sku[sku]['imp'] += ad['imp']
-                ad_by_sku[sku]['clk'] += ad['clk']
-                ad_by_sku[sku]['sales'] += ad['sales']
-            elif asin:
-                key = asin.split('-')[0]
-                if key not in ad_by_asin:
-                    ad_by_asin[key] = {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0}
-                ad_by_asin[key]['spend'] += ad['spend']
-                ad_by_asin[key]['imp'] += ad['imp']
-                ad_by_asin[key]['clk'] += ad['clk']
-                ad_by_asin[key]['sales'] += ad['sales']
-    
-    # 构建库存映射
-    inv_by_sku = {}
-    if inv_df is not None and len(inv_df) > 0:
-        for _, row in inv_df.iterrows():
-            sku = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
-            if sku:
-                inv_by_sku[sku] = {
-                    'ful': safe_float(row.iloc[5]) if len(row) > 5 else 0,
-                    'inb': safe_float(row.iloc[6]) if len(row) > 6 else 0,
-                    'rsv': safe_float(row.iloc[7]) if len(row) > 7 else 0
-                }
+    # 构建SKU主数据 / 广告汇总 / 库存映射 (整列计算)
+    sku_info = build_sku_master(master_df)
+    ad_by_sku, ad_by_asin = aggregate_ads(ads_df)
+    inv_by_sku = build_inventory(inv_df)
     
     # 解析固定成本
     mf_monthly = 0
     if fc_df is not None and len(fc_df) > 0:
         last_row = fc_df.iloc[-1]
-        labor = safe_float(last_row.iloc[1]) if len(last_row) > 1 else 0
-        rent = safe_float(last_row.iloc[2]) if len(last_row) > 2 else 0
-        sw = safe_float(last_row.iloc[3]) if len(last_row) > 3 else 0
-        other1 = safe_float(last_row.iloc[4]) if len(last_row) > 4 else 0
-        other2 = safe_float(last_row.iloc[5]) if len(last_row) > 5 else 0
+        labor = safe_float(last_row.get(1))
+        rent = safe_float(last_row.get(2))
+        sw = safe_float(last_row.get(3))
+        other1 = safe_float(last_row.get(4))
+        other2 = safe_float(last_row.get(5))
         mf_monthly = labor + rent + sw + other1 + other2
     
-    mf_daily = mf_monthly / 30
-    mf_period = mf_daily * days
-    
     # 处理销售数据
-    skus = []
-    if sales_df is not None and len(sales_df) > 0:
-        for _, row in sales_df.iterrows():
-            sku = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ''
-            asin = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
-            rev = safe_float(row.iloc[6]) if len(row) > 6 else 0
-            
-            if not sku or rev <= 0:
-                continue
-            
-            info = sku_info.get(sku, {'name': sku, 'cat': '未分类', 'cost': 0, 'freight': 0})
-            units = safe_float(row.iloc[5]) if len(row) > 5 else 0
-            rfm = abs(safe_float(row.iloc[8])) if len(row) > 8 else 0
-            ref = safe_float(row.iloc[9]) if len(row) > 9 else 0
-            fba = safe_float(row.iloc[10]) if len(row) > 10 else 0
-            
-            cogs = info['cost'] * units
-            frt = info['freight'] * units
-            pp = rev - ref - fba - cogs - frt - rfm
-            pm = pp / rev if rev > 0 else 0
-            
-            # 获取广告数据
-            ad = ad_by_sku.get(sku)
-            if not ad:
-                key = asin.split('-')[0] if asin else ''
-                ad = ad_by_asin.get(key, {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0})
-            
-            op = pp - ad['spend']
-            om = op / rev if rev > 0 else 0
-            ar = ad['spend'] / rev if rev > 0 else 0
-            
-            # 获取库存数据
-            iv = inv_by_sku.get(sku, {'ful': 0, 'inb': 0, 'rsv': 0})
-            du = units / days
-            
-            skus.append({
-                'sku': sku,
-                'asin': asin,
-                'name': info['name'],
-                'cat': info['cat'],
-                'units': round(units, 0),
-                'du': round(du, 1),
-                'rev': round(rev, 2),
-                'ref': round(ref, 2),
-                'fba': round(fba, 2),
-                'cogs': round(cogs, 2),
-                'frt': round(frt, 2),
-                'rfmFee': round(rfm, 2),
-                'pp': round(pp, 2),
-                'pm': round(pm, 4),
-                'adSpend': round(ad['spend'], 2),
-                'adImp': ad['imp'],
-                'adClk': ad['clk'],
-                'adSales': round(ad['sales'], 2),
-                'op': round(op, 2),
-                'om': round(om, 4),
-                'ar': round(ar, 4),
-                'acos': round(ad['spend'] / ad['sales'], 4) if ad['sales'] > 0 else 0,
-                'roas': round(ad['sales'] / ad['spend'], 2) if ad['spend'] > 0 else 0,
-                'ful': iv['ful'],
-                'inb': iv['inb'],
-                'rsv': iv['rsv']
-            })
+    skus = build_sku_records(sales_df, sku_info, ad_by_sku, ad_by_asin, inv_by_sku, days)
     
     # 按经营利润排序
-    skus.sort(key=lambda x: x['op'], reverse=True)
+    skus = skus.sorted('op', reverse=True)
     
-    # 计算汇总
+    return {'summary': summarize_skus(skus, days, mf_monthly), 'skus': skus}
+
+
+def summarize_skus(skus, days, mf_monthly):
+    """SKU明细 → 汇总 (固定成本按30天/月折算到统计周期)"""
+    mf_daily = mf_monthly / 30
+    mf_period = mf_daily * days
+    
+    # 按SKU顺序逐个累加 (sum而非np.sum，合计与checksum逐位一致)
     t = {
-        'rev': sum(s['rev'] for s in skus),
-        'units': sum(s['units'] for s in skus),
-        'ref': sum(s['ref'] for s in skus),
-        'fba': sum(s['fba'] for s in skus),
-        'cogs': sum(s['cogs'] for s in skus),
-        'frt': sum(s['frt'] for s in skus),
-        'rfmFee': sum(s['rfmFee'] for s in skus),
-        'pp': sum(s['pp'] for s in skus),
-        'adSpend': sum(s['adSpend'] for s in skus),
-        'op': sum(s['op'] for s in skus),
-        'imp': sum(s['adImp'] for s in skus),
-        'clk': sum(s['adClk'] for s in skus),
-        'adSales': sum(s['adSales'] for s in skus)
+        'rev': sum(sku_table.values(skus, 'rev')),
+        'units': sum(sku_table.values(skus, 'units')),
+        'ref': sum(sku_table.values(skus, 'ref')),
+        'fba': sum(sku_table.values(skus, 'fba')),
+        'cogs': sum(sku_table.values(skus, 'cogs')),
+        'frt': sum(sku_table.values(skus, 'frt')),
+        'rfmFee': sum(sku_table.values(skus, 'rfmFee')),
+        'pp': sum(sku_table.values(skus, 'pp')),
+        'adSpend': sum(sku_table.values(skus, 'adSpend')),
+        'op': sum(sku_table.values(skus, 'op')),
+        'imp': sum(sku_table.values(skus, 'adImp')),
+        'clk': sum(sku_table.values(skus, 'adClk')),
+        'adSales': sum(sku_table.values(skus, 'adSales'))
     }
     
     d_rev = t['rev'] / days if days > 0 else 0
@@ -214,13 +120,265 @@ def process_excel_file(file, params):
         'dailyBreakEven': round(be, 2)
     }
     
-    return {'summary': summary, 'skus': skus}
+    return summary
+
+
+# ==================== 多店铺组合 ====================
+# 合并同SKU时直接相加的字段 (金额/数量/广告量/库存)，比率类字段合并后重算
+PORTFOLIO_SUM_FIELDS = ('units', 'rev', 'ref', 'fba', 'cogs', 'frt', 'rfmFee', 'pp', 'adSpend', 'adImp', 'adClk',
+                        'adSales', 'op', 'ful', 'inb', 'rsv')
+
+
+def merge_portfolio(results, days):
+    """
+    多个店铺/站点的计算结果 [{'summary', 'skus'}] → 组合汇总
+    同SKU各店铺相加后重算比率 (名称/类目取第一个出现的店铺)，固定成本相加，汇总逻辑与单文件一致
+    """
+    mf_monthly = sum(r['summary'].get('mfMonthly', 0) for r in results)
+    rows = SkuTable.concat([SkuTable.from_records(r['skus']) for r in results])
+    if not rows:
+        return {'summary': summarize_skus(rows, days, mf_monthly), 'skus': rows}
+
+    # 只在一个店铺出现的SKU原样保留，重复的SKU才合并重算
+    df = pd.DataFrame({key: rows.values(key) for key in rows.keys()})
+    dup = df['sku'].duplicated(keep=False).to_numpy()
+    skus = rows.take(np.flatnonzero(~dup))
+    if dup.any():
+        grouped = df[dup].groupby('sku', sort=False)
+        merged = grouped[['asin', 'name', 'cat']].first().join(grouped[list(PORTFOLIO_SUM_FIELDS)].sum())
+
+        rev = merged['rev']
+        spend = merged['adSpend']
+        sales_ = merged['adSales']
+        merged['du'] = merged['units'] / days
+        merged['pm'] = merged['pp'] / rev
+        merged['om'] = merged['op'] / rev
+        merged['ar'] = spend / rev
+        merged['acos'] = (spend / sales_).where(sales_ > 0, 0)
+        merged['roas'] = (sales_ / spend).where(spend > 0, 0)
+
+        decimals = {'units': 0, 'du': 1, 'pm': 4, 'om': 4, 'ar': 4, 'acos': 4, 'roas': 2,
+                    **{f: 2 for f in ('rev', 'ref', 'fba', 'cogs', 'frt', 'rfmFee', 'pp', 'adSpend', 'adSales', 'op')}}
+        merged = merged.round(decimals).reset_index()
+        skus = SkuTable.concat([skus, SkuTable.from_columns(len(merged), {k: merged[k].tolist() for k in rows.keys()})])
+
+    skus = skus.sorted('op', reverse=True)
+    return {'summary': summarize_skus(skus, days, mf_monthly), 'skus': skus}
+
+
+# ==================== 列式计算 ====================
+AD_FIELDS = ('spend', 'imp', 'clk', 'sales')
+# 来自库存sheet的SKU字段 (不参与汇总)
+INVENTORY_FIELDS = ('ful', 'inb', 'rsv')
+
+
+def build_sku_master(master_df):
+    """SKU主数据表 (index=sku, 重复SKU以最后一行为准)"""
+    if master_df is None or len(master_df) == 0:
+        return pd.DataFrame(columns=['name', 'cat', 'cost', 'freight'], index=pd.Index([], name='sku'))
+
+    sku = text_col(master_df, 0)
+    info = pd.DataFrame({
+        'sku': sku,
+        'name': text_col(master_df, 2, missing=None),
+        'cat': text_col(master_df, 3, missing='未分类'),
+        'cost': num_col(master_df, 4),
+        'freight': num_col(master_df, 5)
+    })
+    info = info[sku != ''].drop_duplicates('sku', keep='last')
+    info['name'] = info['name'].fillna(info['sku'])
+    return info.set_index('sku')
+
+
+def aggregate_ads(ads_df):
+    """广告汇总：有SKU按SKU汇总，否则按ASIN前缀汇总"""
+    empty = pd.DataFrame(columns=list(AD_FIELDS), dtype=float)
+    if ads_df is None or len(ads_df) == 0:
+        return empty, empty
+
+    asin = text_col(ads_df, 1)
+    sku = text_col(ads_df, 2, strip=True)
+    values = pd.DataFrame({
+        'spend': num_col(ads_df, 10),
+        'imp': num_col(ads_df, 7),
+        'clk': num_col(ads_df, 8),
+        'sales': num_col(ads_df, 4)
+    })
+
+    by_sku = sku != ''
+    by_asin = ~by_sku & (asin != '')
+    ad_by_sku = group_sum(sku[by_sku], values[by_sku])
+    ad_by_asin = group_sum(asin_key(asin[by_asin]), values[by_asin])
+    return ad_by_sku, ad_by_asin
+
+
+def build_inventory(inv_df):
+    """库存表 (index=sku, 重复SKU以最后一行为准，缺失值为NaN)"""
+    if inv_df is None or len(inv_df) == 0:
+        return pd.DataFrame(columns=['ful', 'inb', 'rsv'], index=pd.Index([], name='sku'), dtype=float)
+
+    sku = text_col(inv_df, 1)
+    inv = pd.DataFrame({
+        'sku': sku,
+        'ful': num_col(inv_df, 5),
+        'inb': num_col(inv_df, 6),
+        'rsv': num_col(inv_df, 7)
+    })
+    inv = inv[sku != ''].drop_duplicates('sku', keep='last')
+    return inv.set_index('sku')
+
+
+def replace_inventory(skus, inv_df):
+    """SKU表换用新的库存sheet：只替换库存列 (与完整重算时的取值一致)，其余列与顺序不变"""
+    skus = SkuTable.from_records(skus)
+    if not skus:
+        return skus
+    iv = build_inventory(inv_df).reindex(skus.values('sku'))
+    return SkuTable(len(skus), {**skus.columns, **{k: sku_table.pack(exact(iv[k])) for k in INVENTORY_FIELDS}})
+
+
+def build_sku_records(sales_df, sku_info, ad_by_sku, ad_by_asin, inv_by_sku, days):
+    """销售行 join 主数据/广告/库存，按列计算利润与广告指标，输出 SkuTable"""
+    if sales_df is None or len(sales_df) == 0:
+        return SkuTable(0, {})
+
+    sales = pd.DataFrame({
+        'sku': text_col(sales_df, 2),
+        'asin': text_col(sales_df, 1),
+        'rev': num_col(sales_df, 6),
+        'units': num_col(sales_df, 5),
+        'rfm': num_col(sales_df, 8).abs(),
+        'ref': num_col(sales_df, 9),
+        'fba': num_col(sales_df, 10)
+    })
+    sales = sales[(sales['sku'] != '') & (sales['rev'].fillna(0) > 0)].reset_index(drop=True)
+    if len(sales) == 0:
+        return SkuTable(0, {})
+
+    df = sales.merge(sku_info, how='left', left_on='sku', right_index=True).reset_index(drop=True)
+    df['name'] = df['name'].fillna(df['sku'])
+    df['cat'] = df['cat'].fillna('未分类')
+
+    # 广告：优先SKU匹配，未命中再按ASIN前缀匹配
+    ad = ad_by_sku.reindex(df['sku'])
+    missing = ~df['sku'].isin(ad_by_sku.index).to_numpy()
+    if missing.any():
+        ad.iloc[missing] = ad_by_asin.reindex(asin_key(df['asin'][missing])).to_numpy()
+    ad = ad.reset_index(drop=True)
+
+    iv = inv_by_sku.reindex(df['sku']).reset_index(drop=True)
+
+    # 计算用0代替缺失值；输出时缺失值 (原逐行计算中为int 0) 经 exact() 还原
+    rev = df['rev']
+    units = df['units'].fillna(0)
+    ref = df['ref'].fillna(0)
+    fba = df['fba'].fillna(0)
+    rfm = df['rfm'].fillna(0)
+    cost = df['cost'].fillna(0)
+    freight = df['freight'].fillna(0)
+    # int 0 × int 0 仍为int 0，否则为float
+    cogs = (cost * units).where(df['cost'].notna() | df['units'].notna())
+    frt = (freight * units).where(df['freight'].notna() | df['units'].notna())
+    pp = rev - ref - fba - cogs.fillna(0) - frt.fillna(0) - rfm
+    spend = ad['spend'].fillna(0)
+    op = pp - spend
+    sales_ = ad['sales'].fillna(0)
+    du = units / days
+    pm = pp / rev
+    om = op / rev
+    ar = spend / rev
+    # 分母为0时原计算直接取int 0
+    acos = (spend / sales_).where(sales_ > 0)
+    roas = (sales_ / spend).where(spend > 0)
+
+    return SkuTable.from_columns(len(df), {
+        'sku': df['sku'].tolist(),
+        'asin': df['asin'].tolist(),
+        'name': df['name'].tolist(),
+        'cat': df['cat'].tolist(),
+        'units': exact(df['units'], 0),
+        'du': exact(du, 1),
+        'rev': exact(rev, 2),
+        'ref': exact(df['ref'], 2),
+        'fba': exact(df['fba'], 2),
+        'cogs': exact(cogs, 2),
+        'frt': exact(frt, 2),
+        'rfmFee': exact(df['rfm'], 2),
+        'pp': exact(pp, 2),
+        'pm': exact(pm, 4),
+        'adSpend': exact(ad['spend'], 2),
+        'adImp': exact(ad['imp']),
+        'adClk': exact(ad['clk']),
+        'adSales': exact(ad['sales'], 2),
+        'op': exact(op, 2),
+        'om': exact(om, 4),
+        'ar': exact(ar, 4),
+        'acos': exact(acos, 4),
+        'roas': exact(roas, 2),
+        'ful': exact(iv['ful']),
+        'inb': exact(iv['inb']),
+        'rsv': exact(iv['rsv'])
+    })
+
+
+def exact(col, digits=None):
+    """
+    列 → Python值列表，与原逐行计算的值和类型一致：NaN (缺失/无法转换，原 safe_float 返回int 0) 还原为int 0；
+    digits不为None时逐值 round() (np.round 在个别值上与 round() 不同)
+    """
+    if digits is None:
+        return [0 if v != v else v for v in col.tolist()]
+    return [0 if v != v else round(v, digits) for v in col.tolist()]
+
+
+def group_sum(keys, values):
+    """按key顺序累加 (与逐行 += 结果逐位一致)，组内全部缺失时为NaN (逐行累加时保持int 0)"""
+    if len(keys) == 0:
+        return pd.DataFrame(columns=values.columns, dtype=float)
+    codes, uniques = pd.factorize(keys)
+
+    def total(col):
+        present = ~np.isnan(col)
+        sums = np.bincount(codes, weights=np.where(present, col, 0), minlength=len(uniques))
+        sums[np.bincount(codes, weights=present, minlength=len(uniques)) == 0] = np.nan
+        return sums
+
+    return pd.DataFrame({c: total(values[c].to_numpy()) for c in values.columns}, index=pd.Index(uniques, name='key'))
+
+
+def asin_key(asin):
+    """ASIN前缀 (去掉 '-' 之后的部分)"""
+    return asin.str.split('-', n=1).str[0]
+
+
+def text_col(df, idx, strip=False, missing=''):
+    """整列转字符串，缺失值/不存在的列返回missing"""
+    if idx not in df.columns:
+        return pd.Series(missing, index=df.index, dtype=object)
+    col = df[idx]
+    text = col
+    if col.dtype.kind == 'f':
+        # 只读流式读取时含空值的数字列 (如纯数字SKU) 被推断为float：整数值按整数转字符串 ('1001' 而非 '1001.0')
+        integral = (col % 1 == 0) & (col.abs() < 2 ** 53)
+        text = col.astype(object).where(~integral, col.where(integral, 0).astype(np.int64))
+    text = text.astype(str).astype(object)
+    if strip:
+        text = text.str.strip()
+    return text.where(col.notna(), missing)
+
 
+def num_col(df, idx):
+    """整列转浮点数，无法转换/缺失/不存在的列记为NaN (逐个safe_float时为int 0，参与计算前fillna(0))"""
+    if idx not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[idx], errors='coerce').astype(float)
 
-def generate_ad_plan(summary, skus):
+
+def generate_ad_plan(summary, skus, rules=None, role_plan=None):
     """
     生成广告优化计划 (Phase1/Phase2结构化输出)
     任务1核心实现
+    rules: 覆盖 AD_WASTE_RULES 中的阈值；role_plan: calc_role_plan() 结果，给出时附带按角色的预算计划
     """
     s = summary
     current_ad_ratio = s['ar']
@@ -234,81 +392,11 @@ def generate_ad_plan(summary, skus):
     gap = max(0, current_ad_ratio - target_ad_ratio)
     ad_dependency = s['adSales'] / s['rev'] if s['rev'] > 0 else 0
     
-    ad_skus = [x for x in skus if x['adSpend'] > 0]
-    
-    # ========== Phase 1: 无意义消耗清单 ==========
-    phase1_waste_list = []
-    
-    # 1) 高花费零归因
-    for x in ad_skus:
-        if x['adSpend'] > 30 and x['adSales'] == 0:
-            phase1_waste_list.append({
-                'sku': x['sku'],
-                'asin': x['asin'],
-                'wasted_spend': x['adSpend'],
-                'reason': f"广告花费${x['adSpend']:.0f}但归因销售为0",
-                'suggested_action': 'pause',
-                'action_desc': '暂停该SKU所有广告投放'
-            })
-    
-    # 2) ACOS极高 (>300%)
-    for x in ad_skus:
-        if x['acos'] > 3 and x['adSpend'] > 20:
-            if not any(p['sku'] == x['sku'] for p in phase1_waste_list):
-                phase1_waste_list.append({
-                    'sku': x['sku'],
-                    'asin': x['asin'],
-                    'wasted_spend': x['adSpend'] * 0.8,
-                    'reason': f"ACOS={x['acos']*100:.0f}%极高，投入产出严重失衡",
-                    'suggested_action': 'restructure',
-                    'action_desc': '砍掉80%预算，仅保留核心词'
-                })
-    
-    # 3) 广告占比>毛利率×2
-    for x in ad_skus:
-        if x['ar'] > x['pm'] * 2 and x['adSpend'] > 30 and x['pm'] > 0:
-            if not any(p['sku'] == x['sku'] for p in phase1_waste_list):
-                phase1_waste_list.append({
-                    'sku': x['sku'],
-                    'asin': x['asin'],
-                    'wasted_spend': max(0, x['adSpend'] - x['rev'] * x['pm'] * 0.8),
-                    'reason': f"广告占比{x['ar']*100:.1f}%超过毛利率{x['pm']*100:.1f}%的2倍",
-                    'suggested_action': 'negate',
-                    'action_desc': '否定低效词，预算降至毛利80%'
-                })
-    
+    phase1_waste_list, phase1_actions = detect_ad_waste(skus, {**AD_WASTE_RULES, **(rules or {})})
     phase1_total_savings = sum(max(0, w['wasted_spend']) for w in phase1_waste_list)
     phase1_ratio_reduction = phase1_total_savings / s['rev'] if s['rev'] > 0 else 0
     after_phase1_ratio = max(0, current_ad_ratio - phase1_ratio_reduction)
     
-    # Phase 1 汇总动作
-    phase1_actions = []
-    pause_items = [w for w in phase1_waste_list if w['suggested_action'] == 'pause']
-    restructure_items = [w for w in phase1_waste_list if w['suggested_action'] == 'restructure']
-    negate_items = [w for w in phase1_waste_list if w['suggested_action'] == 'negate']
-    
-    if pause_items:
-        phase1_actions.append({
-            'action': '暂停零归因投放',
-            'skuCount': len(pause_items),
-            'spend': sum(w['wasted_spend'] for w in pause_items),
-            'impact': '销量影响≈0（本来就没有归因）'
-        })
-    if restructure_items:
-        phase1_actions.append({
-            'action': '砍掉ACOS>300%投放80%',
-            'skuCount': len(restructure_items),
-            'spend': sum(w['wasted_spend'] for w in restructure_items),
-            'impact': '销量影响<3%（这些投放ROI极差）'
-        })
-    if negate_items:
-        phase1_actions.append({
-            'action': '降超支SKU至毛利80%线',
-            'skuCount': len(negate_items),
-            'spend': sum(w['wasted_spend'] for w in negate_items),
-            'impact': '销量影响5-8%'
-        })
-    
     # ========== Phase 2: 增量优化周计划 ==========
     phase2_gap = max(0, after_phase1_ratio - target_ad_ratio)
     phase2_plan = []
@@ -362,7 +450,7 @@ def generate_ad_plan(summary, skus):
     has_nonlinear_risk = total_reduction_pct > risk_threshold
     risk_warning = f"累计降幅>{risk_threshold}%，可能触发排名下滑。建议分阶段执行，每阶段后观察3-5天自然位变化。" if has_nonlinear_risk else None
     
-    return {
+    plan = {
         'algoVersion': ALGO_VERSION,
         'currentAdRatio': current_ad_ratio,
         'targetAdRatio': target_ad_ratio,
@@ -392,150 +480,151 @@ def generate_ad_plan(summary, skus):
         'hasNonlinearRisk': has_nonlinear_risk,
         'riskWarning': risk_warning
     }
+    if role_plan is not None:
+        plan['roleBudget'] = role_budget(role_plan)
+    return plan
 
 
-def calc_inventory(skus, params):
-    """计算库存指标"""
-    lead_time = params.get('lead_time_days', 35)
-    safety_days = params.get('safety_days', 30)
-    target_cover = params.get('target_cover_days', 90)
-    low_threshold = params.get('low_stock_threshold', 7)
-    over_threshold = params.get('overstock_threshold', 120)
-    
-    result = []
-    for sku in skus:
-        ful = sku.get('ful', 0)
-        inb = sku.get('inb', 0)
-        rsv = sku.get('rsv', 0)
-        du = sku.get('du', 0)
-        
-        if du <= 0:
-            result.append({
-                'sku': sku['sku'],
-                'sellableDOS': None,
-                'totalDOS': None,
-                'stockoutGap': None,
-                'status': 'no-sales',
-                'overstockRisk': False,
-                'ropUnits': 0,
-                'targetUnits': 0,
-                'availableUnits': 0,
-                'orderQty': 0
-            })
-            continue
-        
-        sellable_dos = ful / du
-        total_dos = (ful + inb - rsv) / du
-        stockout_gap = max(0, lead_time - sellable_dos)
-        
-        if sellable_dos < low_threshold:
-            status = 'critical'
-        elif sellable_dos < lead_time:
-            status = 'reorder-now'
-        elif sellable_dos < 15:
-            status = 'watch'
-        else:
-            status = 'healthy'
-        
-        overstock_risk = total_dos > over_threshold
-        rop_units = (lead_time + safety_days) * du
-        target_units = target_cover * du
-        available_units = ful + inb - rsv
-        order_qty = max(0, target_units - available_units)
-        
-        result.append({
-            'sku': sku['sku'],
-            'sellableDOS': round(sellable_dos, 1),
-            'totalDOS': round(total_dos, 1),
-            'stockoutGap': round(stockout_gap, 1),
-            'status': status,
-            'overstockRisk': overstock_risk,
-            'ropUnits': round(rop_units, 0),
-            'targetUnits': round(target_units, 0),
-            'availableUnits': round(available_units, 0),
-            'orderQty': round(order_qty, 0)
-        })
-    
-    return result
+# ==================== 角色止损/预算 ====================
+def calc_role_plan(skus, sku_roles):
+    """
+    按SKU角色的亏损容忍线/止损线/窗口期，全目录一次向量化计算，返回与SKU对齐的 SkuTable
+    sku_roles: {sku: [role, 已指定周数]}，未设置的SKU为profit
+    - 经营毛利 < allowedLoss：超出容忍线，广告预算削减到回到容忍线为止
+    - 经营毛利 < stopLoss，或窗口期已满仍低于容忍线：触发止损
+      盈利款/测试款 (降级为盈利款) 按不亏损控制预算，引流/防御款启动退出，预算清零
+    """
+    sku = sku_table.values(skus, 'sku')
+    roles = [(sku_roles.get(x) or ['profit', 0]) for x in sku]
+    role = [r[0] for r in roles]
+    weeks = np.array([r[1] for r in roles], dtype=float)
+    cfg = [SKU_ROLE_CONFIG[r] for r in role]
+    allowed = np.array([c['allowedLoss'] for c in cfg], dtype=float)
+    stop = np.array([c['stopLoss'] for c in cfg], dtype=float)
+    window = np.array([np.nan if c['windowWeeks'] is None else c['windowWeeks'] for c in cfg], dtype=float)
 
+    om, rev, op, spend = (sku_table.array(skus, k) for k in ('om', 'rev', 'op', 'adSpend'))
 
-def generate_diagnostics(skus, params):
-    """生成SKU诊断建议"""
-    lead_time = params.get('lead_time_days', 35)
-    low_threshold = params.get('low_stock_threshold', 7)
-    
-    diagnostics = []
-    for sku in skus:
-        issues = []
-        actions = []
-        stop_loss = []
-        is_healthy = True
-        
-        # 计算库存指标
-        du = sku.get('du', 0)
-        ful = sku.get('ful', 0)
-        sellable_dos = ful / du if du > 0 else None
-        
-        # 库存风险
-        if sellable_dos is not None and sellable_dos < low_threshold:
-            issues.append({'type': 'critical', 'text': f"可售库存仅{sellable_dos:.1f}天，低于{low_threshold}天阈值"})
-            actions.append({'priority': 0, 'text': '【紧急】立即补货或调拨', 'condition': '库存恢复前不做其他优化'})
-            is_healthy = False
-        
-        # 定价毛利问题
-        if sku['pm'] < 0:
-            issues.append({'type': 'critical', 'text': f"定价毛利为负({sku['pm']*100:.1f}%)"})
-            is_healthy = False
-            actions.append({'priority': 1, 'text': '【诊断】检查成本结构', 'condition': '定位主要成本问题'})
-        
-        # 广告占比问题
-        if sku['ar'] > sku['pm'] and sku['adSpend'] > 0:
-            issues.append({'type': 'critical', 'text': f"广告占比({sku['ar']*100:.1f}%)超过毛利率({sku['pm']*100:.1f}%)"})
-            is_healthy = False
-            actions.append({'priority': 1, 'text': '【立即】执行Phase1砍无意义消耗', 'condition': '先砍ACOS>200%的词'})
-        
-        # 广告贡献
-        ad_contrib = sku['adSales'] * sku['pm'] - sku['adSpend']
-        if ad_contrib < 0 and sku['adSpend'] > 50:
-            issues.append({'type': 'warning', 'text': f"广告贡献利润为负(${ad_contrib:.0f})"})
-            actions.append({'priority': 2, 'text': '【优化】否定ACOS>50%词，降长尾竞价20%', 'condition': '2周后复盘效果'})
-        
-        # 四象限分类
-        if sku['pm'] > 0 and ad_contrib >= 0:
-            quadrant = 'star'
-        elif sku['pm'] > 0 and ad_contrib < 0:
-            quadrant = 'dog'
-        elif sku['pm'] <= 0 and ad_contrib >= 0:
-            quadrant = 'question'
-        else:
-            quadrant = 'eliminate'
-        
-        if quadrant == 'eliminate':
-            actions.append({'priority': 1, 'text': '【启动退出】定价亏+广告亏，双重问题', 'condition': '除非有战略价值'})
-            stop_loss.append('立即停止补货')
-            is_healthy = False
-        
-        actions.sort(key=lambda x: x['priority'])
-        
-        diagnostics.append({
-            'sku': sku['sku'],
-            'quadrant': quadrant,
-            'adContrib': round(ad_contrib, 2),
-            'issues': issues,
-            'actions': actions,
-            'stopLoss': stop_loss,
-            'isHealthy': is_healthy
-        })
-    
-    return diagnostics
+    below = om < allowed
+    window_expired = below & (weeks >= window)
+    triggered = (om < stop) | window_expired
+    target = np.where(triggered, 0, allowed)
+    cut = np.clip(target * rev - op, 0, spend)
+    exit_ = triggered & np.isin(role, ('traffic', 'defense'))
+    cut = np.where(exit_, spend, cut)
+    budget = spend - cut
+
+    return SkuTable.from_columns(len(sku), {
+        'sku': sku,
+        'role': role,
+        'weeksInRole': [int(w) for w in weeks.tolist()],
+        'allowedLoss': allowed.tolist(),
+        'stopLoss': stop.tolist(),
+        'belowAllowed': below.tolist(),
+        'windowExpired': window_expired.tolist(),
+        'stopLossTriggered': triggered.tolist(),
+        'adBudget': [round(v, 2) for v in budget.tolist()],
+        'budgetCut': [round(v, 2) for v in cut.tolist()]
+    })
+
+
+def role_budget(role_plan):
+    """广告计划中的角色预算汇总：各角色削减额与止损数，及需调整预算的SKU (按削减额降序)"""
+    by_role = {}
+    for role, cfg in SKU_ROLE_CONFIG.items():
+        by_role[role] = {'name': cfg['name'], 'skuCount': 0, 'budgetCut': 0, 'stopLossCount': 0}
+    role, cut, stopped = (sku_table.values(role_plan, k) for k in ('role', 'budgetCut', 'stopLossTriggered'))
+    for r, c, t in zip(role, cut, stopped):
+        agg = by_role[r]
+        agg['skuCount'] += 1
+        agg['budgetCut'] += c
+        agg['stopLossCount'] += t
+    for agg in by_role.values():
+        agg['budgetCut'] = round(agg['budgetCut'], 2)
+    items = sorted((i for i, (c, t) in enumerate(zip(cut, stopped)) if c > 0 or t), key=lambda i: -cut[i])
+    return {
+        'totalCut': round(sum(cut), 2),
+        'stopLossCount': sum(stopped),
+        'byRole': by_role,
+        'items': [{'sku': p['sku'], 'role': p['role'], 'adBudget': p['adBudget'], 'budgetCut': p['budgetCut'],
+                   'stopLossTriggered': p['stopLossTriggered']} for p in map(role_plan.__getitem__, items)]
+    }
+
+
+def detect_ad_waste(skus, rules):
+    """
+    Phase1 无意义消耗清单：三条规则在SKU表上一次向量化判定，
+    按规则优先级去重 (同名SKU已被前面规则收录则跳过)，同时累计各动作汇总
+    返回 (wasteList, actions)
+    """
+    spend, pm = sku_table.array(skus, 'adSpend'), sku_table.array(skus, 'pm')
+    zero_attr = (spend > rules['zeroAttributionMinSpend']) & (sku_table.array(skus, 'adSales') == 0)
+    high_acos = (sku_table.array(skus, 'acos') > rules['highAcos']) & (spend > rules['highAcosMinSpend'])
+    overspend = ((sku_table.array(skus, 'ar') > pm * rules['overspendMarginMultiple'])
+                 & (spend > rules['overspendMinSpend']) & (pm > 0))
+    # 每个在投SKU命中的第一条规则 (0/1/2)，都未命中为-1
+    hit = np.where(spend > 0, np.select([zero_attr, high_acos, overspend], [0, 1, 2], default=-1), -1)
+
+    multiple = rules['overspendMarginMultiple']
+    waste = [[], [], []]
+    listed = set()
+    for rule in range(3):
+        for i in np.flatnonzero(hit == rule).tolist():
+            x = skus[i]
+            # 规则1不去重；规则2/3跳过已收录的同名SKU
+            if rule and x['sku'] in listed:
+                continue
+            listed.add(x['sku'])
+            if rule == 0:
+                item = {
+                    'sku': x['sku'],
+                    'asin': x['asin'],
+                    'wasted_spend': x['adSpend'],
+                    'reason': f"广告花费${x['adSpend']:.0f}但归因销售为0",
+                    'suggested_action': 'pause',
+                    'action_desc': '暂停该SKU所有广告投放'
+                }
+            elif rule == 1:
+                item = {
+                    'sku': x['sku'],
+                    'asin': x['asin'],
+                    'wasted_spend': x['adSpend'] * 0.8,
+                    'reason': f"ACOS={x['acos']*100:.0f}%极高，投入产出严重失衡",
+                    'suggested_action': 'restructure',
+                    'action_desc': '砍掉80%预算，仅保留核心词'
+                }
+            else:
+                item = {
+                    'sku': x['sku'],
+                    'asin': x['asin'],
+                    'wasted_spend': max(0, x['adSpend'] - x['rev'] * x['pm'] * 0.8),
+                    'reason': f"广告占比{x['ar']*100:.1f}%超过毛利率{x['pm']*100:.1f}%的{multiple:g}倍",
+                    'suggested_action': 'negate',
+                    'action_desc': '否定低效词，预算降至毛利80%'
+                }
+            waste[rule].append(item)
+
+    # Phase 1 汇总动作
+    labels = (
+        ('暂停零归因投放', '销量影响≈0（本来就没有归因）'),
+        (f"砍掉ACOS>{rules['highAcos']*100:.0f}%投放80%", '销量影响<3%（这些投放ROI极差）'),
+        ('降超支SKU至毛利80%线', '销量影响5-8%')
+    )
+    actions = [{'action': action, 'skuCount': len(items), 'spend': sum(w['wasted_spend'] for w in items), 'impact': impact}
+               for (action, impact), items in zip(labels, waste) if items]
+    return waste[0] + waste[1] + waste[2], actions
+
+
+def calc_inventory(skus, params, prior=None):
+    """计算库存指标 (整列计算见 replenishment.plan_replenishment)"""
+    from replenishment import plan_replenishment
+    return plan_replenishment(skus, params, prior)
 
 
-def parse_sheet(xl, name, skip):
-    """解析Excel工作表"""
-    if name not in xl.sheet_names:
-        return None
-    df = pd.read_excel(xl, sheet_name=name, header=None)
-    return df.iloc[skip:] if len(df) > skip else df
+def generate_diagnostics(skus, params, role_plan=None):
+    """生成含问题/动作/止损文本的完整SKU诊断 (整列计算见 diagnostics.diagnose，流水线只保存问题位)"""
+    from diagnostics import diagnose, expand
+    return expand(skus, diagnose(skus, params, role_plan), params, role_plan)
 
 
 def safe_float(val):
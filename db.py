@@ -0,0 +1,113 @@
+"""
+LGURT Dashboard v5.1 - Database
+SQLite访问层：WAL模式、连接池 (绑定Flask应用上下文)、语句缓存、锁冲突重试
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+DB_PATH = os.environ.get('DATABASE_PATH', 'lgurt_dashboard.db')
+
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# sqlite3按连接缓存预编译语句，连接复用后同一SQL不再重复prepare
+STATEMENT_CACHE = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -20000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+)
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.05
+
+
+def connect(db_path=None):
+    """新建一个已配置PRAGMA的连接"""
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """进程内连接池：空闲连接后进先出复用，fork后自动丢弃父进程的连接"""
+
+    def __init__(self, db_path=None, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def acquire(self):
+        with self._lock:
+            self._check_pid()
+            if self._idle:
+                return self._idle.pop()
+        return connect(self.db_path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._check_pid()
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+
+
+POOL = ConnectionPool()
+
+
+def get_db():
+    """当前应用上下文的连接 (请求结束时归还连接池)"""
+    if 'db' not in g:
+        g.db = POOL.acquire()
+    return g.db
+
+
+def release_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        POOL.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+
+def transaction(conn, fn, *args, **kwargs):
+    """执行 fn(conn, ...) 并提交；database is locked/busy 时回滚后指数退避重试"""
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            result = fn(conn, *args, **kwargs)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            msg = str(e)
+            if attempt == RETRY_ATTEMPTS - 1 or ('locked' not in msg and 'busy' not in msg):
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
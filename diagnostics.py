@@ -0,0 +1,177 @@
+"""
+LGURT Dashboard v5.1 - Diagnostics
+列式诊断：逐SKU的问题按位掩码 (flags) 整列计算，按四象限/问题位/严重问题数建倒排索引；
+问题/动作/止损文本不落库，只在查询到具体SKU时生成
+"""
+import numpy as np
+
+import sku_table
+from data_processor import SKU_ROLE_CONFIG
+from replenishment import column, demand_rates
+from roles import DEFAULT_ROLE
+from sku_table import SkuTable
+
+# 问题位
+LOW_STOCK = 1 << 0              # 可售天数低于低库存阈值 (critical)
+NEGATIVE_MARGIN = 1 << 1        # 定价毛利为负 (critical)
+AD_OVER_MARGIN = 1 << 2         # 广告占比超过毛利率 (critical)
+NEGATIVE_AD_CONTRIB = 1 << 3    # 广告贡献利润为负且花费>$50 (warning)
+BELOW_ROLE_ALLOWED = 1 << 4     # 经营毛利低于角色容忍线 (warning)
+ROLE_WINDOW_EXPIRED = 1 << 5    # 角色窗口期已到仍低于容忍线 (critical)
+ROLE_STOP_LOSS = 1 << 6         # 触发角色止损线 (critical)
+ROLE_BUDGET_CUT = 1 << 7        # 按角色削减广告预算 (仅动作)
+ROLE_FLAGS = BELOW_ROLE_ALLOWED | ROLE_WINDOW_EXPIRED | ROLE_STOP_LOSS | ROLE_BUDGET_CUT
+
+# API中的问题位名称
+FLAGS = {
+    'lowStock': LOW_STOCK,
+    'negativeMargin': NEGATIVE_MARGIN,
+    'adOverMargin': AD_OVER_MARGIN,
+    'negativeAdContrib': NEGATIVE_AD_CONTRIB,
+    'belowRoleAllowed': BELOW_ROLE_ALLOWED,
+    'roleWindowExpired': ROLE_WINDOW_EXPIRED,
+    'roleStopLoss': ROLE_STOP_LOSS,
+    'roleBudgetCut': ROLE_BUDGET_CUT
+}
+CRITICAL_FLAGS = LOW_STOCK | NEGATIVE_MARGIN | AD_OVER_MARGIN | ROLE_WINDOW_EXPIRED | ROLE_STOP_LOSS
+MAX_CRITICAL = bin(CRITICAL_FLAGS).count('1')
+QUADRANTS = ('star', 'dog', 'question', 'eliminate')
+
+# 生成文本时用到的字段
+SKU_FIELDS = ('sku', 'du', 'ful', 'pm', 'ar', 'om', 'adSales', 'adSpend')
+ROLE_FIELDS = ('role', 'adBudget', 'budgetCut')
+
+
+def diagnose(skus, params, role_plan=None, prior=None):
+    """
+    整列计算诊断 → SkuTable {'sku', 'quadrant', 'adContrib', 'flags', 'criticalCount', 'isHealthy'}
+    role_plan: calc_role_plan() 结果，给出时已指定角色的SKU按角色容忍线/止损线诊断
+    (未指定角色的SKU按盈利款只在广告计划中控制预算，不产生角色问题，诊断与无角色时相同)
+    prior: demand_prior() 结果，可售天数按与补货引擎相同的平滑日均计算
+    """
+    low_threshold = params.get('low_stock_threshold', 7)
+    col = {k: column(skus, k) for k in SKU_FIELDS[1:]}
+    du, pm, spend = demand_rates(skus, prior), col['pm'], col['adSpend']
+
+    sellable = np.divide(col['ful'], du, out=np.full(len(skus), np.inf), where=du > 0)
+    ad_contrib = col['adSales'] * pm - spend
+    flags = (np.where(sellable < low_threshold, LOW_STOCK, 0)
+             | np.where(pm < 0, NEGATIVE_MARGIN, 0)
+             | np.where((col['ar'] > pm) & (spend > 0), AD_OVER_MARGIN, 0)
+             | np.where((ad_contrib < 0) & (spend > 50), NEGATIVE_AD_CONTRIB, 0))
+
+    if role_plan is not None:
+        below, triggered, expired = (sku_table.array(role_plan, k, bool)
+                                     for k in ('belowAllowed', 'stopLossTriggered', 'windowExpired'))
+        below = below & assigned(role_plan)
+        stop, cut = sku_table.array(role_plan, 'stopLoss'), sku_table.array(role_plan, 'budgetCut')
+        window = triggered & expired & (col['om'] >= stop)
+        flags |= (np.where(below, BELOW_ROLE_ALLOWED, 0)
+                  | np.where(below & window, ROLE_WINDOW_EXPIRED, 0)
+                  | np.where(below & triggered & ~window, ROLE_STOP_LOSS, 0)
+                  | np.where(below & (cut > 0), ROLE_BUDGET_CUT, 0))
+
+    quadrant = np.select([(pm > 0) & (ad_contrib >= 0), pm > 0, ad_contrib >= 0], [0, 1, 2], 3)
+    critical_count, healthy = severity(flags, quadrant == 3)
+
+    return SkuTable(len(skus), {
+        'sku': sku_table.pack(sku_table.values(skus, 'sku')),
+        'quadrant': [QUADRANTS[q] for q in quadrant.tolist()],
+        'adContrib': sku_table.pack([round(ac, 2) for ac in ad_contrib.tolist()]),
+        'flags': flags.astype(np.int64),
+        'criticalCount': np.asarray(critical_count, dtype=np.int64),
+        'isHealthy': healthy
+    })
+
+
+def severity(flags, eliminate):
+    """问题位 → (严重问题数, 是否健康)；eliminate: 是否淘汰象限"""
+    critical = flags & CRITICAL_FLAGS
+    critical_count = sum((critical >> bit) & 1 for bit in range(CRITICAL_FLAGS.bit_length()))
+    return critical_count, (critical == 0) & ~eliminate
+
+
+def assigned(role_plan):
+    """已指定 (非默认) 角色的SKU；默认角色不落库 (roles.set_roles)，快照中只有显式指定的角色"""
+    return np.array(sku_table.values(role_plan, 'role'), dtype=object) != DEFAULT_ROLE
+
+
+def stop_loss_advice(role):
+    """止损建议，与 calc_role_plan 的预算一致：引流/防御款退出，测试款降级，盈利款按不亏损削减预算"""
+    if role in ('traffic', 'defense'):
+        return '启动退出流程'
+    if role == 'test':
+        return '降级为profit款'
+    return '广告预算降至不亏损'
+
+
+def render(sku, diag, role=None, low_threshold=7):
+    """
+    单个SKU的诊断文本 → {'issues', 'actions', 'stopLoss'}
+    sku: 含 SKU_FIELDS (另可含库存表的 demandRate，没有时按本期日均)；diag: diagnose() 的记录；role: 角色计划记录 (含 ROLE_FIELDS)
+    """
+    flags = diag['flags']
+    issues = []
+    actions = []
+    stop_loss = []
+
+    if flags & LOW_STOCK:
+        issues.append({'type': 'critical',
+                       'text': f"可售库存仅{sku['ful'] / (sku.get('demandRate') or sku['du']):.1f}天，低于{low_threshold}天阈值"})
+        actions.append({'priority': 0, 'text': '【紧急】立即补货或调拨', 'condition': '库存恢复前不做其他优化'})
+    if flags & NEGATIVE_MARGIN:
+        issues.append({'type': 'critical', 'text': f"定价毛利为负({sku['pm']*100:.1f}%)"})
+        actions.append({'priority': 1, 'text': '【诊断】检查成本结构', 'condition': '定位主要成本问题'})
+    if flags & AD_OVER_MARGIN:
+        issues.append({'type': 'critical', 'text': f"广告占比({sku['ar']*100:.1f}%)超过毛利率({sku['pm']*100:.1f}%)"})
+        actions.append({'priority': 1, 'text': '【立即】执行Phase1砍无意义消耗', 'condition': '先砍ACOS>200%的词'})
+    if flags & NEGATIVE_AD_CONTRIB:
+        ad_contrib = sku['adSales'] * sku['pm'] - sku['adSpend']
+        issues.append({'type': 'warning', 'text': f"广告贡献利润为负(${ad_contrib:.0f})"})
+        actions.append({'priority': 2, 'text': '【优化】否定ACOS>50%词，降长尾竞价20%', 'condition': '2周后复盘效果'})
+
+    if flags & BELOW_ROLE_ALLOWED:
+        rc = SKU_ROLE_CONFIG[role['role']]
+        issues.append({'type': 'warning', 'text': f"经营毛利({sku['om']*100:.1f}%)低于{rc['name']}容忍线({rc['allowedLoss']*100:.1f}%)"})
+        stopped = flags & (ROLE_WINDOW_EXPIRED | ROLE_STOP_LOSS)
+        if flags & ROLE_WINDOW_EXPIRED:
+            issues.append({'type': 'critical', 'text': f"{rc['name']}窗口期{rc['windowWeeks']}周已到，仍低于容忍线"})
+        elif flags & ROLE_STOP_LOSS:
+            issues.append({'type': 'critical', 'text': f"触发止损线({rc['stopLoss']*100:.1f}%)"})
+        if stopped:
+            stop_loss.append(f"{rc['name']}止损线已触发，建议：{stop_loss_advice(role['role'])}")
+        if flags & ROLE_BUDGET_CUT:
+            actions.append({'priority': 1, 'text': f"【预算】广告预算降至${role['adBudget']:.0f} (减${role['budgetCut']:.0f})",
+                            'condition': '回到角色容忍线' if not stopped else '止损执行中'})
+
+    if diag['quadrant'] == 'eliminate':
+        actions.append({'priority': 1, 'text': '【启动退出】定价亏+广告亏，双重问题', 'condition': '除非有战略价值'})
+        stop_loss.append('立即停止补货')
+
+    actions.sort(key=lambda x: x['priority'])
+    return {'issues': issues, 'actions': actions, 'stopLoss': stop_loss}
+
+
+def expand(skus, diagnostics, params, role_plan=None):
+    """完整诊断 (含文本)，与逐行生成的结构一致"""
+    low_threshold = params.get('low_stock_threshold', 7)
+    result = []
+    for i, (sku, diag) in enumerate(zip(skus, diagnostics)):
+        role = role_plan[i] if role_plan is not None else None
+        record = {'sku': diag['sku'], 'quadrant': diag['quadrant'], 'adContrib': diag['adContrib'],
+                  **render(sku, diag, role, low_threshold), 'isHealthy': diag['isHealthy']}
+        if role is not None:
+            record['role'] = role['role']
+        result.append(record)
+    return result
+
+
+def build_index(diagnostics):
+    """倒排索引 {键: 位置数组}；键为 quadrant:<象限> / flag:<问题位> / critical:<严重问题数>"""
+    quadrant = np.array(sku_table.values(diagnostics, 'quadrant'), dtype=object)
+    flags = sku_table.array(diagnostics, 'flags', np.int64)
+    critical = sku_table.array(diagnostics, 'criticalCount', np.int64)
+    index = {f'quadrant:{q}': np.flatnonzero(quadrant == q) for q in QUADRANTS}
+    index.update({f'flag:{name}': np.flatnonzero(flags & bit) for name, bit in FLAGS.items()})
+    index.update({f'critical:{k}': np.flatnonzero(critical == k) for k in range(1, MAX_CRITICAL + 1)})
+    return {key: positions.astype('<i4') for key, positions in index.items() if len(positions)}
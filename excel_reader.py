@@ -0,0 +1,125 @@
+"""
+LGURT Dashboard v5.1 - Excel Reader
+只读流式解析上传工作簿：按sheet跳过表头、只取用到的列、大文件落盘
+"""
+import shutil
+import tempfile
+import zipfile
+from operator import itemgetter
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+
+import metrics
+
+# sheet名 → (表头行数, 读取的列序号)
+SHEET_LAYOUT = {
+    'sales_data': (19, (1, 2, 5, 6, 8, 9, 10)),
+    'sku_master': (18, (0, 2, 3, 4, 5)),
+    'ad_data': (18, (1, 2, 4, 7, 8, 10)),
+    'inventory_data': (15, (1, 5, 6, 7)),
+    'fixed_costs': (12, (0, 1, 2, 3, 4, 5))
+}
+
+# 超过该大小的上传先写入临时文件，避免整份工作簿常驻内存
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# 与 pd.read_excel 默认一致：这些文本/错误值视为空
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]) | frozenset(ERROR_CODES)
+
+
+def read_workbook(file, layout=None):
+    """
+    读取工作簿中已知的sheet，返回 {sheet名: DataFrame或None}
+    DataFrame的列标签为原始列序号，仅包含layout中声明的列
+    """
+    layout = layout or SHEET_LAYOUT
+    source, spooled = open_source(file)
+    try:
+        with metrics.PARSE_SECONDS.time():
+            if not zipfile.is_zipfile(source):
+                # 非xlsx (如.xls) 交给pandas
+                frames = read_workbook_pandas(source, layout)
+            else:
+                wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+                try:
+                    frames = {name: timed_sheet(wb, name, skip, cols) for name, (skip, cols) in layout.items()}
+                finally:
+                    wb.close()
+        for name, df in frames.items():
+            if df is not None:
+                metrics.ROWS.inc(len(df), sheet=name)
+        return frames
+    finally:
+        if spooled is not None:
+            spooled.close()
+
+
+def open_source(file):
+    """
+    返回 (可seek的文件源, 需要关闭的临时文件)
+    路径直接使用；可seek的流回到开头；其余流复制到SpooledTemporaryFile
+    """
+    if not hasattr(file, 'read'):
+        return file, None
+    stream = getattr(file, 'stream', file)
+    if getattr(stream, 'seekable', lambda: False)():
+        stream.seek(0)
+        return stream, None
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled, spooled
+
+
+def timed_sheet(wb, name, skip, cols):
+    with metrics.PARSE_SHEET_SECONDS.time(sheet=name):
+        return read_sheet(wb, name, skip, cols)
+
+
+def read_sheet(wb, name, skip, cols):
+    """流式读取单个sheet：从第skip+1行开始，只取cols列"""
+    if name not in wb.sheetnames:
+        return None
+    ws = wb[name]
+    rows = collect_rows(ws.iter_rows(min_row=skip + 1, max_col=max(cols) + 1, values_only=True), cols)
+    if not rows:
+        # 数据行为空时与 parse_sheet 一致，返回表头部分
+        rows = collect_rows(ws.iter_rows(max_row=skip, max_col=max(cols) + 1, values_only=True), cols)
+    return to_frame(rows, cols)
+
+
+def collect_rows(it, cols):
+    """抽取指定列，去掉末尾空行"""
+    pick = itemgetter(*cols) if len(cols) > 1 else (lambda r: (r[cols[0]],))
+    rows = [pick(r) for r in it]
+    while rows and all(v is None for v in rows[-1]):
+        rows.pop()
+    return rows
+
+
+def to_frame(rows, cols):
+    """行列表 → DataFrame，文本空值按 read_excel 规则置为NaN"""
+    df = pd.DataFrame.from_records(rows, columns=list(cols)) if rows else pd.DataFrame(columns=list(cols))
+    for c in df.columns:
+        if df[c].dtype == object or pd.api.types.is_string_dtype(df[c]):
+            df[c] = df[c].where(~df[c].isin(NA_VALUES))
+    return df
+
+
+def read_workbook_pandas(source, layout):
+    """兜底：整表读取后按layout截取"""
+    xl = pd.ExcelFile(source)
+    frames = {}
+    for name, (skip, cols) in layout.items():
+        if name not in xl.sheet_names:
+            frames[name] = None
+            continue
+        df = pd.read_excel(xl, sheet_name=name, header=None)
+        df = df.iloc[skip:] if len(df) > skip else df
+        frames[name] = df.reindex(columns=list(cols)).reset_index(drop=True)
+    return frames
@@ -0,0 +1,455 @@
+"""
+LGURT Dashboard v5.1 - Exports
+已落库run的服务端导出：CSV分块生成、XLSX只写模式逐行落盘、PDF报告 (封面/摘要/总览/利润/诊断/广告/库存/配置)
+SKU与 /skus 使用相同的筛选/排序，按块投影写出，不组装完整SKU列表
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from itertools import compress
+from xml.sax.saxutils import escape
+
+import numpy as np
+from openpyxl import Workbook
+
+import run_store
+from data_processor import PORTFOLIO_SUM_FIELDS, SKU_ROLE_CONFIG, summarize_skus
+from diagnostics import FLAGS, ROLE_BUDGET_CUT, ROLE_STOP_LOSS, ROLE_WINDOW_EXPIRED
+from roles import DEFAULT_ROLE
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+except ImportError:
+    pdfmetrics = None
+
+# 每块投影的SKU数
+EXPORT_CHUNK = int(os.environ.get('EXPORT_CHUNK', 2000))
+# 文件流式返回的块大小
+STREAM_CHUNK = 64 * 1024
+# PDF各清单的行数上限
+PDF_TOP_ROWS = 10
+PDF_LIST_ROWS = 20
+PDF_FONT = 'STSong-Light'
+# A4版心宽度 (左右各留20mm)
+PDF_WIDTH = 170 * mm if pdfmetrics is not None else None
+
+QUADRANT_NAMES = {'star': '明星', 'question': '问题', 'dog': '瘦狗', 'eliminate': '淘汰'}
+STATUS_NAMES = {'critical': '断货风险', 'reorder-now': '需补货', 'watch': '关注', 'healthy': '健康', 'no-sales': '无销量'}
+# 会产生问题 (issues) 的问题位；有止损建议的问题位
+ISSUE_FLAGS = sum(FLAGS.values()) & ~ROLE_BUDGET_CUT
+STOP_LOSS_FLAGS = ROLE_WINDOW_EXPIRED | ROLE_STOP_LOSS
+
+# (表头, 字段)
+CSV_COLUMNS = (
+    ('SKU', 'sku'), ('销售额', 'rev'), ('毛利率', 'pm'), ('广告占比', 'ar'), ('经营利润', 'op'),
+    ('Sellable DOS', 'sellableDOS'), ('库存状态', 'status')
+)
+SKU_FULL_COLUMNS = (
+    ('SKU', 'sku'), ('ASIN', 'asin'), ('品类', 'cat'), ('销售额', 'rev'), ('销量', 'units'), ('日均', 'du'),
+    ('佣金', 'ref'), ('FBA', 'fba'), ('成本', 'cogs'), ('头程', 'frt'), ('退款费', 'rfmFee'), ('定价毛利', 'pp'),
+    ('毛利率', 'pm'), ('广告花费', 'adSpend'), ('归因销售', 'adSales'), ('广告占比', 'ar'), ('ACOS', 'acos'),
+    ('ROAS', 'roas'), ('广告贡献', 'adContrib'), ('经营利润', 'op'), ('经营毛利率', 'om'), ('四象限', 'quadrant'),
+    ('SKU角色', 'role'), ('Sellable DOS', 'sellableDOS'), ('Total DOS', 'totalDOS'), ('库存状态', 'status'),
+    ('建议补货', 'orderQty'), ('问题数', 'issues'), ('首要建议', 'actions')
+)
+INVENTORY_DETAIL_COLUMNS = (
+    ('SKU', 'sku'), ('ASIN', 'asin'), ('可售', 'ful'), ('在途', 'inb'), ('预留', 'rsv'), ('可用', 'availableUnits'),
+    ('日均', 'demandRate'), ('Sellable DOS', 'sellableDOS'), ('Total DOS', 'totalDOS'), ('Stockout Gap', 'stockoutGap'),
+    ('状态', 'status'), ('积压风险', 'overstockRisk'), ('ROP', 'ropUnits'), ('目标库存', 'targetUnits'),
+    ('建议补货', 'orderQty')
+)
+PARAM_NOTES = (
+    ('lead_time_days', '头程周期'), ('safety_days', '安全库存天数'), ('target_cover_days', '目标覆盖天数'),
+    ('low_stock_threshold', '低库存阈值(天)'), ('overstock_threshold', '积压阈值(天)')
+)
+FIELD_DEFINITIONS = (
+    ('定价毛利', '净销售 - 佣金 - FBA - 商品成本 - 头程 - 退款管理费'),
+    ('经营毛利', '定价毛利 - 广告花费'),
+    ('净利润', '经营毛利 - 固定成本(按周期分摊)'),
+    ('广告贡献利润', '归因销售 × 毛利率 - 广告花费'),
+    ('Sellable DOS', '可售库存 / 日均销量 (状态判断依据)'),
+    ('Total DOS', '(可售+在途-预留) / 日均销量 (积压判断依据)'),
+    ('Stockout Gap', 'max(0, 头程天数 - Sellable DOS)'),
+    ('ROP', '(头程+安全) × 日均销量'),
+    ('建议补货', 'max(0, 目标库存 - 可用库存)')
+)
+# 报告/工作簿需要的SKU字段 (不含导出列本身)
+REPORT_FIELDS = tuple(PORTFOLIO_SUM_FIELDS) + ('isHealthy', 'flags', 'status', 'overstockRisk', 'priority')
+XLSX_FIELDS = tuple(dict.fromkeys([f for _, f in SKU_FULL_COLUMNS] + [f for _, f in INVENTORY_DETAIL_COLUMNS] + ['du']))
+PDF_FIELDS = ('sku', 'rev', 'pm', 'ar', 'op', 'du', 'ful', 'inb', 'quadrant', 'role', 'adContrib', 'sellableDOS',
+              'orderQty', 'issues', 'actions', 'stopLoss')
+
+# run: runs表的行；column(表, 字段) → 按位置对齐的整列；hits: 筛选/排序后的位置；total: run的SKU总数
+# verify: 落库checksum 与 summary/SKU列合计的校验结果 (run_store.check)
+Export = namedtuple('Export', 'run params summary ads column hits total filtered low_threshold verify')
+
+
+def open_export(conn, run, filters=None, sort='op', order='desc', fields=()):
+    """读取run的汇总/广告计划并按筛选/排序选出SKU位置，只解码 fields 与报告用到的列"""
+    row = conn.execute("SELECT summary_json, ads_json FROM run_results WHERE run_id = ?", (run['id'],)).fetchone()
+    params = run_store.run_params(conn, run['id'])
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    fields = tuple(dict.fromkeys(tuple(fields) + REPORT_FIELDS))
+    column, _, hits = run_store.select_skus(conn, run['id'], filters, sort, order, fields)
+    summary = json.loads(row['summary_json']) if row else {}
+    ads = json.loads(row['ads_json']) if row and row['ads_json'] else {}
+    # rev/op列已随报告字段解码，校验只多一次求和
+    verify = run_store.check(run_store.stored_checksum(run), summary,
+                             {k: sum(column('skus', k)) for k in run_store.CHECKSUM_FIELDS})
+    export = Export(run, params, summary, ads, column, hits, len(column('skus', 'sku')), bool(filters),
+                    params.get('low_stock_threshold', 7), verify)
+    return export._replace(summary=filtered_summary(export)) if filters else export
+
+
+def filtered_summary(export):
+    """筛选后的汇总：按原顺序累加命中SKU (与 summarize_skus 逐条求和一致)"""
+    mask = np.zeros(export.total, dtype=bool)
+    mask[export.hits] = True
+    totals = {k: sum(compress(export.column('skus', k), mask)) for k in PORTFOLIO_SUM_FIELDS}
+    summary = summarize_skus([totals], export.summary.get('days', export.params.get('days', 31)),
+                             export.summary.get('mfMonthly', 0))
+    return {**summary, 'skuCount': int(mask.sum()), 'totalSkuCount': len(mask)}
+
+
+def records(export, fields):
+    """逐块生成导出记录"""
+    return run_store.iter_records(export.column, fields, export.hits.tolist(), export.low_threshold, EXPORT_CHUNK)
+
+
+def file_name(run, ext):
+    return f"LGURT_{run['id']}.{ext}"
+
+
+def stream_file(path):
+    """分块读出导出文件，读完 (或客户端断开) 后删除"""
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK), b''):
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def temp_path(suffix):
+    fd, path = tempfile.mkstemp(prefix='lgurt_export_', suffix=suffix)
+    os.close(fd)
+    return path
+
+
+# ==================== CSV ====================
+def csv_chunks(export, columns=CSV_COLUMNS):
+    """CSV文本块 (首块带BOM与表头)，每块 EXPORT_CHUNK 行"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    buf.write('\ufeff')
+    writer.writerow([header for header, _ in columns])
+    for block in records(export, [field for _, field in columns]):
+        writer.writerows([csv_value(r[field]) for _, field in columns] for r in block)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def csv_value(v):
+    # 诊断文本等嵌套字段按JSON写出
+    return json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v
+
+
+# ==================== XLSX ====================
+def write_xlsx(export, path):
+    """只写模式工作簿：SKU行逐块追加 (落盘到临时文件)，工作表与前端导出一致"""
+    wb = Workbook(write_only=True)
+    summary_ws = wb.create_sheet('Summary_Store')
+    sku_ws = wb.create_sheet('SKU_Full')
+    ads_ws = wb.create_sheet('Ads_Detail')
+    inventory_ws = wb.create_sheet('Inventory_Detail')
+    config_ws = wb.create_sheet('Config_And_Definitions')
+
+    sku_ws.append([header for header, _ in SKU_FULL_COLUMNS])
+    inventory_ws.append([header for header, _ in INVENTORY_DETAIL_COLUMNS])
+    rev_total = 0
+    for block in records(export, XLSX_FIELDS):
+        for r in block:
+            rev_total += r['rev'] or 0
+            sku_ws.append([sku_full_value(r, field) for _, field in SKU_FULL_COLUMNS])
+            inventory_ws.append([inventory_value(r, field) for _, field in INVENTORY_DETAIL_COLUMNS])
+
+    s, plan, meta = export.summary, export.ads, metadata(export)
+    for row in ([['LGURT Dashboard v5.1 - 店铺汇总'], [], ['元数据']] + meta + [
+            [], ['关键指标', '值', '占比'],
+            ['净销售额', s.get('rev'), '100%'], ['定价毛利', s.get('pp'), pct(s.get('pm'))],
+            ['广告花费', s.get('adSpend'), pct(s.get('ar'))], ['经营毛利', s.get('op'), pct(s.get('om'))],
+            ['固定成本', s.get('mfPeriod'), ''], ['净利润', s.get('np'), pct(s.get('npm'))],
+            [], ['广告分析'], ['广告依赖度', pct(plan.get('adDependency'))],
+            ['盈亏线广告占比', pct(plan.get('breakEvenAdRatio'))], ['目标广告占比', pct(plan.get('targetAdRatio'))],
+            ['Phase1节流预估', plan.get('phase1', {}).get('totalSavings')],
+            ['Phase2需降幅度', pct(plan.get('phase2', {}).get('gap'))]]):
+        summary_ws.append(row)
+
+    for row in ads_rows(plan):
+        ads_ws.append(row)
+
+    difference = abs(rev_total - (s.get('rev') or 0))
+    for row in ([['LGURT Dashboard 配置与定义'], [], ['=== 元数据 ===']] + meta + [
+            [], ['=== 库存配置 ==='], ['参数', '值', '说明']] +
+            [[key, export.params.get(key), note] for key, note in PARAM_NOTES] +
+            [[], ['=== 字段定义 ==='], ['字段', '公式/说明']] + [list(d) for d in FIELD_DEFINITIONS] +
+            [[], ['=== 一致性校验 ==='], ['SKU汇总销售', rev_total], ['Summary销售', s.get('rev')],
+             ['差异', difference], ['校验结果', '✓ 通过' if difference <= 1 else '⚠ 不一致']] + checksum_rows(export)):
+        config_ws.append(row)
+
+    wb.save(path)
+
+
+def checksum_rows(export):
+    """落库checksum与整个run的 summary/SKU合计的校验"""
+    verify = export.verify
+    checksum = verify['checksum'] or {}
+    return [['Checksum销售 (DB)', checksum.get('rev')], ['Checksum经营利润 (DB)', checksum.get('op')],
+            ['DB校验差异', f"rev {verify['difference']['rev']} / op {verify['difference']['op']}"],
+            ['DB校验结果', '✓ 通过' if verify['is_consistent'] else '⚠ 不一致']]
+
+
+def sku_full_value(r, field):
+    if field == 'quadrant':
+        return QUADRANT_NAMES.get(r['quadrant'], '-')
+    if field == 'role':
+        return SKU_ROLE_CONFIG[r['role'] or DEFAULT_ROLE]['name']
+    if field == 'issues':
+        return len(r['issues'] or [])
+    if field == 'actions':
+        return r['actions'][0]['text'] if r['actions'] else '-'
+    return r[field]
+
+
+def inventory_value(r, field):
+    if field == 'rsv':
+        return r['rsv'] or 0
+    if field == 'demandRate':
+        # 旧run没有平滑后的日均，按本期日均
+        return r['demandRate'] if r['demandRate'] is not None else r['du']
+    if field == 'status':
+        return STATUS_NAMES.get(r['status'], '-')
+    if field == 'overstockRisk':
+        return '是' if r['overstockRisk'] else '否'
+    return r[field]
+
+
+def ads_rows(plan):
+    """Ads_Detail：Phase1清单/汇总 + Phase2周计划 + 销量影响度"""
+    phase1, phase2, impact = plan.get('phase1', {}), plan.get('phase2', {}), plan.get('impact', {})
+    rows = [['=== Phase 1 无意义消耗清单 ==='], ['SKU', 'ASIN', '浪费金额', '原因', '建议动作', '动作描述']]
+    rows += [[w['sku'], w['asin'], w['wasted_spend'], w['reason'], w['suggested_action'], w['action_desc']]
+             for w in phase1.get('wasteList', [])]
+    rows += [[], ['Phase1汇总'], ['总节省', phase1.get('totalSavings')], ['占比下降', pct(phase1.get('ratioReduction'))],
+             ['执行后广告占比', pct(phase1.get('afterRatio'))], ['销量影响假设', phase1.get('salesImpactAssumption')]]
+    rows += [[], ['=== Phase 2 周计划 ==='], ['周次', '目标占比', '降幅', '日预算', '动作1', '动作2', '检查点']]
+    rows += [[f"Week {p['week']}", p['target_ad_ratio'], p['delta'], p['daily_budget'],
+              *(p['actions'] + ['', ''])[:2], p.get('checkpoint') or ''] for p in phase2.get('plan', [])]
+    rows += [[], ['=== 销量影响度 ==='], ['类型', '每降1%影响', '总影响', '说明']]
+    for key, name in (('conservative', '保守'), ('moderate', '中性'), ('aggressive', '激进')):
+        per_point = impact.get('perPointPct', {}).get(key, {})
+        rows.append([name, per_point.get('rate'), f"{impact.get('totalPct', {}).get(key)}%", per_point.get('desc')])
+    if plan.get('riskWarning'):
+        rows += [[], ['风险警告', plan['riskWarning']]]
+    return rows
+
+
+def metadata(export):
+    s, lead_time = export.summary, export.params.get('lead_time_days', 35)
+    return [['生成时间', datetime.now().strftime('%Y-%m-%d %H:%M:%S')], ['Run ID', export.run['id']],
+            ['算法版本', export.run['algo_version']], ['数据周期', f"{s.get('days', export.params.get('days'))}天"],
+            ['SKU数量', f"{len(export.hits)}/{export.total}" if export.filtered else len(export.hits)],
+            ['头程模式', f"{lead_time}天 ({lead_mode(lead_time)})"]]
+
+
+def lead_mode(days):
+    return '快船' if days <= 15 else '慢船' if days <= 35 else '极慢船'
+
+
+def pct(v):
+    return f"{v * 100:.1f}%" if v is not None else '-'
+
+
+def money(v):
+    return f"${v:,.0f}" if v is not None else '-'
+
+
+# ==================== PDF ====================
+def write_pdf(export, path):
+    """PDF报告：封面/Executive Summary/Overview/Profit/Decision/Ads/Inventory/Config，页脚带 run_id/时间/算法版本"""
+    if pdfmetrics is None:
+        raise RuntimeError('PDF导出需要安装 reportlab')
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(UnicodeCIDFont(PDF_FONT))
+
+    s, plan, column = export.summary, export.ads, export.column
+    hits = export.hits
+    col = lambda table, key: np.array(column(table, key), dtype=object)[hits]
+    op, pm, du = (np.array(col('skus', k), dtype=float) for k in ('op', 'pm', 'du'))
+    status, quadrant = col('inventory', 'status'), col('diagnostics', 'quadrant')
+    flags = np.array([f or 0 for f in col('diagnostics', 'flags')], dtype=np.int64)
+    healthy = np.array([h is not False for h in col('diagnostics', 'isHealthy')], dtype=bool)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def rows(positions, fields):
+        return next(run_store.iter_records(column, fields, hits[positions].tolist(), export.low_threshold), [])
+
+    title = ParagraphStyle('title', fontName=PDF_FONT, fontSize=22, leading=28, alignment=1, spaceAfter=12)
+    h2 = ParagraphStyle('h2', fontName=PDF_FONT, fontSize=15, leading=20, spaceBefore=6, spaceAfter=10,
+                        textColor=colors.HexColor('#0071e3'))
+    h3 = ParagraphStyle('h3', fontName=PDF_FONT, fontSize=11, leading=15, spaceBefore=10, spaceAfter=6)
+    body = ParagraphStyle('body', fontName=PDF_FONT, fontSize=9, leading=13)
+
+    cell = ParagraphStyle('cell', fontName=PDF_FONT, fontSize=8, leading=10)
+
+    def table(header, data):
+        # 等分版心宽度，文本单元格自动换行
+        rows = [header] + [[Paragraph(escape(v), cell) if isinstance(v, str) else '-' if v is None else v for v in r]
+                           for r in data]
+        t = Table(rows, colWidths=[PDF_WIDTH / len(header)] * len(header), repeatRows=1)
+        t.setStyle(TableStyle([('FONTNAME', (0, 0), (-1, -1), PDF_FONT), ('FONTSIZE', (0, 0), (-1, -1), 8),
+                               ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f5f5f7')),
+                               ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.HexColor('#e5e5e5')),
+                               ('VALIGN', (0, 0), (-1, -1), 'MIDDLE')]))
+        return t
+
+    scope = f"{s.get('skuCount')}/{s.get('totalSkuCount')} SKU" if export.filtered else f"全量 {len(hits)} SKU"
+    lead_time = export.params.get('lead_time_days', 35)
+    story = [Spacer(1, 60 * mm), Paragraph('LGURT Dashboard Report', title),
+             Paragraph(f'生成时间: {timestamp}', ParagraphStyle('meta', parent=body, alignment=1)), Spacer(1, 20 * mm)]
+    story += [Paragraph(text, ParagraphStyle('cover', parent=body, fontSize=11, leading=18, leftIndent=50 * mm))
+              for text in (f"数据周期: {s.get('days')} 天", f'筛选范围: {escape(scope)}',
+                           f"算法版本: {export.run['algo_version']}", f"Run ID: {export.run['id']}",
+                           f'头程模式: {lead_time}天 ({lead_mode(lead_time)})')]
+
+    # Executive Summary
+    np_ = s.get('np') or 0
+    over = (s.get('ar') or 0) > (s.get('pm') or 0)
+    story += [PageBreak(), Paragraph('Executive Summary', h2),
+              table(['净销售', '定价毛利', '广告花费', '净利润'],
+                    [[money(s.get('rev')), f"{money(s.get('pp'))} ({pct(s.get('pm'))})",
+                      f"{money(s.get('adSpend'))} ({pct(s.get('ar'))})", money(np_)]]),
+              Spacer(1, 4 * mm),
+              Paragraph(f"一句话结论: {'盈利状态，' if np_ >= 0 else '亏损状态，'}广告占比{'超出' if over else '低于'}毛利率"
+                        f"{'，需执行Phase1优化' if over else '，可适当放量'}。", body),
+              Paragraph('SKU四象限分布', h3),
+              table(['象限', '数量', '说明'],
+                    [['明星', int((quadrant == 'star').sum()), '毛利正+广告贡献正，可放量'],
+                     ['问题', int((quadrant == 'question').sum()), '毛利负但广告贡献正，需诊断成本'],
+                     ['瘦狗', int((quadrant == 'dog').sum()), '毛利正但广告贡献负，需优化广告'],
+                     ['淘汰', int((quadrant == 'eliminate').sum()), '双负，考虑退出']])]
+
+    # Overview
+    top = np.arange(min(PDF_TOP_ROWS, len(hits)))
+    story += [PageBreak(), Paragraph('Overview - SKU健康度', h2),
+              table(['盈利SKU', '亏损SKU', '低库存风险', '无销量'],
+                    [[int((op > 0).sum()), int((op < 0).sum()), int((status == 'critical').sum()), int((du <= 0).sum())]]),
+              Paragraph(f'Top {PDF_TOP_ROWS} 经营利润 SKU', h3),
+              table(['SKU', '销售额', '毛利率', '广告占比', '经营利润'],
+                    [[r['sku'], money(r['rev']), pct(r['pm']), pct(r['ar']), money(r['op'])]
+                     for r in rows(top, ('sku', 'rev', 'pm', 'ar', 'op'))])]
+
+    # Profit
+    gain = np.flatnonzero(op > 0)
+    loss = np.flatnonzero(op < 0)
+    gain = gain[np.argsort(-op[gain], kind='stable')[:PDF_TOP_ROWS]]
+    loss = loss[np.argsort(op[loss], kind='stable')[:PDF_TOP_ROWS]]
+    story += [PageBreak(), Paragraph('Profit Analysis - 利润分析', h2),
+              Paragraph(f'盈利 SKU Top {PDF_TOP_ROWS}', h3),
+              table(['SKU', '销售额', '毛利率', '经营利润'],
+                    [[r['sku'], money(r['rev']), pct(r['pm']), money(r['op'])] for r in rows(gain, ('sku', 'rev', 'pm', 'op'))]),
+              Paragraph(f'亏损 SKU Top {PDF_TOP_ROWS}', h3),
+              table(['SKU', '销售额', '毛利率', '经营利润'],
+                    [[r['sku'], money(r['rev']), pct(r['pm']), money(r['op'])] for r in rows(loss, ('sku', 'rev', 'pm', 'op'))])]
+
+    # Decision：只为列出的SKU生成诊断文本
+    attention = np.flatnonzero(~healthy | (flags & ISSUE_FLAGS).astype(bool))[:PDF_LIST_ROWS]
+    stop = np.flatnonzero((flags & STOP_LOSS_FLAGS).astype(bool) | (quadrant == 'eliminate'))[:5]
+    fields = ('sku', 'quadrant', 'role', 'pm', 'adContrib', 'issues', 'actions')
+    story += [PageBreak(), Paragraph('Decision Center - 诊断建议', h2), Paragraph('需关注的SKU (问题数>0或触发止损)', h3),
+              table(['SKU', '象限', '角色', '毛利率', '广告贡献', '问题数', '首要建议'],
+                    [[r['sku'][:15], QUADRANT_NAMES.get(r['quadrant'], '-'), sku_full_value(r, 'role'), pct(r['pm']),
+                      money(r['adContrib']), len(r['issues'] or []), sku_full_value(r, 'actions')[:30]]
+                     for r in rows(attention, fields)])]
+    if len(stop):
+        story += [Paragraph('止损警告', h3)]
+        story += [Paragraph(f"{escape(r['sku'])}: {escape(r['stopLoss'][0])}", body)
+                  for r in rows(stop, ('sku', 'stopLoss')) if r['stopLoss']]
+
+    # Ads (全店广告计划)
+    phase1, phase2, impact = plan.get('phase1', {}), plan.get('phase2', {}), plan.get('impact', {})
+    story += [PageBreak(), Paragraph('Ads Management - 广告管理', h2),
+              table(['当前广告占比', '盈亏线', '目标', '广告依赖度'],
+                    [[pct(plan.get('currentAdRatio')), pct(plan.get('breakEvenAdRatio')), pct(plan.get('targetAdRatio')),
+                      pct(plan.get('adDependency'))]]),
+              Paragraph('Phase 1: 无意义消耗清单', h3)]
+    waste = phase1.get('wasteList', [])
+    if waste:
+        story += [table(['SKU', '浪费金额', '原因', '建议动作'],
+                        [[w['sku'], money(w['wasted_spend']), w['reason'], w['action_desc']] for w in waste[:15]]),
+                  Spacer(1, 3 * mm),
+                  Paragraph(f"Phase1预计节省: {money(phase1.get('totalSavings'))}，广告占比下降 {pct(phase1.get('ratioReduction'))}",
+                            body)]
+    else:
+        story.append(Paragraph('未发现明显无意义消耗', body))
+    if phase2.get('plan'):
+        story += [Paragraph('Phase 2: 增量优化周计划', h3),
+                  table(['周次', '目标占比', '降幅', '日预算', '执行动作'],
+                        [[f"Week {p['week']}", pct(p['target_ad_ratio']), f"-{pct(p['delta'])}", money(p['daily_budget']),
+                          ', '.join(p['actions'])] for p in phase2['plan']])]
+    story += [Paragraph('销量影响度估算', h3),
+              table(['估计类型', '每降1%影响', '总降幅影响', '场景说明'],
+                    [[name, pct(impact.get('perPointPct', {}).get(key, {}).get('rate')),
+                      f"{impact.get('totalPct', {}).get(key)}%", impact.get('perPointPct', {}).get(key, {}).get('desc')]
+                     for key, name in (('conservative', '保守'), ('moderate', '中性'), ('aggressive', '激进'))])]
+    if plan.get('hasNonlinearRisk'):
+        story.append(Paragraph(escape(plan.get('riskWarning') or ''), body))
+
+    # Inventory：低库存清单按断货优先名次
+    overstock = np.array([bool(v) for v in col('inventory', 'overstockRisk')], dtype=bool)
+    critical = np.flatnonzero(status == 'critical')
+    priority = np.array([p if p is not None else 0 for p in col('inventory', 'priority')], dtype=np.int64)
+    critical = critical[np.argsort(priority[critical], kind='stable')[:PDF_LIST_ROWS]]
+    story += [PageBreak(), Paragraph('Inventory Management - 库存管理', h2),
+              table(['断货风险', '需补货', '健康', '积压风险'],
+                    [[int((status == 'critical').sum()), int((status == 'reorder-now').sum()),
+                      int((status == 'healthy').sum()), int(overstock.sum())]])]
+    if len(critical):
+        story += [Paragraph(f'低库存风险 SKU (Sellable DOS < {export.low_threshold}天)', h3),
+                  table(['SKU', '可售', '在途', '日均', 'Sellable DOS', '建议补货'],
+                        [[r['sku'], r['ful'], r['inb'], f"{r['du']:.1f}", f"{r['sellableDOS'] or 0:.1f}天", r['orderQty']]
+                         for r in rows(critical, ('sku', 'ful', 'inb', 'du', 'sellableDOS', 'orderQty'))])]
+    else:
+        story.append(Paragraph('无低库存风险SKU', body))
+
+    # Config
+    story += [PageBreak(), Paragraph('Config & Definitions - 配置与定义', h2), Paragraph('库存配置', h3),
+              table(['参数', '值', '说明'], [[key, export.params.get(key), note] for key, note in PARAM_NOTES]),
+              Paragraph('字段定义', h3), table(['字段', '公式'], FIELD_DEFINITIONS),
+              Paragraph('一致性校验', h3), table(['项目', '值'], checksum_rows(export))]
+
+    footer = f"Run ID: {export.run['id']} | Generated: {timestamp} | Algorithm: {export.run['algo_version']}"
+
+    def draw_footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(PDF_FONT, 8)
+        canvas.setFillColor(colors.HexColor('#6e6e73'))
+        canvas.drawCentredString(A4[0] / 2, 10 * mm, f'{footer} | {doc.page}')
+        canvas.restoreState()
+
+    doc = SimpleDocTemplate(path, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm, topMargin=20 * mm,
+                            bottomMargin=20 * mm, title='LGURT Dashboard Report')
+    doc.build(story, onFirstPage=draw_footer, onLaterPages=draw_footer)
@@ -0,0 +1,17 @@
+"""
+LGURT Dashboard v5.1 - Gunicorn配置
+preload: master导入app时执行一次建表/迁移与计算链路预热，worker fork后直接继承，
+部署/扩容后的首个请求不再承担导入与首次调用开销；worker数由 WEB_CONCURRENCY 设置
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+# jobs.JOB_WORKERS 默认按同一个 WEB_CONCURRENCY 平分CPU核数；用 -w 指定worker数时需同时设置 WEB_CONCURRENCY 或 JOB_WORKERS
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+preload_app = True
+
+
+def child_exit(server, worker):
+    """worker退出 (含超时被kill，atexit未执行) 后把其指标快照并入归档"""
+    import metrics
+    metrics.retire(worker.pid)
@@ -0,0 +1,137 @@
+"""
+LGURT Dashboard v5.1 - HTTP Cache
+已落库run的响应缓存：强ETag + If-None-Match 304，进程内LRU保存序列化并预压缩 (gzip/brotli) 的响应体
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PAYLOAD_CACHE_BYTES = int(os.environ.get('RUN_PAYLOAD_CACHE_MB', 64)) * 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# 小于该大小的响应体不压缩
+MIN_COMPRESS_BYTES = 1024
+# 响应结构变化时递增，使客户端已缓存的ETag失效
+PAYLOAD_VERSION = 1
+
+
+def run_etag(run_id, algo_version):
+    """run落库后不再变化，ETag只取决于 run_id + 算法版本"""
+    return hashlib.sha256(f'{run_id}:{algo_version}:{PAYLOAD_VERSION}'.encode()).hexdigest()[:32]
+
+
+def encode_body(body):
+    """序列化后的响应体 → {编码: 字节}"""
+    encoded = {'identity': body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        encoded['gzip'] = gzip.compress(body, GZIP_LEVEL)
+        if brotli is not None:
+            encoded['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return encoded
+
+
+class PayloadCache:
+    """run_id → (etag, {编码: 响应体})，按总字节数LRU淘汰"""
+
+    def __init__(self, max_bytes=PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, run_id, etag):
+        with self._lock:
+            entry = self._items.get(run_id)
+            if entry is None or entry[0] != etag:
+                return None
+            self._items.move_to_end(run_id)
+            return entry[1]
+
+    def put(self, run_id, etag, encoded):
+        size = sum(len(b) for b in encoded.values())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(run_id)
+            self._items[run_id] = (etag, encoded, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+
+    def discard(self, run_id):
+        with self._lock:
+            self._pop(run_id)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def _pop(self, run_id):
+        entry = self._items.pop(run_id, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+RUN_PAYLOAD_CACHE = PayloadCache()
+
+
+def matched_etag(etag):
+    """If-None-Match中与该run匹配的ETag (任一编码的变体)，未命中返回None"""
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if tag.split('-')[0] == etag:
+            return tag
+    return None
+
+
+def cached_json_response(run_id, etag, build, cache=None):
+    """
+    已落库run的JSON响应：If-None-Match命中返回304；否则从LRU取预压缩响应体，
+    未命中时调用 build() 生成payload并序列化、压缩后缓存
+    """
+    cache = cache or RUN_PAYLOAD_CACHE
+    matched = matched_etag(etag)
+    if matched:
+        return etag_response(Response(status=304), matched)
+
+    encoded = cache.get(run_id, etag)
+    if encoded is None:
+        payload = build()
+        with metrics.SERIALIZE_SECONDS.time(route=metrics.current_route()):
+            body = current_app.json.dumps(payload).encode()
+        encoded = encode_body(body)
+        cache.put(run_id, etag, encoded)
+
+    encoding = choose_encoding(encoded)
+    response = Response(encoded[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    # 不同编码是不同的表示，强ETag按编码区分
+    return etag_response(response, etag if encoding == 'identity' else f'{etag}-{encoding}')
+
+
+def choose_encoding(encoded):
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in encoded and accepted[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+def etag_response(response, etag):
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
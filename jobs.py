@@ -0,0 +1,174 @@
+"""
+LGURT Dashboard v5.1 - Upload Jobs
+异步上传任务：SQLite jobs表作为队列记录，进程池执行计算并回写阶段进度
+批量上传 (batch_id非空) 的各文件也提交到同一个进程池，由Web进程中的协调线程汇总 (见 batch.run_batch)
+"""
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from db import connect, transaction
+
+JOB_UPLOAD_DIR = os.environ.get('JOB_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'lgurt_jobs'))
+# 进程池大小 (每个Web进程一个池，异步上传与批量上传共用)：默认把CPU核数平分给各gunicorn worker
+# (WEB_CONCURRENCY，见 gunicorn.conf.py)，整机的计算进程数约为CPU核数
+WEB_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(1, (os.cpu_count() or 1) // WEB_WORKERS)))
+# running状态超过该时长未更新视为进程已退出
+JOB_STALE_MINUTES = int(os.environ.get('JOB_STALE_MINUTES', 60))
+
+JOBS_SCHEMA = '''CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    file_name TEXT,
+    file_path TEXT,
+    params_json TEXT,
+    status TEXT DEFAULT 'queued',
+    stage TEXT,
+    progress REAL DEFAULT 0,
+    run_id TEXT,
+    error TEXT,
+    batch_id TEXT,
+    result_json TEXT
+)'''
+# 对外返回的任务字段
+JOB_FIELDS = 'id, created_at, updated_at, file_name, status, stage, progress, run_id, error, batch_id, result_json'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(db_path):
+    """懒加载进程池 (每个Web进程一个)，首次创建时恢复未执行的任务"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+            recover_jobs(db_path, _executor)
+        return _executor
+
+
+def submit_job(conn, db_path, user_id, file, file_name, params):
+    """保存上传文件、写入队列记录并提交到进程池，返回job_id"""
+    job_id = 'job_' + uuid.uuid4().hex[:12]
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(JOB_UPLOAD_DIR, job_id + os.path.splitext(file_name)[1])
+    file.save(file_path)
+
+    transaction(conn, lambda c: c.execute(
+        'INSERT INTO jobs (id, user_id, file_name, file_path, params_json) VALUES (?, ?, ?, ?, ?)',
+        (job_id, user_id, file_name, file_path, json.dumps(params))))
+
+    get_executor(db_path).submit(run_job, db_path, job_id)
+    return job_id
+
+
+def recover_jobs(db_path, executor):
+    """重启后：排队中的任务重新提交 (批量上传重新启动协调线程)，长时间无进度的running任务标记失败"""
+    from batch import start_batch
+
+    conn = connect(db_path)
+    conn.execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP "
+                 "WHERE status = 'running' AND updated_at < datetime('now', ?)",
+                 ('任务执行中断', f'-{JOB_STALE_MINUTES} minutes'))
+    conn.commit()
+    queued = conn.execute("SELECT id, batch_id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+    conn.close()
+    for job_id, batch_id in queued:
+        if batch_id is None:
+            executor.submit(run_job, db_path, job_id)
+        else:
+            start_batch(db_path, job_id)
+
+
+def job_record(row):
+    """任务行 → API记录 (批量上传的结果 result_json 解析为 result)"""
+    job = dict(row)
+    result_json = job.pop('result_json')
+    job['result'] = json.loads(result_json) if result_json else None
+    return job
+
+
+def get_job(conn, job_id, user_id):
+    row = conn.execute(f'SELECT {JOB_FIELDS} FROM jobs WHERE id = ? AND user_id = ?', (job_id, user_id)).fetchone()
+    return job_record(row) if row else None
+
+
+def list_jobs(conn, user_id, limit=50):
+    rows = conn.execute(f'SELECT {JOB_FIELDS} FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
+                        (user_id, limit)).fetchall()
+    return [job_record(r) for r in rows]
+
+
+def claim_job(conn, job_id):
+    """认领排队中的任务 (queued → running)，返回任务行；已被其他进程/线程认领时返回None"""
+    cur = conn.execute("UPDATE jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+                       "WHERE id = ? AND status = 'queued'", (job_id,))
+    conn.commit()
+    if cur.rowcount != 1:
+        return None
+    return conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def fail_job(conn, job_id, error, result=None):
+    """回滚未提交的写入后标记失败"""
+    conn.rollback()
+    conn.execute("UPDATE jobs SET status = 'failed', error = ?, result_json = ?, updated_at = CURRENT_TIMESTAMP "
+                 "WHERE id = ?", (error, json.dumps(result) if result is not None else None, job_id))
+    conn.commit()
+
+
+def update_progress(conn, job_id, stage, progress):
+    transaction(conn, lambda c: c.execute(
+        'UPDATE jobs SET stage = ?, progress = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (stage, progress, job_id)))
+
+
+# ==================== 进程池内执行 ====================
+def run_job(db_path, job_id):
+    """在工作进程中执行：认领任务 → run_pipeline → 落库 → 回写状态"""
+    from pipeline import STAGES, run_pipeline
+    from replenishment import demand_prior
+
+    conn = connect(db_path)
+    job = claim_job(conn, job_id)
+    if job is None:
+        conn.close()
+        return
+    params = json.loads(job['params_json'])
+
+    def progress(stage):
+        update_progress(conn, job_id, stage, round(STAGES.index(stage) / len(STAGES), 2))
+
+    try:
+        bundle = run_pipeline(job['file_path'], params, progress=progress, demand=demand_prior(conn, job['user_id']))
+        progress('store')
+        run_id = 'run_' + uuid.uuid4().hex[:12]
+        transaction(conn, finish_job, job, run_id, params, bundle)
+    except Exception as e:
+        metrics.report_error('job', f"Job {job_id} failed: {e}", exc_info=True)
+        fail_job(conn, job_id, str(e))
+    finally:
+        conn.close()
+        try:
+            os.remove(job['file_path'])
+        except OSError:
+            pass
+        metrics.flush()
+
+
+def finish_job(conn, job, run_id, params, bundle):
+    from data_processor import ALGO_VERSION
+    from run_store import save_run
+
+    save_run(conn, run_id, job['user_id'], job['file_name'], params, bundle, ALGO_VERSION)
+    conn.execute("UPDATE jobs SET status = 'done', stage = NULL, progress = 1, run_id = ?, "
+                 "updated_at = CURRENT_TIMESTAMP WHERE id = ?", (run_id, job['id']))
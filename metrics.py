@@ -0,0 +1,435 @@
+"""
+LGURT Dashboard v5.1 - Metrics
+进程内指标：阶段耗时直方图 / 行数与字节计数 / 按路由的请求延迟，以Prometheus文本格式输出 (/metrics)；
+设置 METRICS_DIR 时各进程 (gunicorn worker、异步任务/批量上传进程池) 定期把快照写入该目录，/metrics 汇总全部进程；
+进程退出后其快照并入归档文件再删除，汇总值不会因进程退出而回退
+错误 (上传/任务失败、一致性校验不通过) 计入 lgurt_errors_total 并写日志 (logger: lgurt)
+可选采样profiler：慢于阈值的请求把采样到的调用栈按折叠格式 (flamegraph.pl / speedscope 可直接读取) 落盘
+"""
+import atexit
+import bisect
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 直方图分桶上界 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 多进程汇总目录 (为空则只输出当前进程)；快照写出间隔
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+# 已退出进程的累计值 (格式与进程快照相同)
+ARCHIVE_FILE = 'archived.json'
+
+# 请求慢于该毫秒数时写出采样profile；0为关闭
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# 单个调用栈保留的最大帧数
+PROFILE_MAX_DEPTH = 128
+
+
+# ==================== 指标 ====================
+class Histogram:
+    """按标签分组的直方图；series: {标签值元组: [各桶计数 (最后一个为+Inf), 总和]}"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+        schedule_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    @staticmethod
+    def merge(into, value):
+        if into is None:
+            return [list(value[0]), value[1]]
+        into[0] = [a + b for a, b in zip(into[0], value[0])]
+        into[1] += value[1]
+        return into
+
+    def render(self, series):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{label_text(self.labels + ("le",), key + (str(bound),))} {cumulative}')
+            lines.append(f'{self.name}_sum{label_text(self.labels, key)} {total:.6f}')
+            lines.append(f'{self.name}_count{label_text(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Counter:
+    """按标签分组的单调计数；series: {标签值元组: 计数}"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._series = collections.Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._series[key] += value
+        schedule_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    def reset(self):
+        with self._lock:
+            self._series = collections.Counter()
+
+    @staticmethod
+    def merge(into, value):
+        return value if into is None else into + value
+
+    def render(self, series):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{label_text(self.labels, key)} {value}' for key, value in sorted(series.items()))
+        return lines
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+PARSE_SECONDS = Histogram('lgurt_parse_seconds', 'Excel工作簿解析耗时')
+PARSE_SHEET_SECONDS = Histogram('lgurt_parse_sheet_seconds', '单个sheet解析耗时', ('sheet',))
+STAGE_SECONDS = Histogram('lgurt_stage_seconds', '计算阶段耗时 (parse/aggregate/roles/ads/inventory/diagnostics)',
+                          ('stage',))
+DB_WRITE_SECONDS = Histogram('lgurt_db_write_seconds', 'ResultBundle落库耗时')
+SERIALIZE_SECONDS = Histogram('lgurt_json_serialize_seconds', '响应JSON序列化耗时', ('route',))
+REQUEST_SECONDS = Histogram('lgurt_request_seconds', '请求延迟', ('method', 'route', 'status'))
+ROWS = Counter('lgurt_rows_total', '解析的数据行数', ('sheet',))
+BYTES = Counter('lgurt_bytes_total', '字节数 (upload: 上传文件 / bundle: 压缩结果 / response: 响应体)', ('kind',))
+SLOW_PROFILES = Counter('lgurt_slow_profiles_total', '写出的慢请求profile数', ('route',))
+ERRORS = Counter('lgurt_errors_total', '错误数 (upload: 同步上传 / job: 异步任务 / batch: 批量任务 / checksum: 一致性校验)',
+                 ('kind',))
+
+REGISTRY = (PARSE_SECONDS, PARSE_SHEET_SECONDS, STAGE_SECONDS, DB_WRITE_SECONDS, SERIALIZE_SECONDS,
+            REQUEST_SECONDS, ROWS, BYTES, SLOW_PROFILES, ERRORS)
+
+LOGGER = logging.getLogger('lgurt')
+
+
+def report_error(kind, message, exc_info=False):
+    """记录错误：计入 lgurt_errors_total{kind} 并写日志；exc_info=True 时附带当前异常的调用栈"""
+    ERRORS.inc(kind=kind)
+    LOGGER.error(message, exc_info=exc_info)
+
+
+def reset():
+    """清空本进程的全部指标 (启动预热之后调用，预热不计入)"""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+# ==================== 多进程汇总 ====================
+_flush_lock = threading.Lock()
+# pid: 已启动写快照线程的进程；owner: 已接管快照文件的进程；retired: 快照已并入归档的进程 (之后不再写出)
+_flush_state = {'pid': None, 'thread': None, 'owner': None, 'retired': None}
+
+
+def schedule_flush():
+    """设置 METRICS_DIR 时，每个进程首次记录指标即启动后台线程定期写快照 (fork后的子进程重新启动)"""
+    if not METRICS_DIR or _flush_state['pid'] == os.getpid():
+        return
+    with _flush_lock:
+        if _flush_state['pid'] == os.getpid():
+            return
+        _flush_state['pid'] = os.getpid()
+        _flush_state['thread'] = threading.Thread(target=_flush_loop, name='lgurt-metrics', daemon=True)
+        _flush_state['thread'].start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def flush():
+    """当前进程的快照写入 METRICS_DIR/<pid>.json (先写临时文件再替换，读取方不会读到半个文件)"""
+    pid = os.getpid()
+    if not METRICS_DIR or _flush_state['retired'] == pid:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    if _flush_state['owner'] != pid:
+        # 同pid的旧文件属于已退出的进程 (pid复用)，先归档；退出时归档本进程的快照
+        retire(pid)
+        _flush_state['owner'] = pid
+        atexit.register(_retire_self)
+    write_json(snapshot_path(pid), {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                                    for metric in REGISTRY})
+
+
+def _retire_self():
+    pid = os.getpid()
+    if _flush_state['owner'] != pid or _flush_state['retired'] == pid:
+        return
+    flush()
+    _flush_state['retired'] = pid
+    retire(pid)
+
+
+def retire(pid):
+    """已退出进程的快照并入归档文件后删除 (gunicorn child_exit、atexit 及汇总时发现进程已不存在时调用)"""
+    if not METRICS_DIR or not os.path.exists(snapshot_path(pid)):
+        return
+    with archive_lock(exclusive=True):
+        path = snapshot_path(pid)
+        data = read_json(path)
+        if data is None:
+            return
+        archive = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+        write_json(archive, encode(merge_into(decode(read_json(archive) or {}), data)))
+        os.remove(path)
+
+
+def collect():
+    """{指标名: 汇总后的series}：METRICS_DIR 下全部进程快照 (含本进程最新值) 与归档，未设置时只取本进程"""
+    if not METRICS_DIR:
+        return {metric.name: metric.snapshot() for metric in REGISTRY}
+    flush()
+    for pid in snapshot_pids():
+        if not pid_alive(pid):
+            retire(pid)
+    merged = decode({})
+    with archive_lock(exclusive=False):
+        for entry in os.scandir(METRICS_DIR):
+            if entry.name.endswith('.json'):
+                merge_into(merged, read_json(entry.path) or {})
+    return merged
+
+
+def merge_into(merged, data):
+    """快照 {指标名: [[标签值列表, 值]]} 累加到 {指标名: {标签值元组: 值}}"""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, series in data.items():
+        if name not in metrics:
+            continue
+        for key, value in series:
+            key = tuple(key)
+            merged[name][key] = metrics[name].merge(merged[name].get(key), value)
+    return merged
+
+
+def decode(data):
+    return merge_into({metric.name: {} for metric in REGISTRY}, data)
+
+
+def encode(merged):
+    return {name: [[list(key), value] for key, value in series.items()] for name, series in merged.items()}
+
+
+def snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+
+def snapshot_pids():
+    return [int(entry.name[:-5]) for entry in os.scandir(METRICS_DIR)
+            if entry.name.endswith('.json') and entry.name[:-5].isdigit()]
+
+
+def pid_alive(pid):
+    """非POSIX平台无法探测，视为存活 (由退出时的atexit归档)"""
+    if os.name != 'posix' or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def archive_lock(exclusive):
+    """归档与汇总互斥 (归档时先写归档再删快照，汇总不会把同一进程算两次)；无fcntl的平台不加锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def render():
+    """全部指标 → Prometheus文本格式"""
+    series = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(series[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+# ==================== 采样profiler ====================
+class Sampler:
+    """
+    后台线程按 PROFILE_INTERVAL_MS 采样已登记线程的调用栈 (sys._current_frames)，
+    每个线程累计 {折叠栈: 次数}；只在 PROFILE_SLOW_MS > 0 时启用
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def begin(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = collections.Counter()
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='lgurt-sampler', daemon=True).start()
+
+    def end(self, thread_id):
+        with self._lock:
+            return self._stacks.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._stacks:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[fold(frame)] += 1
+
+
+def fold(frame):
+    """调用栈 → 折叠格式 'root;...;leaf' (模块名:函数名)"""
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        module = frame.f_globals.get('__name__') or os.path.basename(frame.f_code.co_filename)
+        names.append(f'{module}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+SAMPLER = Sampler()
+
+
+def dump_profile(stacks, route, elapsed):
+    """写出折叠格式profile (每行 '栈 次数')，返回文件路径"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}_{os.getpid()}_{slug}_{elapsed * 1000:.0f}ms.folded'
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    SLOW_PROFILES.inc(route=route)
+    return path
+
+
+# ==================== Flask接入 ====================
+def current_route():
+    """当前请求的路由模板 (如 /api/runs/<run_id>)，避免按run_id产生无限多的标签值"""
+    from flask import has_request_context, request
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def init_app(app):
+    """按路由记录请求延迟/响应字节数与JSON序列化耗时；PROFILE_SLOW_MS > 0 时慢请求写出采样profile"""
+    from flask import g, request
+
+    class TimedJSONProvider(type(app.json)):
+        """jsonify的序列化耗时 (预序列化的run响应体在 http_cache 中单独计时)"""
+
+        def response(self, *args, **kwargs):
+            with SERIALIZE_SECONDS.time(route=current_route()):
+                return super().response(*args, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        if PROFILE_SLOW_MS > 0:
+            SAMPLER.begin(threading.get_ident())
+
+    @app.after_request
+    def record(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = current_route()
+        REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        if response.content_length:
+            BYTES.inc(response.content_length, kind='response')
+        if PROFILE_SLOW_MS > 0:
+            stacks = SAMPLER.end(threading.get_ident())
+            if stacks and elapsed * 1000 >= PROFILE_SLOW_MS:
+                path = dump_profile(stacks, route, elapsed)
+                print(f"⏱️  Slow request {request.method} {route} {elapsed * 1000:.0f}ms → {path}")
+        return response
@@ -0,0 +1,243 @@
+"""
+LGURT Dashboard v5.1 - Pipeline
+上传 → 解析 → 计算 → ResultBundle
+每个阶段声明读取的上游输出与参数，阶段输出按 (上游版本 + 所读参数) 的摘要缓存，
+参数变化时只重算受影响的阶段
+"""
+import hashlib
+import os
+from collections import namedtuple
+
+import metrics
+
+from data_processor import (ALGO_VERSION, process_frames, generate_ad_plan, calc_role_plan, merge_portfolio,
+                            replace_inventory)
+from diagnostics import diagnose
+from excel_reader import read_workbook, open_source
+from replenishment import plan_replenishment
+from result_cache import RESULT_CACHE, file_digest, params_digest
+
+# name: 阶段名；inputs: 读取的上游输出；params: 读取的参数；outputs: 产出；run(输入字典, params) → 产出元组
+# 外部输入 source (原始文件) / demand (历史run的EWMA日均销量 {sku: 日均}) 由调用方提供
+Stage = namedtuple('Stage', 'name inputs params outputs run')
+
+
+def parse_stage(v, params):
+    return (read_workbook(v['source']),)
+
+
+def aggregate_stage(v, params):
+    result = process_frames(v['frames'], params)
+    return result['summary'], result['skus']
+
+
+def roles_stage(v, params):
+    return (calc_role_plan(v['skus'], params.get('sku_roles') or {}),)
+
+
+def ads_stage(v, params):
+    return (generate_ad_plan(v['summary'], v['skus'], role_plan=v['roles']),)
+
+
+def inventory_stage(v, params):
+    return (plan_replenishment(v['skus'], params, v['demand']),)
+
+
+def diagnostics_stage(v, params):
+    return (diagnose(v['skus'], params, v['roles'], v['demand']),)
+
+
+INVENTORY_PARAMS = ('lead_time_days', 'safety_days', 'target_cover_days', 'low_stock_threshold', 'overstock_threshold',
+                    'category_lead_times')
+
+PIPELINE = (
+    Stage('parse', ('source',), (), ('frames',), parse_stage),
+    Stage('aggregate', ('frames',), ('days',), ('summary', 'skus'), aggregate_stage),
+    # sku_roles: 上传时的角色快照 {sku: [role, 已指定周数]}
+    Stage('roles', ('skus',), ('sku_roles',), ('roles',), roles_stage),
+    Stage('ads', ('summary', 'skus', 'roles'), (), ('ads',), ads_stage),
+    # category_lead_times: 上传时的类目头程快照 {类目: 天数}
+    Stage('inventory', ('skus', 'demand'), INVENTORY_PARAMS, ('inventory',), inventory_stage),
+    # 诊断只读低库存阈值 (可售天数按平滑日均，与头程无关)
+    Stage('diagnostics', ('skus', 'roles', 'demand'), ('low_stock_threshold',), ('diagnostics',), diagnostics_stage),
+)
+PRODUCERS = {out: stage for stage in PIPELINE for out in stage.outputs}
+BUNDLE_OUTPUTS = ('summary', 'skus', 'roles', 'ads', 'inventory', 'diagnostics')
+# 影响计算结果的全部参数 (可通过 PATCH /api/runs/<id>/params 修改)
+PIPELINE_PARAMS = tuple(dict.fromkeys(p for stage in PIPELINE for p in stage.params))
+
+# 阶段顺序 (用于进度上报)
+STAGES = tuple(stage.name for stage in PIPELINE) + ('store',)
+
+
+def check_params(changes, allowed=PIPELINE_PARAMS):
+    """校验修改的参数：只允许 allowed 中的键，值须为正整数 (排除0/负数/小数/NaN/布尔)，非法时抛ValueError"""
+    unknown = [k for k in changes if k not in allowed]
+    if unknown:
+        raise ValueError(f"不支持修改的参数: {', '.join(unknown)}")
+    if any(isinstance(v, bool) or not isinstance(v, int) or v <= 0 for v in changes.values()):
+        raise ValueError('参数必须是正整数')
+
+
+def stage_keys(source_hash, params, demand=None):
+    """各阶段的版本键：阶段名 + 算法版本 + 上游阶段键 + 所读参数摘要，上游或参数变化则键变化"""
+    keys = {'source': source_hash, 'demand': params_digest(demand or {})}
+    for stage in PIPELINE:
+        upstream = sorted({keys[i] for i in stage.inputs})
+        digest = params_digest({p: params[p] for p in stage.params if p in params})
+        raw = f"{stage.name}:{ALGO_VERSION}:{':'.join(upstream)}:{digest}"
+        key = hashlib.sha256(raw.encode()).hexdigest()[:32]
+        for out in stage.outputs:
+            keys[out] = key
+    return keys
+
+
+def execute(source_hash, params, load_source=None, cache=None, progress=None, seeds=None, demand=None):
+    """
+    计算ResultBundle各输出，只执行缓存/seeds都没有命中的阶段 (按需向上游回溯)
+    load_source(): 需要重新解析时提供原始文件；seeds: {阶段键: 返回 {输出名: 值} 的函数}，如读取已落库run的结果
+    demand: 历史日均销量 (replenishment.demand_prior)
+    返回 (输出字典, 实际执行的阶段列表)
+    """
+    cache = RESULT_CACHE if cache is None else cache
+    progress = progress or (lambda stage: None)
+    seeds = seeds or {}
+    keys = stage_keys(source_hash, params, demand)
+    values = {'demand': demand or {}}
+    executed = []
+
+    def resolve(name):
+        if name in values:
+            return values[name]
+        if name == 'source':
+            if load_source is None:
+                raise LookupError('原始Excel已不在缓存中，请重新上传')
+            values['source'] = load_source()
+            return values['source']
+        stage = PRODUCERS[name]
+        key = keys[name]
+        outputs = seeds[key]() if key in seeds else None
+        if outputs is None:
+            outputs = cache.get(f"stage:{key}")
+        if outputs is None:
+            inputs = {i: resolve(i) for i in stage.inputs}
+            progress(stage.name)
+            executed.append(stage.name)
+            with metrics.STAGE_SECONDS.time(stage=stage.name):
+                outputs = dict(zip(stage.outputs, stage.run(inputs, params)))
+            cache.put(f"stage:{key}", outputs)
+        values.update(outputs)
+        return values[name]
+
+    return {name: resolve(name) for name in BUNDLE_OUTPUTS}, executed
+
+
+def run_stages(values, params, on_stage=None):
+    """
+    不经过缓存依次执行全部阶段 (基准测试/启动预热用)，values: 外部输入 {'source', 'demand'}，就地补齐各输出
+    on_stage(阶段名, 执行函数) 可包装每个阶段 (计时/测内存)，返回值须为执行函数的返回值
+    """
+    on_stage = on_stage or (lambda name, fn: fn())
+    for stage in PIPELINE:
+        inputs = {i: values[i] for i in stage.inputs}
+        values.update(zip(stage.outputs, on_stage(stage.name, lambda: stage.run(inputs, params))))
+    return values
+
+
+def run_pipeline(file, params, cache=None, progress=None, demand=None):
+    """
+    计算完整ResultBundle
+    progress(stage) 在每个实际执行的阶段开始前回调；demand: 历史日均销量
+    """
+    source, spooled = open_source(file)
+    try:
+        source_hash = file_digest(source)
+        metrics.BYTES.inc(source_size(source), kind='upload')
+        outputs, _ = execute(source_hash, params, lambda: source, cache, progress, demand=demand)
+        return {'source_hash': source_hash, **outputs}
+    finally:
+        if spooled is not None:
+            spooled.close()
+
+
+def source_size(source):
+    """路径或可seek的流的字节数 (流回到开头)"""
+    if not hasattr(source, 'read'):
+        return os.path.getsize(source)
+    size = source.seek(0, os.SEEK_END)
+    source.seek(0)
+    return size
+
+
+def rerun_with_params(source_hash, old_params, new_params, load_stored, cache=None, demand=None, old_demand=None):
+    """
+    基于已落库run按新参数重算：参数未影响的阶段复用 load_stored(输出名列表) 读出的原结果，
+    只读取实际用到的输出；需要重新聚合时从缓存取已解析的sheet，缓存已淘汰则抛LookupError
+    demand: 原run计算时的历史日均销量；old_demand: 原结果按另一历史日均算出时给出 (读取日均的库存/诊断阶段重算)
+    返回 (ResultBundle, 实际执行的阶段列表)
+    """
+    old_keys = stage_keys(source_hash, old_params, demand if old_demand is None else old_demand)
+    seeds = {old_keys[stage.outputs[0]]: (lambda outputs=stage.outputs: load_stored(outputs))
+             for stage in PIPELINE if stage.name != 'parse'}
+    outputs, executed = execute(source_hash, new_params, cache=cache, seeds=seeds, demand=demand)
+    return {'source_hash': source_hash, **outputs}, executed
+
+
+# 只含库存sheet的增量：SKU表只有库存列变化 (summary不含库存)，读取库存列的只有库存/诊断阶段
+INVENTORY_SHEET = 'inventory_data'
+INVENTORY_ONLY_REUSED = ('roles', 'ads')
+
+
+def run_delta(file, base_hash, base_params, params, load_stored, cache=None, demand=None):
+    """
+    部分工作簿 (只含部分sheet) 合并到基准run，缺少的sheet沿用基准run的输入
+    - 只含库存sheet：基准run的SKU表换用新库存列，只重算库存/诊断 (角色/广告计划所读参数未变时沿用原结果)
+    - 含其他sheet：与基准run已解析的sheet (结果缓存中) 合并后从聚合阶段重算，缓存已淘汰则抛LookupError
+    load_stored(输出名列表): 读取基准run的结果 (不可复用时返回None)；demand: 基准run计算时的历史日均销量
+    返回 (ResultBundle, 增量包含的sheet, 实际执行的阶段列表)；工作簿中没有可识别的sheet时抛ValueError
+    """
+    cache = RESULT_CACHE if cache is None else cache
+    source, spooled = open_source(file)
+    try:
+        digest = file_digest(source)
+        metrics.BYTES.inc(source_size(source), kind='upload')
+        frames = {name: df for name, df in read_workbook(source).items() if df is not None}
+    finally:
+        if spooled is not None:
+            spooled.close()
+    if not frames:
+        raise ValueError('工作簿中没有可识别的sheet')
+
+    source_hash = 'delta:' + hashlib.sha256(f'{base_hash}:{digest}'.encode()).hexdigest()[:32]
+    keys = stage_keys(source_hash, params, demand)
+    seeds = {}
+    stored = load_stored(('summary', 'skus') + INVENTORY_ONLY_REUSED) if set(frames) == {INVENTORY_SHEET} else None
+    if stored is not None:
+        skus = replace_inventory(stored['skus'], frames[INVENTORY_SHEET])
+        seeds[keys['skus']] = lambda: {'summary': stored['summary'], 'skus': skus}
+        if all(base_params.get(p) == params.get(p) for name in INVENTORY_ONLY_REUSED for p in PRODUCERS[name].params):
+            seeds.update({keys[name]: (lambda name=name: {name: stored[name]}) for name in INVENTORY_ONLY_REUSED})
+    else:
+        base = cache.get(f"stage:{stage_keys(base_hash, base_params)['frames']}")
+        if base is None:
+            raise LookupError('最近一次run的原始sheet已不在缓存中，请上传完整工作簿')
+        merged = {**base['frames'], **frames}
+        # 合并后的sheet按本run的解析键缓存，后续增量可继续在此基础上合并
+        cache.put(f"stage:{keys['frames']}", {'frames': merged})
+        seeds[keys['frames']] = lambda: {'frames': merged}
+
+    outputs, executed = execute(source_hash, params, cache=cache, seeds=seeds, demand=demand)
+    return {'source_hash': source_hash, **outputs}, sorted(frames), executed
+
+
+def run_portfolio(parts, params, cache=None, demand=None):
+    """
+    多个已计算的ResultBundle合并为组合run：合并后的 summary/skus 作为聚合阶段的结果，
+    下游角色/广告/库存/诊断阶段照常计算；source_hash 由各文件的 source_hash 派生
+    """
+    digest = hashlib.sha256(':'.join(sorted(p['source_hash'] for p in parts)).encode()).hexdigest()[:32]
+    source_hash = f'portfolio:{digest}'
+    keys = stage_keys(source_hash, params, demand)
+    merged = lambda: merge_portfolio(parts, params.get('days', 31))
+    outputs, _ = execute(source_hash, params, cache=cache, seeds={keys['skus']: merged}, demand=demand)
+    return {'source_hash': source_hash, **outputs}
@@ -0,0 +1,185 @@
+"""
+LGURT Dashboard v5.1 - Replenishment
+补货引擎：基于SKU表整列计算可售天数/补货点/建议补货量
+日均销量按用户历史run做EWMA平滑，头程可按类目覆盖；预先算好"断货优先"排序 (priority)，库存页直接按序分页
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import sku_table
+from sku_table import SkuTable
+from trends import CANONICAL_RUN_SQL
+
+# 本期日均的权重，其余为历史EWMA
+DEMAND_EWMA_ALPHA = float(os.environ.get('DEMAND_EWMA_ALPHA', 0.5))
+# 参与平滑的历史run数
+DEMAND_EWMA_RUNS = int(os.environ.get('DEMAND_EWMA_RUNS', 6))
+
+# 状态 (按紧急程度)；watch: 可售天数低于该值
+STATUS_ORDER = ('critical', 'reorder-now', 'watch', 'healthy', 'no-sales')
+WATCH_DAYS = 15
+
+LEAD_TIMES_SCHEMA = '''CREATE TABLE IF NOT EXISTS category_lead_times (
+    user_id INTEGER NOT NULL,
+    cat TEXT NOT NULL,
+    lead_time_days INTEGER NOT NULL,
+    PRIMARY KEY (user_id, cat)
+) WITHOUT ROWID'''
+
+
+# ==================== 类目头程 ====================
+def get_lead_times(conn, user_id):
+    """{类目: 头程天数}"""
+    rows = conn.execute("SELECT cat, lead_time_days FROM category_lead_times WHERE user_id = ? ORDER BY cat",
+                        (user_id,))
+    return {r['cat']: r['lead_time_days'] for r in rows}
+
+
+def set_lead_times(conn, user_id, lead_times):
+    """批量设置 {类目: 天数} (调用方负责commit)；值为null即删除覆盖，恢复默认头程"""
+    invalid = [cat for cat, days in lead_times.items()
+               if days is not None and (isinstance(days, bool) or not isinstance(days, int) or days <= 0)]
+    if invalid:
+        raise ValueError(f"头程必须是正整数: {', '.join(invalid)}")
+    cur = conn.cursor()
+    cur.executemany("DELETE FROM category_lead_times WHERE user_id = ? AND cat = ?",
+                    ((user_id, cat) for cat, days in lead_times.items() if days is None))
+    cur.executemany("INSERT OR REPLACE INTO category_lead_times (user_id, cat, lead_time_days) VALUES (?, ?, ?)",
+                    ((user_id, cat, days) for cat, days in lead_times.items() if days is not None))
+
+
+# ==================== 需求平滑 ====================
+def demand_prior(conn, user_id, before=None, before_run=None):
+    """
+    用户最近 DEMAND_EWMA_RUNS 期 (代表一期的run，见 trends.CANONICAL_RUN_SQL) 的逐SKU日均销量EWMA → {sku: 日均}
+    before: 只取该时间之前的run (回填历史期时传该期的created_at)
+    before_run: 只取该run之前写入的run (重算已有run时传其id，同一秒内按rowid，保证与原run计算时一致)
+    同一内容 (source_hash) 重复上传只算一期 (取最近一次)；SKU出现之后某期未出现视为该期无销量
+    """
+    sql = f"SELECT r.id, r.days, r.source_hash FROM runs r WHERE r.user_id = ? AND {CANONICAL_RUN_SQL}"
+    args = [user_id]
+    if before is not None:
+        sql += " AND r.created_at < ?"
+        args.append(before)
+    if before_run is not None:
+        sql += " AND (r.created_at, r.rowid) < (SELECT created_at, rowid FROM runs WHERE id = ?)"
+        args.append(before_run)
+    # 同一秒内的run按写入顺序 (rowid)
+    runs, seen = [], set()
+    for r in conn.execute(sql + " ORDER BY r.created_at DESC, r.rowid DESC", args):
+        if r['source_hash'] is not None:
+            if r['source_hash'] in seen:
+                continue
+            seen.add(r['source_hash'])
+        runs.append(r)
+        if len(runs) >= DEMAND_EWMA_RUNS:
+            break
+    if not runs:
+        return {}
+
+    runs = runs[::-1]
+    placeholders = ', '.join('?' * len(runs))
+    rows = conn.execute(f"SELECT run_id, sku, units FROM sku_trend WHERE user_id = ? AND run_id IN ({placeholders})",
+                        [user_id] + [r['id'] for r in runs]).fetchall()
+    if not rows:
+        return {}
+
+    df = pd.DataFrame(rows, columns=['run_id', 'sku', 'units'])
+    days = {r['id']: r['days'] or 31 for r in runs}
+    df['rate'] = df['units'] / df['run_id'].map(days)
+    rates = df.pivot_table(index='sku', columns='run_id', values='rate', aggfunc='sum')
+    rates = rates.reindex(columns=[r['id'] for r in runs])
+
+    smoothed = np.full(len(rates), np.nan)
+    for rate in rates.to_numpy().T:
+        seen = ~np.isnan(smoothed)
+        rate = np.where(seen, np.nan_to_num(rate), rate)
+        smoothed = np.where(seen, DEMAND_EWMA_ALPHA * rate + (1 - DEMAND_EWMA_ALPHA) * smoothed, rate)
+    return dict(zip(rates.index.tolist(), smoothed.tolist()))
+
+
+# ==================== 补货计算 ====================
+def column(skus, key):
+    """SKU表的一列 → float数组 (缺失记为0)"""
+    return sku_table.array(skus, key)
+
+
+def demand_rates(skus, prior=None):
+    """本期日均与历史EWMA合并，保留2位小数 (无历史的SKU直接用本期日均)"""
+    du = column(skus, 'du')
+    if not prior:
+        return du
+    past = np.array([prior.get(sku, np.nan) for sku in sku_table.values(skus, 'sku')], dtype=float)
+    return np.where(np.isnan(past), du, np.round(DEMAND_EWMA_ALPHA * du + (1 - DEMAND_EWMA_ALPHA) * past, 2))
+
+
+def lead_times(skus, params):
+    """逐SKU头程：类目覆盖优先，否则取 lead_time_days"""
+    default = params.get('lead_time_days', 35)
+    overrides = params.get('category_lead_times') or {}
+    if not overrides:
+        return np.full(len(skus), default, dtype=float)
+    return np.array([overrides.get(cat, default) for cat in sku_table.values(skus, 'cat')], dtype=float)
+
+
+def available_units(skus):
+    """可用库存 round(ful + inb - rsv, 0)：逐值计算保留原类型 (无库存行的SKU为int 0)"""
+    return [round(f + i - r, 0) for f, i, r in zip(sku_table.values(skus, 'ful', 0), sku_table.values(skus, 'inb', 0),
+                                                    sku_table.values(skus, 'rsv', 0))]
+
+
+def plan_replenishment(skus, params, prior=None):
+    """
+    整列计算库存指标 (字段与原逐行计算一致，另加 demandRate/leadTime/priority)，返回与SKU对齐的 SkuTable
+    prior: demand_prior() 结果 (诊断、趋势的可售天数用同一日均 demand_rates)；priority: 断货优先排序的名次 (状态 → 可售天数 → 原顺序)
+    """
+    n = len(skus)
+    safety_days = params.get('safety_days', 30)
+    target_cover = params.get('target_cover_days', 90)
+    low_threshold = params.get('low_stock_threshold', 7)
+    over_threshold = params.get('overstock_threshold', 120)
+
+    du = demand_rates(skus, prior)
+    lead = lead_times(skus, params)
+    ful, inb, rsv = column(skus, 'ful'), column(skus, 'inb'), column(skus, 'rsv')
+    available = ful + inb - rsv
+
+    selling = du > 0
+    safe_du = np.where(selling, du, 1)
+    sellable = ful / safe_du
+    total = available / safe_du
+    status = np.select([~selling, sellable < low_threshold, sellable < lead, sellable < WATCH_DAYS],
+                       [4, 0, 1, 2], 3)
+    # 取整到个位 (np.rint与round(x, 0)同为银行家舍入)
+    rop = np.rint((lead + safety_days) * du)
+    target = target_cover * du
+    order = target - available
+    reorder = order > 0
+    overstock = total > over_threshold
+
+    priority = np.empty(n, dtype=np.int64)
+    priority[np.lexsort((np.arange(n), np.where(selling, sellable, np.inf), status))] = np.arange(n)
+
+    # 无销量的SKU：天数/缺口为None，补货相关量为0
+    sel = selling.tolist()
+
+    def when_selling(values, missing):
+        return [v if s else missing for s, v in zip(sel, values)]
+
+    return SkuTable.from_columns(n, {
+        'sku': sku_table.values(skus, 'sku'),
+        'sellableDOS': when_selling([round(v, 1) for v in sellable.tolist()], None),
+        'totalDOS': when_selling([round(v, 1) for v in total.tolist()], None),
+        'stockoutGap': when_selling([round(max(0, l - v), 1) for l, v in zip(lead.tolist(), sellable.tolist())], None),
+        'status': [STATUS_ORDER[st] for st in status.tolist()],
+        'overstockRisk': when_selling(overstock.tolist(), False),
+        'ropUnits': when_selling(rop.tolist(), 0),
+        'targetUnits': when_selling(np.rint(target).tolist(), 0),
+        'availableUnits': when_selling(available_units(skus), 0),
+        'orderQty': [v if need else 0 for v, need in zip(np.rint(order).tolist(), (reorder & selling).tolist())],
+        'demandRate': du.tolist(),
+        'leadTime': [int(v) for v in lead.tolist()],
+        'priority': priority.tolist()
+    })
@@ -0,0 +1,207 @@
+"""
+LGURT Dashboard v5.1 - Result Cache
+内容寻址缓存：内存LRU + 磁盘层，均按字节数限额淘汰
+磁盘层的pickle只从当前用户私有 (0700) 的目录读取，目录属于其他用户/是符号链接时不启用磁盘层
+"""
+import hashlib
+import json
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+
+from db import DB_PATH
+
+# 默认放在数据库所在的数据目录下 (不使用全局可写的 /tmp)
+CACHE_DIR = os.environ.get('RESULT_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), '.lgurt_cache'))
+CACHE_MEMORY_BYTES = int(os.environ.get('RESULT_CACHE_MEMORY_MB', 128)) * 1024 * 1024
+CACHE_DISK_BYTES = int(os.environ.get('RESULT_CACHE_DISK_MB', 1024)) * 1024 * 1024
+# 超限时淘汰到上限的该比例，避免接近上限时每次写入都扫描目录
+DISK_LOW_WATER = 0.9
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(source):
+    """上传内容的SHA-256 (路径或可seek的流，读完回到开头)"""
+    h = hashlib.sha256()
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(HASH_CHUNK), b''):
+        h.update(chunk)
+    source.seek(0)
+    return h.hexdigest()
+
+
+def private_dir(path):
+    """创建 (0700) 并检查目录：是当前用户所有的真实目录时返回True，同时收回组/其他用户的权限"""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, 'getuid'):
+        if st.st_uid != os.getuid():
+            return False
+        if st.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return True
+
+
+def params_digest(params):
+    """参数字典的稳定摘要"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    两级缓存：值以pickle字节保存 (大小可计、取出即副本)
+    内存层按LRU淘汰；磁盘层多进程共享，按修改时间淘汰
+    (本进程写入时累加占用估计，超过上限才扫描目录淘汰，扫描后按实际占用校正)
+    """
+
+    def __init__(self, directory=CACHE_DIR, memory_bytes=CACHE_MEMORY_BYTES, disk_bytes=CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # 磁盘层：目录检查结果 (None为尚未检查) 与占用字节数估计
+        self._disk_ok = None
+        self._disk_size = 0
+
+    def get(self, key):
+        with self._lock:
+            blob = self._items.get(key)
+            if blob is not None:
+                self._items.move_to_end(key)
+        if blob is None:
+            blob = self._disk_get(key)
+            if blob is None:
+                return None
+            self._memory_put(key, blob)
+        return pickle.loads(blob)
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory_put(key, blob)
+        self._disk_put(key, blob)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+        if self._disk_ready():
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pkl'):
+                    os.remove(entry.path)
+            self._disk_size = 0
+
+    # ---------- 内存层 ----------
+    def _memory_put(self, key, blob):
+        if len(blob) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = blob
+            self._size += len(blob)
+            while self._size > self.memory_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    # ---------- 磁盘层 ----------
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.pkl')
+
+    def _disk_ready(self):
+        """首次使用磁盘层时检查目录并统计已有占用；不是私有目录时本进程不再使用磁盘层"""
+        if self.disk_bytes <= 0:
+            return False
+        if self._disk_ok is None:
+            self._disk_ok = private_dir(self.directory)
+            if self._disk_ok:
+                self._disk_size = sum(size for _, size, _ in self._disk_entries())
+            else:
+                print(f"⚠️ Result cache dir {self.directory} is not a private directory of this user, disk cache disabled")
+        return self._disk_ok
+
+    def _disk_entries(self):
+        """[(修改时间, 字节数, 路径)]"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _disk_get(self, key):
+        if not self._disk_ready():
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.utime(path)
+            return blob
+        except OSError:
+            return None
+
+    def _disk_put(self, key, blob):
+        if len(blob) > self.disk_bytes or not self._disk_ready():
+            return
+        path = self._path(key)
+        try:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            with self._lock:
+                self._disk_size += len(blob) - replaced
+                over = self._disk_size > self.disk_bytes
+            if over:
+                self._disk_evict()
+        except OSError as e:
+            print(f"⚠️ Result cache write error: {e}")
+
+    def _disk_evict(self):
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        with self._lock:
+            self._disk_size = total
+        if total <= self.disk_bytes:
+            return
+        entries.sort()
+        target = self.disk_bytes * DISK_LOW_WATER
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= target:
+                break
+        with self._lock:
+            self._disk_size = total
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,54 @@
+"""
+LGURT Dashboard v5.1 - SKU Roles
+按用户持久化SKU角色 (盈利/引流/防御/测试)，未设置的SKU视为盈利款
+上传/派生run时把角色快照写入params，计算结果与当时的角色一一对应
+"""
+from datetime import datetime, timezone
+
+from data_processor import SKU_ROLE_CONFIG
+
+DEFAULT_ROLE = 'profit'
+
+ROLES_SCHEMA = '''CREATE TABLE IF NOT EXISTS sku_roles (
+    user_id INTEGER NOT NULL,
+    sku TEXT NOT NULL,
+    role TEXT NOT NULL,
+    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, sku)
+) WITHOUT ROWID'''
+
+
+def get_roles(conn, user_id):
+    """{sku: {'role', 'assigned_at'}} (只含非默认角色)"""
+    rows = conn.execute("SELECT sku, role, assigned_at FROM sku_roles WHERE user_id = ? ORDER BY sku", (user_id,))
+    return {r['sku']: {'role': r['role'], 'assigned_at': r['assigned_at']} for r in rows}
+
+
+def set_roles(conn, user_id, roles):
+    """
+    批量设置 {sku: role} (调用方负责commit)；设为默认角色即删除记录
+    角色未变化的SKU保留原指定时间 (窗口期从首次指定起算)
+    """
+    unknown = sorted({r for r in roles.values() if r not in SKU_ROLE_CONFIG})
+    if unknown:
+        raise ValueError(f"未知角色: {', '.join(map(str, unknown))}")
+    cur = conn.cursor()
+    cur.executemany("DELETE FROM sku_roles WHERE user_id = ? AND sku = ?",
+                    ((user_id, sku) for sku, role in roles.items() if role == DEFAULT_ROLE))
+    cur.executemany(
+        "INSERT INTO sku_roles (user_id, sku, role) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, sku) DO UPDATE SET role = excluded.role, assigned_at = CURRENT_TIMESTAMP "
+        "WHERE sku_roles.role != excluded.role",
+        ((user_id, sku, role) for sku, role in roles.items() if role != DEFAULT_ROLE))
+
+
+def snapshot(conn, user_id, now=None):
+    """计算用的角色快照 {sku: [role, 已指定周数]}；assigned_at 为SQLite CURRENT_TIMESTAMP (UTC，不带时区)"""
+    now = now or datetime.now(timezone.utc)
+    result = {}
+    for sku, info in get_roles(conn, user_id).items():
+        assigned = datetime.fromisoformat(info['assigned_at'])
+        if assigned.tzinfo is None:
+            assigned = assigned.replace(tzinfo=timezone.utc)
+        result[sku] = [info['role'], max(0, (now - assigned).days // 7)]
+    return result
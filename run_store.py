@@ -0,0 +1,699 @@
+"""
+LGURT Dashboard v5.1 - Run Store
+ResultBundle落库/读取：summary/ads/config 存 run_results 的JSON列，SKU/库存/诊断整体编码为压缩列式blob (bundle_codec)，
+另把每个SKU的关键指标存为一行 (run_skus)，跨run查询单个SKU走索引，不解码blob
+"""
+import base64
+import json
+
+import numpy as np
+
+import bundle_codec
+import diagnostics
+import metrics
+import sku_table
+import trends
+from replenishment import STATUS_ORDER
+from sku_table import SkuTable
+
+# (ResultBundle字段, 旧版宽行表列名)，用于读取迁移前的数据
+SKU_COLUMNS = (
+    ('sku', 'sku'), ('asin', 'asin'), ('name', 'name'), ('cat', 'cat'),
+    ('units', 'units'), ('du', 'du'), ('rev', 'rev'), ('ref', 'ref'), ('fba', 'fba'),
+    ('cogs', 'cogs'), ('frt', 'frt'), ('rfmFee', 'rfm_fee'), ('pp', 'pp'), ('pm', 'pm'),
+    ('adSpend', 'ad_spend'), ('adImp', 'ad_imp'), ('adClk', 'ad_clk'), ('adSales', 'ad_sales'),
+    ('op', 'op'), ('om', 'om'), ('ar', 'ar'), ('acos', 'acos'), ('roas', 'roas'),
+    ('ful', 'ful'), ('inb', 'inb'), ('rsv', 'rsv')
+)
+INVENTORY_COLUMNS = (
+    ('sku', 'sku'), ('sellableDOS', 'sellable_dos'), ('totalDOS', 'total_dos'),
+    ('stockoutGap', 'stockout_gap'), ('status', 'status'), ('overstockRisk', 'overstock_risk'),
+    ('ropUnits', 'rop_units'), ('targetUnits', 'target_units'),
+    ('availableUnits', 'available_units'), ('orderQty', 'order_qty')
+)
+DIAGNOSTIC_COLUMNS = (
+    ('sku', 'sku'), ('quadrant', 'quadrant'), ('adContrib', 'ad_contrib'),
+    ('issues', 'issues_json'), ('actions', 'actions_json'), ('stopLoss', 'stop_loss_json'),
+    ('isHealthy', 'is_healthy')
+)
+BOOL_FIELDS = ('overstockRisk', 'isHealthy')
+JSON_FIELDS = ('issues', 'actions', 'stopLoss')
+# 诊断问题位 (新run的诊断只存问题位，JSON_FIELDS 的文本按需生成)
+DIAGNOSTIC_FLAG_FIELDS = ('flags', 'criticalCount')
+
+# 旧版宽行表 → (bundle中的表名, 字段)
+ROW_TABLES = {
+    'run_skus': ('skus', SKU_COLUMNS),
+    'run_inventory': ('inventory', INVENTORY_COLUMNS),
+    'run_diagnostics': ('diagnostics', DIAGNOSTIC_COLUMNS)
+}
+# 逐SKU的结果表 (存入压缩blob)；roles为按角色的止损/预算计划
+BUNDLE_TABLES = tuple(name for name, _ in ROW_TABLES.values()) + ('roles',)
+# 补货引擎新增的库存字段 (旧run没有)
+REPLENISHMENT_FIELDS = ('demandRate', 'leadTime', 'priority')
+ROLE_FIELDS = ('role', 'weeksInRole', 'allowedLoss', 'stopLoss', 'belowAllowed', 'windowExpired',
+               'stopLossTriggered', 'adBudget', 'budgetCut')
+
+# 逐SKU关键指标行 (表名, 字段, 列名)：库存/诊断按位置与SKU对齐；完整结果仍以blob为准
+SKU_ROW_COLUMNS = (
+    ('skus', 'sku', 'sku'), ('skus', 'units', 'units'), ('skus', 'du', 'du'), ('skus', 'rev', 'rev'),
+    ('skus', 'pp', 'pp'), ('skus', 'pm', 'pm'), ('skus', 'op', 'op'), ('skus', 'om', 'om'),
+    ('skus', 'adSpend', 'ad_spend'), ('skus', 'adSales', 'ad_sales'), ('skus', 'ar', 'ar'), ('skus', 'acos', 'acos'),
+    ('skus', 'ful', 'ful'), ('skus', 'inb', 'inb'), ('skus', 'rsv', 'rsv'),
+    ('inventory', 'demandRate', 'demand_rate'), ('inventory', 'sellableDOS', 'sellable_dos'),
+    ('inventory', 'status', 'status'), ('inventory', 'orderQty', 'order_qty'),
+    ('diagnostics', 'quadrant', 'quadrant'), ('diagnostics', 'flags', 'flags')
+)
+SKU_ROW_TYPES = {'sku': 'TEXT NOT NULL', 'status': 'TEXT', 'quadrant': 'TEXT', 'flags': 'INTEGER'}
+SKU_ROWS_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS run_skus (
+        run_id TEXT NOT NULL,
+        pos INTEGER NOT NULL,
+        %s,
+        PRIMARY KEY (run_id, pos)
+    ) WITHOUT ROWID''' % ',\n        '.join(f"{col} {SKU_ROW_TYPES.get(col, 'REAL')}" for _, _, col in SKU_ROW_COLUMNS),
+    'CREATE INDEX IF NOT EXISTS idx_run_skus_sku_run ON run_skus (sku, run_id)',
+)
+SKU_RUNS_LIMIT = 12
+
+RUN_TABLES_SCHEMA = SKU_ROWS_SCHEMA + (
+    'CREATE INDEX IF NOT EXISTS idx_runs_user_created ON runs (user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_run_results_run ON run_results (run_id)',
+    # 诊断倒排索引：键 (quadrant:<象限> / flag:<问题位> / critical:<严重问题数>) → SKU位置 (<i4数组)
+    '''CREATE TABLE IF NOT EXISTS run_diag_index (
+        run_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        positions BLOB NOT NULL,
+        PRIMARY KEY (run_id, key)
+    ) WITHOUT ROWID''',
+)
+
+
+def encode_bundle(bundle):
+    """ResultBundle中按列存储的表 → 压缩blob"""
+    return bundle_codec.encode({name: bundle[name] for name in BUNDLE_TABLES if name in bundle})
+
+
+def save_run(conn, run_id, user_id, file_name, params, bundle, algo_version, parent_run_id=None, batch_id=None,
+             blob=None, trend=None, created_at=None):
+    """
+    ResultBundle落库 (调用方负责commit)；parent_run_id: 由已有run改参数派生时的来源run；
+    batch_id: 批量上传时同一批的各文件run与组合run共用；blob: 已在工作进程中编码好的 encode_bundle(bundle)
+    trend: 是否写入趋势点，默认只有非派生run写入 (批量上传的各文件run由组合run代表，传False)
+    created_at: 数据所属时间 (命令行回填历史工作簿时按期指定)，默认为当前时间
+    checksum_rev/checksum_op 取聚合时累加的SKU合计 (summary.rev/op)，不再额外扫描SKU
+    """
+    # 耗时含列式编码压缩，不含调用方的commit
+    with metrics.DB_WRITE_SECONDS.time():
+        if blob is None:
+            blob = encode_bundle(bundle)
+        cur = conn.cursor()
+        cur.execute('INSERT INTO runs (id, user_id, file_name, days, algo_version, params_json, source_hash, '
+                    'parent_run_id, batch_id, checksum_rev, checksum_op, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                    (run_id, user_id, file_name, params.get('days'), algo_version, json.dumps(params),
+                     bundle.get('source_hash'), parent_run_id, batch_id, bundle['summary'].get('rev'),
+                     bundle['summary'].get('op'), created_at))
+        cur.execute('INSERT INTO run_results (run_id, summary_json, ads_json, config_json, bundle_blob) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (run_id, json.dumps(bundle['summary']), json.dumps(bundle['ads']), json.dumps(params), blob))
+        save_diag_index(cur, run_id, bundle['diagnostics'])
+        save_sku_rows(cur, run_id, lambda table, key: sku_table.values(bundle.get(table) or [], key))
+        if trend is None:
+            trend = parent_run_id is None
+        if trend:
+            trends.record_run(cur, run_id, user_id, bundle['summary'], bundle['skus'],
+                              sku_table.values(bundle['inventory'], 'demandRate'))
+    metrics.BYTES.inc(len(blob), kind='bundle')
+
+
+def save_diag_index(cur, run_id, records):
+    cur.executemany("INSERT OR REPLACE INTO run_diag_index (run_id, key, positions) VALUES (?, ?, ?)",
+                    ((run_id, key, positions.tobytes()) for key, positions in diagnostics.build_index(records).items()))
+
+
+def save_sku_rows(cur, run_id, column):
+    """逐SKU关键指标行；column(表名, 字段) → 该表整列 (库存/诊断缺失的位置为None)"""
+    sku = column('skus', 'sku')
+    n = len(sku)
+    cols = [sku] + [(column(table, key)[:n] + [None] * n)[:n] for table, key, _ in SKU_ROW_COLUMNS[1:]]
+    names = ', '.join(col for _, _, col in SKU_ROW_COLUMNS)
+    marks = ', '.join('?' * (len(SKU_ROW_COLUMNS) + 2))
+    cur.executemany(f"INSERT OR REPLACE INTO run_skus (run_id, pos, {names}) VALUES ({marks})",
+                    ((run_id, pos) + row for pos, row in enumerate(zip(*cols))))
+
+
+def delete_run(conn, run_id, user_id):
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM runs WHERE id = ? AND user_id = ?", (run_id, user_id))
+    if not cur.fetchone():
+        return
+    cur.execute("DELETE FROM run_results WHERE run_id = ?", (run_id,))
+    cur.execute("DELETE FROM run_diag_index WHERE run_id = ?", (run_id,))
+    cur.execute("DELETE FROM run_skus WHERE run_id = ?", (run_id,))
+    trends.remove_run(cur, run_id)
+    cur.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+
+def load_columns(conn, run_id, names=None, keys=None):
+    """解码某个run的压缩blob → {表名: (记录数, {字段: 值列表})}，names/keys: 只解码指定的表/字段"""
+    row = conn.execute("SELECT bundle_blob FROM run_results WHERE run_id = ?", (run_id,)).fetchone()
+    return bundle_codec.decode_columns(row[0], names, keys) if row and row[0] else {}
+
+
+def load_tables(conn, run_id, names=None, missing=()):
+    """同 load_columns，但返回 SkuTable；run中没有的表取 missing (默认空列表，传None可区分)"""
+    columns = load_columns(conn, run_id, names)
+    return {name: SkuTable.from_columns(*columns[name]) if name in columns
+            else (list(missing) if missing is not None else None)
+            for name in BUNDLE_TABLES if names is None or name in names}
+
+
+def load_run(conn, run_id, run):
+    """回放payload {'run_id', 'summary', 'skus', 'checksum'}；run: 含 checksum_rev/checksum_op 的runs行"""
+    row = conn.execute("SELECT summary_json FROM run_results WHERE run_id = ?", (run_id,)).fetchone()
+    summary = json.loads(row['summary_json']) if row else {}
+    columns = load_columns(conn, run_id, ('skus',))
+    n, skus = columns.get('skus', (0, {}))
+    # 回放时顺带校验 (SKU已解码，只多一次求和)
+    verify = check(stored_checksum(run), summary, column_totals(skus))
+    return {'run_id': run_id, 'summary': summary, 'skus': bundle_codec.columns_to_records(n, skus), 'checksum': verify}
+
+
+# ==================== 分页查询 ====================
+# 排序键 → (所在表, 空值排序时的取值)；sellableDOS为空表示无销量，排在最低；priority为预先算好的断货优先名次
+SORT_KEYS = {
+    'op': ('skus', 0),
+    'rev': ('skus', 0),
+    'acos': ('skus', 0),
+    'sellableDOS': ('inventory', -1),
+    'priority': ('inventory', 0)
+}
+# 筛选参数 → (所在表, 字段)
+FILTER_FIELDS = {
+    'cat': ('skus', 'cat'),
+    'quadrant': ('diagnostics', 'quadrant'),
+    'status': ('inventory', 'status'),
+    'min_rev': ('skus', 'rev'),
+    'role': ('roles', 'role')
+}
+# 可投影字段 → 所在表 (SKU表优先，其次库存/诊断/角色计划)
+FIELD_TABLES = {key: name
+                for name, keys in (('roles', ROLE_FIELDS),
+                                   ('diagnostics', [k for k, _ in DIAGNOSTIC_COLUMNS] + list(DIAGNOSTIC_FLAG_FIELDS)),
+                                   ('inventory', [k for k, _ in INVENTORY_COLUMNS] + list(REPLENISHMENT_FIELDS)),
+                                   ('skus', [k for k, _ in SKU_COLUMNS]))
+                for key in keys}
+DEFAULT_FIELDS = tuple(key for key, _ in SKU_COLUMNS)
+# 生成诊断文本需要的列
+RENDER_COLUMNS = ({('skus', k) for k in diagnostics.SKU_FIELDS} | {('diagnostics', 'quadrant'), ('diagnostics', 'flags')}
+                  | {('roles', k) for k in diagnostics.ROLE_FIELDS} | {('inventory', 'demandRate')})
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, checks):
+    """解析游标，checks: 每一项的校验函数；格式或类型不符 (如被篡改) 时抛ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('无效的cursor')
+    if (not isinstance(values, list) or len(values) != len(checks)
+            or not all(check(v) for check, v in zip(checks, values))):
+        raise ValueError('无效的cursor')
+    return values
+
+
+# 游标项的校验
+def is_text(value):
+    return isinstance(value, str)
+
+
+def is_number(value):
+    # 排序键可为±inf (json的Infinity)，不可为NaN
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+
+
+def is_position(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def is_none(value):
+    return value is None
+
+
+def sku_runs(conn, user_id, sku, limit=SKU_RUNS_LIMIT):
+    """
+    单个SKU在最近 limit 个run中的关键指标 (按时间倒序，含派生/批量run；同一run中重复的SKU各一行)
+    只读 run_skus 的 (sku, run_id) 索引与runs，不解码blob
+    """
+    cols = ', '.join(f's.{col}' for _, _, col in SKU_ROW_COLUMNS[1:])
+    rows = conn.execute(
+        f"SELECT r.id, r.created_at, r.file_name, r.parent_run_id, r.batch_id, s.pos, {cols} FROM "
+        "(SELECT DISTINCT r.id, r.created_at, r.file_name, r.parent_run_id, r.batch_id FROM run_skus s "
+        " JOIN runs r ON r.id = s.run_id WHERE s.sku = ? AND r.user_id = ? "
+        " ORDER BY r.created_at DESC, r.id DESC LIMIT ?) r "
+        "JOIN run_skus s ON s.sku = ? AND s.run_id = r.id ORDER BY r.created_at DESC, r.id DESC, s.pos",
+        (sku, user_id, limit, sku)).fetchall()
+    keys = ('run_id', 'created_at', 'file_name', 'parent_run_id', 'batch_id', 'pos') + tuple(
+        key for _, key, _ in SKU_ROW_COLUMNS[1:])
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def list_runs(conn, user_id, cursor=None, limit=50):
+    """按创建时间倒序分页列出run，游标为上一页最后一条的 (created_at, id)"""
+    sql = 'SELECT id, created_at, file_name, days, batch_id FROM runs WHERE user_id = ?'
+    args = [user_id]
+    if cursor:
+        sql += ' AND (created_at, id) < (?, ?)'
+        args += decode_cursor(cursor, (is_text, is_text))
+    sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    rows = [dict(r) for r in conn.execute(sql, args + [limit + 1])]
+    next_cursor = encode_cursor([rows[limit - 1]['created_at'], rows[limit - 1]['id']]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def query_skus(conn, run_id, filters=None, sort='op', order='desc', fields=None, cursor=None, limit=100):
+    """
+    单个run的SKU分页查询：只解码用到的列，在列上筛选/排序后按位置投影
+    filters: cat / quadrant / status / min_rev / role；sort: SORT_KEYS；fields: 投影字段
+    返回 (记录列表, 总数, 下一页游标)，游标为上一页最后一条的 (排序值, 位置)
+    """
+    fields = tuple(fields or DEFAULT_FIELDS)
+    column, keys, hits = select_skus(conn, run_id, filters, sort, order, fields)
+    total = len(hits)
+    if cursor:
+        after_key, after_pos = decode_cursor(cursor, (is_number, is_position))
+        hit_keys = keys[hits]
+        if order != 'asc':
+            hits = hits[(hit_keys < after_key) | ((hit_keys == after_key) & (hits < after_pos))]
+        else:
+            hits = hits[(hit_keys > after_key) | ((hit_keys == after_key) & (hits > after_pos))]
+    page = hits[:limit + 1].tolist()
+
+    low_threshold = run_params(conn, run_id).get('low_stock_threshold', 7)
+    records = next(iter_records(column, fields, page[:limit], low_threshold), [])
+    last = page[limit - 1] if len(page) > limit else None
+    next_cursor = encode_cursor([keys[last].item(), last]) if last is not None else None
+    return records, total, next_cursor
+
+
+def select_skus(conn, run_id, filters=None, sort='op', order='desc', fields=DEFAULT_FIELDS):
+    """
+    校验参数并只解码用到的列，在列上筛选/排序
+    返回 (column(表, 字段) → 与SKU按位置对齐的整列, 排序键数组, 命中的位置数组 (已按排序))
+    """
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    unknown = [f for f in fields if f not in FIELD_TABLES]
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(unknown)}")
+    if sort not in SORT_KEYS:
+        raise ValueError(f"不支持的排序键: {sort}")
+    sort_table, sort_missing = SORT_KEYS[sort]
+    text = any(f in JSON_FIELDS for f in fields)
+    wanted = ({(FIELD_TABLES[f], f) for f in fields if f not in JSON_FIELDS} | {(sort_table, sort)}
+              | {FILTER_FIELDS[k] for k in filters} | (RENDER_COLUMNS if text else set()))
+
+    tables = load_columns(conn, run_id, {'skus'} | {t for t, _ in wanted}, {k for _, k in wanted})
+    n = tables['skus'][0] if 'skus' in tables else 0
+
+    def column(table, key):
+        # 库存/诊断按位置与SKU对齐，缺失位置为None
+        _, columns = tables.get(table, (0, {}))
+        values = columns.get(key, [])[:n]
+        return values + [None] * (n - len(values))
+
+    mask = np.ones(n, dtype=bool)
+    for key, value in filters.items():
+        table, field = FILTER_FIELDS[key]
+        values = column(table, field)
+        if key == 'min_rev':
+            mask &= np.array([v is not None and v >= value for v in values], dtype=bool)
+        else:
+            mask &= np.array([v == value for v in values], dtype=bool)
+
+    keys = np.array([sort_missing if v is None else v for v in column(sort_table, sort)], dtype=np.float64)
+    order_idx = np.lexsort((np.arange(n), keys))
+    if order != 'asc':
+        order_idx = order_idx[::-1]
+    return column, keys, order_idx[mask[order_idx]]
+
+
+def iter_records(column, fields, positions, low_threshold=7, chunk=None):
+    """按位置逐块投影记录 (每块一个列表，chunk为空时整体一块)；诊断文本 (JSON_FIELDS) 只为当前块生成"""
+    projected = {f: column(FIELD_TABLES[f], f) for f in fields if f not in JSON_FIELDS}
+    render = text_renderer(column, low_threshold) if any(f in JSON_FIELDS for f in fields) else None
+    chunk = chunk or max(len(positions), 1)
+    for start in range(0, len(positions), chunk):
+        block = positions[start:start + chunk]
+        if render is None:
+            yield [{f: projected[f][p] for f in fields} for p in block]
+            continue
+        texts = [render(p) or dict.fromkeys(JSON_FIELDS) for p in block]
+        yield [{f: text[f] if f in JSON_FIELDS else projected[f][p] for f in fields} for p, text in zip(block, texts)]
+
+
+def run_params(conn, run_id):
+    row = conn.execute("SELECT params_json FROM runs WHERE id = ?", (run_id,)).fetchone()
+    return json.loads(row[0] or '{}') if row else {}
+
+
+def text_renderer(column, low_threshold=7):
+    """返回 render(位置) → {'issues', 'actions', 'stopLoss'} (该位置无诊断时为None)，column(表, 字段) 取对齐后的整列"""
+    sku_cols = {k: column('skus', k) for k in diagnostics.SKU_FIELDS}
+    sku_cols['demandRate'] = column('inventory', 'demandRate')
+    diag_cols = {k: column('diagnostics', k) for k in ('quadrant', 'flags')}
+    role_cols = {k: column('roles', k) for k in diagnostics.ROLE_FIELDS}
+
+    def render(p):
+        if diag_cols['flags'][p] is None:
+            return None
+        sku = {k: v[p] for k, v in sku_cols.items()}
+        role = {k: v[p] for k, v in role_cols.items()} if role_cols['role'][p] is not None else None
+        return diagnostics.render(sku, {k: v[p] for k, v in diag_cols.items()}, role, low_threshold)
+    return render
+
+
+def query_diagnostics(conn, run_id, quadrant=None, flags=(), min_critical=None, cursor=None, limit=100):
+    """
+    按诊断倒排索引查询：quadrant 象限、flags 须同时具备的问题位名称、min_critical 严重问题数下限
+    只读取命中的索引键并求交集，按SKU位置分页，文本只为本页生成
+    返回 (记录列表, 总数, 下一页游标)，游标为上一页最后一条的位置
+    """
+    if quadrant is not None and quadrant not in diagnostics.QUADRANTS:
+        raise ValueError(f"未知象限: {quadrant}")
+    unknown = [f for f in flags if f not in diagnostics.FLAGS]
+    if unknown:
+        raise ValueError(f"未知问题位: {', '.join(unknown)}")
+    if min_critical is not None and min_critical < 1:
+        raise ValueError('min_critical 必须≥1')
+
+    groups = [[f'flag:{f}'] for f in flags]
+    if quadrant is not None:
+        groups.append([f'quadrant:{quadrant}'])
+    if min_critical is not None:
+        groups.append([f'critical:{k}' for k in range(min_critical, diagnostics.MAX_CRITICAL + 1)])
+    keys = [k for group in groups for k in group]
+    placeholders = ', '.join('?' * len(keys))
+    postings = {r[0]: np.frombuffer(r[1], dtype='<i4') for r in conn.execute(
+        f"SELECT key, positions FROM run_diag_index WHERE run_id = ? AND key IN ({placeholders})", [run_id] + keys)}
+
+    n = load_columns(conn, run_id, ('diagnostics',), ('sku',)).get('diagnostics', (0, {}))[0]
+    matches = np.arange(n, dtype='<i4')
+    for group in groups:
+        # 同组各键互斥 (如 critical:2 / critical:3)，合并后仍有序
+        union = np.sort(np.concatenate([postings.get(k, np.empty(0, dtype='<i4')) for k in group]))
+        matches = np.intersect1d(matches, union, assume_unique=True)
+    total = len(matches)
+    if cursor:
+        _, after = decode_cursor(cursor, (is_none, is_position))
+        matches = matches[np.searchsorted(matches, after, side='right'):]
+    page = matches[:limit + 1].tolist()
+
+    wanted = RENDER_COLUMNS | {('diagnostics', k) for k in ('sku', 'adContrib', 'criticalCount', 'isHealthy')}
+    tables = load_columns(conn, run_id, {t for t, _ in wanted}, {k for _, k in wanted})
+
+    def column(table, key):
+        _, columns = tables.get(table, (0, {}))
+        values = columns.get(key, [])[:n]
+        return values + [None] * (n - len(values))
+
+    diag = {k: column('diagnostics', k)
+            for k in ('sku', 'quadrant', 'adContrib', 'flags', 'criticalCount', 'isHealthy')}
+    roles = column('roles', 'role')
+    render = text_renderer(column, run_params(conn, run_id).get('low_stock_threshold', 7))
+    records = [{**{k: v[p] for k, v in diag.items()}, 'role': roles[p], **render(p)} for p in page[:limit]]
+    next_cursor = encode_cursor([None, page[limit - 1]]) if len(page) > limit else None
+    return records, total, next_cursor
+
+
+def diagnostic_counts(conn, run_id):
+    """各索引键的SKU数 (只读索引长度)"""
+    return {r[0]: r[1] // 4 for r in conn.execute(
+        "SELECT key, length(positions) FROM run_diag_index WHERE run_id = ? ORDER BY key", (run_id,))}
+
+
+def inventory_counts(conn, run_id):
+    """库存页顶部的各状态SKU数 + 积压风险数 (只解码状态两列)"""
+    n, columns = load_columns(conn, run_id, ('inventory',), ('status', 'overstockRisk')).get('inventory', (0, {}))
+    status = np.array(columns.get('status', []), dtype=object)
+    counts = {name: int((status == name).sum()) for name in STATUS_ORDER}
+    counts['overstock'] = int(np.count_nonzero(columns.get('overstockRisk', [])))
+    return counts
+
+
+# ==================== 一致性校验 ====================
+# 金额差异容差
+CHECKSUM_TOLERANCE = 0.01
+CHECKSUM_FIELDS = ('rev', 'op')
+VERIFY_BATCH = 50
+
+
+def check(checksum, summary, totals):
+    """
+    落库时记录的checksum 与 summary、SKU列合计逐项比较 (旧run没有checksum时只比较后两者)
+    返回 {'is_consistent', 'checksum', 'difference'}，difference为各项的最大偏差
+    """
+    difference = {}
+    for k in CHECKSUM_FIELDS:
+        values = [v for v in (checksum.get(k) if checksum else None, summary.get(k), totals.get(k)) if v is not None]
+        difference[k] = round(max(values) - min(values), 2) if len(values) > 1 else None
+    consistent = all(d is not None and d <= CHECKSUM_TOLERANCE for d in difference.values())
+    return {'is_consistent': consistent, 'checksum': checksum, 'difference': difference}
+
+
+def column_totals(columns):
+    """SKU表 rev/op 列合计 (与聚合时按SKU顺序累加一致)"""
+    return {k: sum(columns[k]) for k in CHECKSUM_FIELDS if k in columns}
+
+
+def stored_checksum(row):
+    return {'rev': row['checksum_rev'], 'op': row['checksum_op']} if row['checksum_rev'] is not None else None
+
+
+def verify_run(conn, run_id):
+    """单个run的一致性校验，只解码SKU表的 rev/op 两列"""
+    row = conn.execute("SELECT r.checksum_rev, r.checksum_op, rr.summary_json FROM runs r "
+                       "JOIN run_results rr ON rr.run_id = r.id WHERE r.id = ?", (run_id,)).fetchone()
+    if row is None:
+        return None
+    _, columns = load_columns(conn, run_id, ('skus',), CHECKSUM_FIELDS).get('skus', (0, {}))
+    return check(stored_checksum(row), json.loads(row['summary_json'] or '{}'), column_totals(columns))
+
+
+def verify_all(conn, batch=VERIFY_BATCH):
+    """
+    按run_id分批流式扫描全库 → 逐个生成 (run_id, 校验结果)
+    每批一个短查询 (不长时间占用读事务)，内存只与批大小有关，每个blob只解码 rev/op 两列
+    """
+    after = ''
+    while True:
+        rows = conn.execute("SELECT r.id, r.checksum_rev, r.checksum_op, rr.summary_json, rr.bundle_blob FROM runs r "
+                            "JOIN run_results rr ON rr.run_id = r.id WHERE r.id > ? ORDER BY r.id LIMIT ?",
+                            (after, batch)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            columns = {}
+            if row['bundle_blob']:
+                _, columns = bundle_codec.decode_columns(row['bundle_blob'], ('skus',), CHECKSUM_FIELDS).get('skus', (0, {}))
+            yield row['id'], check(stored_checksum(row), json.loads(row['summary_json'] or '{}'), column_totals(columns))
+        after = rows[-1]['id']
+        del rows
+
+
+# ==================== 迁移 ====================
+def split_result_blobs(cur):
+    """把旧版 run_results 中的 skus/inventory/diagnostics JSON 转为压缩blob，并清空原JSON"""
+    pending = cur.execute("SELECT run_id FROM run_results WHERE skus_json IS NOT NULL").fetchall()
+    for (run_id,) in pending:
+        row = cur.execute("SELECT skus_json, inventory_json, diagnostics_json FROM run_results WHERE run_id = ?",
+                          (run_id,)).fetchone()
+        blob = bundle_codec.encode({name: json.loads(data) if data else [] for name, data in zip(BUNDLE_TABLES, row)})
+        cur.execute("UPDATE run_results SET bundle_blob = ?, skus_json = NULL, inventory_json = NULL, "
+                    "diagnostics_json = NULL WHERE run_id = ?", (blob, run_id))
+    return [run_id for (run_id,) in pending]
+
+
+def stored_skus(cur, run_id):
+    """迁移用：优先读压缩blob，尚未压缩的run读旧版宽行表"""
+    row = cur.execute("SELECT bundle_blob FROM run_results WHERE run_id = ?", (run_id,)).fetchone()
+    if row and row[0]:
+        return bundle_codec.decode(row[0], ('skus',)).get('skus', [])
+    if has_legacy_rows(cur):
+        return legacy_rows(cur, 'run_skus', SKU_COLUMNS, run_id)
+    return []
+
+
+def backfill_trends(cur):
+    return trends.backfill(cur, stored_skus)
+
+
+def compact_row_tables(cur):
+    """旧版宽行表 (每个字段一列) → 压缩blob，转换后删除行表 (精简的 run_skus 在 index_sku_rows 中重建)"""
+    if not has_legacy_rows(cur):
+        return []
+    run_ids = [r[0] for r in cur.execute("SELECT DISTINCT run_id FROM run_skus").fetchall()]
+    for run_id in run_ids:
+        tables = {name: legacy_rows(cur, table, columns, run_id) for table, (name, columns) in ROW_TABLES.items()}
+        cur.execute("UPDATE run_results SET bundle_blob = ? WHERE run_id = ?", (bundle_codec.encode(tables), run_id))
+    for table in ROW_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    return run_ids
+
+
+def legacy_rows(cur, table, columns, run_id):
+    """读取旧版宽行表中某个run的完整记录"""
+    cols = ', '.join(col for _, col in columns)
+    records = []
+    for row in cur.execute(f"SELECT {cols} FROM {table} WHERE run_id = ? ORDER BY pos", (run_id,)).fetchall():
+        record = {}
+        for (key, _), value in zip(columns, row):
+            if key in BOOL_FIELDS:
+                value = bool(value)
+            elif key in JSON_FIELDS:
+                value = json.loads(value)
+            record[key] = value
+        records.append(record)
+    return records
+
+
+def compact_diagnostics(cur):
+    """旧版含文本的诊断 → 问题位，并建倒排索引 (按落库的SKU表/角色计划/参数重新诊断)"""
+    run_ids = [r[0] for r in cur.execute("SELECT run_id FROM run_results WHERE bundle_blob IS NOT NULL").fetchall()]
+    migrated = []
+    for run_id in run_ids:
+        row = cur.execute("SELECT rr.bundle_blob, r.params_json FROM run_results rr LEFT JOIN runs r ON r.id = rr.run_id "
+                          "WHERE rr.run_id = ?", (run_id,)).fetchone()
+        tables = bundle_codec.decode(row[0])
+        records = tables.get('diagnostics') or []
+        if records and 'flags' not in records[0]:
+            params = json.loads(row[1] or '{}')
+            tables['diagnostics'] = records = diagnostics.diagnose(tables.get('skus', []), params, tables.get('roles'))
+            cur.execute("UPDATE run_results SET bundle_blob = ? WHERE run_id = ?", (bundle_codec.encode(tables), run_id))
+            migrated.append(run_id)
+        save_diag_index(cur, run_id, records)
+    return migrated
+
+
+def backfill_checksums(cur):
+    """旧run补写checksum (取落库的summary合计)"""
+    rows = cur.execute("SELECT r.id, rr.summary_json FROM runs r JOIN run_results rr ON rr.run_id = r.id "
+                       "WHERE r.checksum_rev IS NULL").fetchall()
+    for run_id, summary_json in rows:
+        summary = json.loads(summary_json or '{}')
+        cur.execute("UPDATE runs SET checksum_rev = ?, checksum_op = ? WHERE id = ?",
+                    (summary.get('rev'), summary.get('op'), run_id))
+    return [run_id for run_id, _ in rows]
+
+
+def prune_trends(cur):
+    """趋势点只保留代表一期的run (按batch_id查同批组合run；batch_id为后加列，索引在此创建)"""
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_runs_batch ON runs (batch_id)')
+    return trends.prune(cur)
+
+
+def clear_default_role_flags(cur):
+    """未指定角色 (默认盈利款) 的SKU不产生角色问题：清除旧run中这些SKU的角色问题位，重算严重问题数/健康与倒排索引"""
+    migrated = []
+    for run_id, blob in cur.execute("SELECT run_id, bundle_blob FROM run_results WHERE bundle_blob IS NOT NULL").fetchall():
+        tables = bundle_codec.decode(blob)
+        records, role_plan = tables.get('diagnostics'), tables.get('roles')
+        if not records or not role_plan or 'flags' not in records[0]:
+            continue
+        flags = sku_table.array(records, 'flags', np.int64)
+        stale = ~diagnostics.assigned(role_plan) & (flags & diagnostics.ROLE_FLAGS != 0)
+        if not stale.any():
+            continue
+        flags = np.where(stale, flags & ~diagnostics.ROLE_FLAGS, flags)
+        eliminate = np.array(sku_table.values(records, 'quadrant'), dtype=object) == 'eliminate'
+        critical_count, healthy = diagnostics.severity(flags, eliminate)
+        for record, f, c, h in zip(records, flags.tolist(), critical_count.tolist(), healthy.tolist()):
+            record.update(flags=f, criticalCount=c, isHealthy=h)
+        cur.execute("UPDATE run_results SET bundle_blob = ? WHERE run_id = ?", (bundle_codec.encode(tables), run_id))
+        cur.execute("DELETE FROM run_diag_index WHERE run_id = ?", (run_id,))
+        save_diag_index(cur, run_id, records)
+        migrated.append(run_id)
+    return migrated
+
+
+def index_sku_rows(cur):
+    """为已有run补建逐SKU关键指标行 (旧版宽行表已在 compact_row_tables 中删除，这里重建精简表)"""
+    for statement in SKU_ROWS_SCHEMA:
+        cur.execute(statement)
+    pending = cur.execute("SELECT run_id FROM run_results rr WHERE bundle_blob IS NOT NULL "
+                          "AND NOT EXISTS (SELECT 1 FROM run_skus s WHERE s.run_id = rr.run_id)").fetchall()
+    names = {table for table, _, _ in SKU_ROW_COLUMNS}
+    keys = {key for _, key, _ in SKU_ROW_COLUMNS}
+    for (run_id,) in pending:
+        blob = cur.execute("SELECT bundle_blob FROM run_results WHERE run_id = ?", (run_id,)).fetchone()[0]
+        tables = bundle_codec.decode_columns(blob, names, keys)
+        save_sku_rows(cur, run_id, lambda table, key: tables.get(table, (0, {}))[1].get(key, []))
+    return [run_id for (run_id,) in pending]
+
+
+def has_legacy_rows(cur):
+    """旧版宽行表 (含全部SKU字段，如asin) 是否存在；精简的 run_skus 没有这些列"""
+    return has_column(cur, 'run_skus', 'asin')
+
+
+def has_column(cur, table, column):
+    return any(r[1] == column for r in cur.execute(f"PRAGMA table_info({table})").fetchall())
+
+
+def recount_portfolio_trends(cur):
+    """旧版店铺趋势点的可售天数按SKU原始行累加 (同一SKU多行时库存重复计入)：含重复SKU的run按合并后的SKU重写趋势点"""
+    migrated = []
+    rows = cur.execute("SELECT t.run_id, t.user_id, rr.summary_json, rr.bundle_blob FROM portfolio_trend t "
+                       "JOIN run_results rr ON rr.run_id = t.run_id WHERE rr.bundle_blob IS NOT NULL").fetchall()
+    for run_id, user_id, summary_json, blob in rows:
+        tables = bundle_codec.decode(blob, ('skus', 'inventory'))
+        skus, inventory = tables.get('skus', []), tables.get('inventory', [])
+        if len(set(sku_table.values(skus, 'sku'))) == len(skus):
+            continue
+        rates = sku_table.values(inventory, 'demandRate') if inventory and 'demandRate' in inventory[0] else None
+        trends.record_run(cur, run_id, user_id, json.loads(summary_json or '{}'), skus, rates)
+        migrated.append(run_id)
+    return migrated
+
+
+# (PRAGMA user_version, 迁移函数)，按版本顺序执行；迁移函数返回改动过的run_id
+MIGRATIONS = (
+    (1, split_result_blobs),
+    (2, backfill_trends),
+    (3, compact_row_tables),
+    (4, compact_diagnostics),
+    (5, backfill_checksums),
+    (6, prune_trends),
+    (7, clear_default_role_flags),
+    (8, index_sku_rows),
+    (9, recount_portfolio_trends),
+)
+
+
+# 建表之后新增的列 (表, 列, 类型)，旧库启动时补齐
+ADDED_COLUMNS = (
+    ('run_results', 'bundle_blob', 'BLOB'),
+    ('runs', 'source_hash', 'TEXT'),
+    ('runs', 'parent_run_id', 'TEXT'),
+    ('runs', 'batch_id', 'TEXT'),
+    ('jobs', 'batch_id', 'TEXT'),
+    ('jobs', 'result_json', 'TEXT'),
+)
+
+
+def migrate(conn):
+    """执行未应用的迁移，返回受影响的run数 (多个迁移改动同一run只计一次)"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    cur = conn.cursor()
+    for table, column, col_type in ADDED_COLUMNS:
+        if not has_column(cur, table, column):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+    migrated = set()
+    for target, step in MIGRATIONS:
+        if version < target:
+            migrated.update(step(cur))
+            cur.execute(f'PRAGMA user_version = {target}')
+    return len(migrated)
@@ -0,0 +1,171 @@
+"""
+LGURT Dashboard v5.1 - Scenarios
+What-if参数扫描：基于已落库的SKU表，对一组参数组合同时计算广告计划/库存/诊断的汇总指标
+场景为行、SKU为列，用NumPy广播一次算完，不重新解析Excel
+"""
+import math
+
+import numpy as np
+
+from pipeline import check_params
+from roles import DEFAULT_ROLE
+
+# 场景可调参数及默认值 (与 calc_inventory / generate_diagnostics 一致)
+SCENARIO_PARAMS = {
+    'lead_time_days': 35,
+    'safety_days': 30,
+    'target_cover_days': 90,
+    'low_stock_threshold': 7,
+    'overstock_threshold': 120,
+    'target_ad_ratio': None,    # 为空时按盈亏平衡广告占比×0.9
+    'category_lead_times': {}   # 类目头程覆盖，不随场景变化 (取run原参数)
+}
+MAX_SCENARIOS = 200
+
+# 用到的SKU字段 (另需 cat 与库存表的 demandRate)
+SKU_FIELDS = ('du', 'ful', 'inb', 'rsv', 'pm', 'ar', 'adSpend', 'adSales')
+# 数值型场景参数；天数/阈值与 PATCH 参数同样须为正整数，target_ad_ratio 为非负比例 (null即默认)
+NUMERIC_PARAMS = tuple(k for k in SCENARIO_PARAMS if k != 'category_lead_times')
+INT_PARAMS = tuple(k for k in NUMERIC_PARAMS if k != 'target_ad_ratio')
+# 角色计划中与诊断相关的字段 (与场景参数无关)
+ROLE_FIELDS = ('role', 'belowAllowed', 'stopLossTriggered')
+
+# 对比矩阵的列
+METRICS = (
+    'targetAdRatio', 'gap', 'finalAdRatio', 'phase2Weeks', 'salesImpactModerate', 'hasNonlinearRisk',
+    'critical', 'reorderNow', 'watch', 'healthy', 'noSales', 'overstock', 'stockoutSkus',
+    'ropUnits', 'orderUnits', 'lowStockIssues', 'unhealthy'
+)
+
+# 与 generate_ad_plan 的Phase2一致
+WEEKLY_REDUCTION = 0.015
+MAX_WEEKS = 12
+RISK_THRESHOLD = 5
+
+
+def scenario_grid(base_params, scenarios):
+    """请求中的参数组合 → 完整参数列表 (未给出的取run原参数)，非法输入抛ValueError"""
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError('scenarios 必须是非空数组')
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f'场景数不能超过{MAX_SCENARIOS}')
+    grid = []
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            raise ValueError('每个场景必须是参数对象')
+        unknown = [k for k in scenario if k not in NUMERIC_PARAMS]
+        if unknown:
+            raise ValueError(f"未知参数: {', '.join(unknown)}")
+        check_params({k: v for k, v in scenario.items() if k in INT_PARAMS}, INT_PARAMS)
+        ratio = scenario.get('target_ad_ratio')
+        if ratio is not None and (isinstance(ratio, bool) or not isinstance(ratio, (int, float))
+                                  or not math.isfinite(ratio) or ratio < 0):
+            raise ValueError('参数 target_ad_ratio 必须是非负数')
+        grid.append({**{k: base_params.get(k, default) for k, default in SCENARIO_PARAMS.items()}, **scenario})
+    return grid
+
+
+def run_scenarios(summary, ads, columns, grid, roles=None):
+    """
+    summary/ads: run的汇总与广告计划；columns: {字段: 值列表} (SKU_FIELDS + cat/demandRate)；grid: scenario_grid() 结果
+    roles: 角色计划的列 {字段: 值列表} (ROLE_FIELDS)，与诊断阶段一样按角色止损判断是否健康
+    返回 {'metrics': 列名, 'matrix': 每个场景一行}
+    """
+    col = {k: np.array(columns[k], dtype=float) for k in SKU_FIELDS + ('demandRate',)}
+    S = len(grid)
+    p = {k: np.array([g[k] if g[k] is not None else np.nan for g in grid], dtype=float)[:, None]
+         for k in NUMERIC_PARAMS}
+    # 有类目覆盖的SKU头程固定，其余随场景的 lead_time_days 变化
+    overrides = grid[0]['category_lead_times'] or {}
+    fixed_lead = np.array([overrides.get(c, np.nan) for c in columns['cat']], dtype=float)
+    p['lead_time'] = np.where(np.isnan(fixed_lead)[None, :], p['lead_time_days'], fixed_lead[None, :])
+
+    ad_cols = ad_metrics(summary, ads, p['target_ad_ratio'][:, 0])
+    inv_cols = inventory_metrics(col, p)
+    diag_cols = diagnostic_metrics(col, p, roles)
+    values = {**ad_cols, **inv_cols, **diag_cols}
+
+    matrix = [[values[m][i].item() for m in METRICS] for i in range(S)]
+    return {'metrics': list(METRICS), 'matrix': matrix}
+
+
+def ad_metrics(summary, ads, target_override):
+    """广告计划：目标占比、缺口、Phase2周数与最终占比 (Phase1与参数无关，取落库结果)"""
+    current = summary['ar']
+    daily_rev = summary['dRev']
+    break_even = summary['pm'] - (summary['mfDaily'] / daily_rev if daily_rev > 0 else 0)
+    target = np.where(np.isnan(target_override), max(0, break_even * 0.9), target_override)
+    gap = np.maximum(0, current - target)
+    ad_dependency = summary['adSales'] / summary['rev'] if summary['rev'] > 0 else 0
+
+    # Phase2 每周降 1.5pp，直到目标或最多12周
+    after_phase1 = ads['phase1']['afterRatio']
+    temp = np.full(len(target), after_phase1, dtype=float)
+    weeks = np.zeros(len(target), dtype=np.int64)
+    active = (after_phase1 - target) > 0
+    weeks_needed = np.where(active, np.floor((after_phase1 - target) / WEEKLY_REDUCTION) + 1, 0)
+    for w in range(1, MAX_WEEKS + 1):
+        reduction = np.minimum(WEEKLY_REDUCTION, temp - target)
+        active &= (w <= weeks_needed) & (reduction > 0)
+        temp = np.where(active, temp - reduction, temp)
+        weeks += active
+
+    total_pct = gap * 100
+    moderate_rate = round(ad_dependency * 0.5, 4)
+    return {
+        'targetAdRatio': np.round(target, 4),
+        'gap': np.round(gap, 4),
+        'finalAdRatio': np.round(temp, 4),
+        'phase2Weeks': weeks,
+        'salesImpactModerate': np.round(total_pct * moderate_rate, 1),
+        'hasNonlinearRisk': total_pct > RISK_THRESHOLD
+    }
+
+
+def inventory_metrics(col, p):
+    """库存 (与补货引擎一致，按平滑后的日均与逐SKU头程)：各状态SKU数、积压/断货风险数、补货点与建议补货量合计"""
+    du, ful, inb, rsv = col['demandRate'], col['ful'], col['inb'], col['rsv']
+    selling = du > 0
+    safe_du = np.where(selling, du, 1)
+    sellable = np.where(selling, ful / safe_du, np.nan)
+    total_dos = np.where(selling, (ful + inb - rsv) / safe_du, np.nan)
+    lead_time = p['lead_time']
+
+    critical = selling & (sellable < p['low_stock_threshold'])
+    reorder = selling & ~critical & (sellable < lead_time)
+    watch = selling & ~critical & ~reorder & (sellable < 15)
+    healthy = selling & ~critical & ~reorder & ~watch
+
+    rop = np.where(selling, np.rint((lead_time + p['safety_days']) * du), 0)
+    order = np.where(selling, np.rint(np.maximum(0, p['target_cover_days'] * du - (ful + inb - rsv))), 0)
+    return {
+        'critical': critical.sum(axis=1),
+        'reorderNow': reorder.sum(axis=1),
+        'watch': watch.sum(axis=1),
+        'healthy': healthy.sum(axis=1),
+        'noSales': np.full(len(lead_time), int((~selling).sum())),
+        'overstock': (selling & (total_dos > p['overstock_threshold'])).sum(axis=1),
+        'stockoutSkus': (selling & (lead_time - sellable > 0)).sum(axis=1),
+        'ropUnits': rop.sum(axis=1),
+        'orderUnits': order.sum(axis=1)
+    }
+
+
+def diagnostic_metrics(col, p, roles=None):
+    """
+    诊断：低库存问题数 (按平滑后的日均，与补货引擎一致)、不健康SKU数 (定价/广告/象限/角色问题与参数无关，只算一次)
+    角色：已指定角色的SKU低于容忍线且触发止损 (窗口期到期或止损线) 为严重问题，与 diagnostics.diagnose 一致
+    """
+    du, pm = col['demandRate'], col['pm']
+    sellable = np.where(du > 0, col['ful'] / np.where(du > 0, du, 1), np.inf)
+    low_stock = sellable < p['low_stock_threshold']
+    ad_contrib = col['adSales'] * pm - col['adSpend']
+    eliminate = (pm <= 0) & (ad_contrib < 0)
+    fixed_issue = (pm < 0) | ((col['ar'] > pm) & (col['adSpend'] > 0)) | eliminate
+    if roles is not None:
+        fixed_issue |= (np.array(roles['role'], dtype=object) != DEFAULT_ROLE) \
+            & np.array(roles['belowAllowed'], dtype=bool) & np.array(roles['stopLossTriggered'], dtype=bool)
+    return {
+        'lowStockIssues': low_stock.sum(axis=1),
+        'unhealthy': (low_stock | fixed_issue).sum(axis=1)
+    }
@@ -0,0 +1,222 @@
+"""
+LGURT Dashboard v5.1 - SKU Table
+按SKU对齐的紧凑列式表 (SKU明细/角色计划/库存/诊断)：单一类型的数值/布尔列存为NumPy数组，
+含空值或int/float混合的数值列存为float64数组+位置掩码 (NumberColumn)，文本等其余列存为列表；
+行视图 SkuRow (__slots__) 提供与字典相同的只读访问。
+计算阶段直接按列读取，只在API边界 (to_records) 还原为字典列表
+"""
+from collections.abc import Mapping, Sequence
+from operator import itemgetter
+
+import numpy as np
+
+# 可存为数组的值类型 (整列同一类型时)
+DTYPES = {float: np.float64, int: np.int64, bool: np.bool_}
+NUMBER_TYPES = {int, float, type(None)}
+
+
+def pack(values):
+    """值列表 → 数组/NumberColumn/原列表，取值时还原为同样的Python类型"""
+    types = set(map(type, values))
+    if len(types) == 1 and next(iter(types)) in DTYPES:
+        try:
+            return np.array(values, dtype=DTYPES[types.pop()])
+        except OverflowError:
+            pass
+    elif types and types <= NUMBER_TYPES:
+        col = NumberColumn.from_values(values)
+        if col is not None:
+            return col
+    return list(values)
+
+
+class NumberColumn:
+    """
+    含None或int/float混合的数值列 (如无销量SKU的可售天数为None、补货量为int 0)：
+    float64数组 (None存NaN) + None/int位置掩码，接口与一维数组的 item/tolist/按位置取值相同
+    """
+    __slots__ = ('data', 'nulls', 'ints')
+
+    def __init__(self, data, nulls, ints):
+        self.data = data
+        self.nulls = nulls
+        self.ints = ints
+
+    @classmethod
+    def from_values(cls, values):
+        """int超出float64精确整数范围时无法还原，返回None (改存列表)"""
+        try:
+            data = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        except OverflowError:
+            return None
+        ints = np.array([type(v) is int for v in values], dtype=bool)
+        if ints.any() and np.abs(data[ints]).max() >= 2 ** 53:
+            return None
+        nulls = np.array([v is None for v in values], dtype=bool)
+        return cls(data, nulls if nulls.any() else None, ints if ints.any() else None)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, positions):
+        return NumberColumn(self.data[positions], None if self.nulls is None else self.nulls[positions],
+                            None if self.ints is None else self.ints[positions])
+
+    def item(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        value = self.data.item(i)
+        return int(value) if self.ints is not None and self.ints[i] else value
+
+    def tolist(self):
+        values = self.data.tolist()
+        if self.ints is not None:
+            for i in np.flatnonzero(self.ints).tolist():
+                values[i] = int(values[i])
+        if self.nulls is not None:
+            for i in np.flatnonzero(self.nulls).tolist():
+                values[i] = None
+        return values
+
+
+class SkuTable(Sequence):
+    """n行、{字段: 数组或列表} 的表；按位置取行得到 SkuRow，切片/take 得到子表"""
+    __slots__ = ('n', 'columns')
+
+    def __init__(self, n, columns):
+        self.n = n
+        self.columns = columns
+
+    @classmethod
+    def from_columns(cls, n, columns):
+        """{字段: 值列表} → 表 (字段顺序即记录的键顺序)"""
+        return cls(n, {key: pack(values) for key, values in columns.items()})
+
+    @classmethod
+    def from_records(cls, records):
+        """字典列表 → 表 (字段取第一条记录的键，已是表时原样返回)"""
+        if isinstance(records, SkuTable):
+            return records
+        keys = list(records[0]) if records else []
+        return cls.from_columns(len(records), {key: values(records, key) for key in keys})
+
+    @classmethod
+    def concat(cls, tables):
+        """按行拼接 (字段取第一个非空表)"""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls(0, {})
+        keys = list(tables[0].keys())
+        return cls.from_columns(sum(len(t) for t in tables),
+                                {key: [v for t in tables for v in values(t, key)] for key in keys})
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(self.n)))
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError('SkuTable index out of range')
+        return SkuRow(self, i)
+
+    def __iter__(self):
+        return (SkuRow(self, i) for i in range(self.n))
+
+    def __repr__(self):
+        return f'SkuTable(n={self.n}, keys={list(self.columns)})'
+
+    def __eq__(self, other):
+        """与另一个表或字典列表按记录比较"""
+        if isinstance(other, SkuTable):
+            other = other.to_records()
+        elif not isinstance(other, list):
+            return NotImplemented
+        return self.to_records() == other
+
+    __hash__ = None
+
+    def keys(self):
+        return self.columns.keys()
+
+    def values(self, key):
+        """整列 → Python值列表 (与对应记录中的值类型一致)"""
+        col = self.columns[key]
+        return col if isinstance(col, list) else col.tolist()
+
+    def array(self, key, dtype=float):
+        """整列 → 数组 (数值列不复制；None为NaN)"""
+        col = self.columns[key]
+        if isinstance(col, NumberColumn):
+            col = col.data
+        elif isinstance(col, list) and dtype is float:
+            col = [np.nan if v is None else v for v in col]
+        return np.asarray(col, dtype=dtype)
+
+    def take(self, positions):
+        """按位置取行 → 新表"""
+        positions = np.asarray(positions, dtype=np.intp)
+        rows = positions.tolist()
+        return SkuTable(len(positions), {key: [col[i] for i in rows] if isinstance(col, list) else col[positions]
+                                         for key, col in self.columns.items()})
+
+    def sorted(self, key, reverse=False):
+        """按某列稳定排序 (与 list.sort(key=..., reverse=...) 的顺序一致)"""
+        if not self.n:
+            return self
+        col = self.array(key)
+        return self.take(np.argsort(-col if reverse else col, kind='stable'))
+
+    def to_records(self):
+        """API边界：还原为字典列表"""
+        keys = list(self.columns)
+        if not keys:
+            return [{} for _ in range(self.n)]
+        return [dict(zip(keys, row)) for row in zip(*(self.values(key) for key in keys))]
+
+
+class SkuRow(Mapping):
+    """表中一行的只读视图，取值时转为Python标量"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        col = self.table.columns[key]
+        return col[self.index] if isinstance(col, list) else col.item(self.index)
+
+    def __iter__(self):
+        return iter(self.table.columns)
+
+    def __len__(self):
+        return len(self.table.columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# ==================== 表/字典列表通用 ====================
+def values(records, key, default=None):
+    """表或字典列表的一列 → 值列表，缺少该字段的记录取default"""
+    if isinstance(records, SkuTable):
+        return records.values(key) if key in records.columns else [default] * len(records)
+    try:
+        return list(map(itemgetter(key), records))
+    except KeyError:
+        return [r.get(key, default) for r in records]
+
+
+def array(records, key, dtype=float, default=0):
+    """表或字典列表的一列 → 数组，缺少该字段的记录取default"""
+    if isinstance(records, SkuTable) and key in records.columns:
+        return records.array(key, dtype)
+    return np.array(values(records, key, default), dtype=dtype)
+
+
+def to_records(records):
+    """API边界：表 → 字典列表 (已是列表时原样返回)"""
+    return records.to_records() if isinstance(records, SkuTable) else records
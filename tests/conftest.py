@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 项目为平铺模块，测试直接导入根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 数据库/缓存/任务目录取临时目录 (须在导入 app/db 之前设置，不触碰仓库中的 lgurt_dashboard.db)
+TEST_DIR = tempfile.mkdtemp(prefix='lgurt-test-')
+os.environ['DATABASE_PATH'] = os.path.join(TEST_DIR, 'test.db')
+os.environ['RESULT_CACHE_DIR'] = os.path.join(TEST_DIR, 'cache')
+os.environ['JOB_UPLOAD_DIR'] = os.path.join(TEST_DIR, 'jobs')
+os.environ['WARMUP'] = '0'
+
+PARAMS = {'days': 31, 'lead_time_days': 35, 'safety_days': 30, 'target_cover_days': 90,
+          'low_stock_threshold': 7, 'overstock_threshold': 120}
+
+
+def workbook_bytes(n_skus=200, seed=0):
+    from benchmark import write_workbook
+    buf = io.BytesIO()
+    write_workbook(buf, n_skus, seed=seed)
+    return buf.getvalue()
+
+
+def read_sheets(raw):
+    """工作簿 → {sheet名: 行列表}"""
+    from openpyxl import load_workbook
+    wb = load_workbook(io.BytesIO(raw), read_only=True)
+    return {ws.title: [list(r) for r in ws.iter_rows(values_only=True)] for ws in wb.worksheets}
+
+
+def write_sheets(sheets):
+    """{sheet名: 行列表} → 工作簿"""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+@pytest.fixture(scope='session')
+def client():
+    """已登录demo用户的测试客户端 (整个测试会话共用一个临时数据库)"""
+    import app as app_module
+    test_client = app_module.app.test_client()
+    test_client.post('/api/auth/login', json={'username': 'demo', 'password': 'demo123'})
+    return test_client
+
+
+@pytest.fixture
+def conn(client):
+    import db
+    connection = db.connect(os.environ['DATABASE_PATH'])
+    yield connection
+    connection.close()
+
+
+def upload(client, raw, name='upload.xlsx'):
+    """上传工作簿 → 响应JSON"""
+    return client.post('/api/runs/upload', data={'file': (io.BytesIO(raw), name)},
+                       content_type='multipart/form-data').json
+
+
+def assert_stored_equal(conn, run_id, bundle):
+    """已落库run的 summary/ads 与各结果表和 bundle (重新完整计算的结果) 逐项一致"""
+    import run_store
+    row = conn.execute('SELECT summary_json, ads_json FROM run_results WHERE run_id = ?', (run_id,)).fetchone()
+    assert json.loads(row[0]) == json.loads(json.dumps(bundle['summary']))
+    assert json.loads(row[1]) == json.loads(json.dumps(bundle['ads']))
+    for name, table in run_store.load_tables(conn, run_id).items():
+        assert table.to_records() == bundle[name].to_records(), name
@@ -0,0 +1,361 @@
+"""
+LGURT Dashboard v5.1 - 向量化之前的逐行实现 (冻结副本，仅供对照测试)
+process_excel_file / calc_inventory / generate_diagnostics / parse_sheet / safe_float 原样保留，不随业务代码修改
+"""
+import pandas as pd
+from io import BytesIO
+
+def process_excel_file(file, params):
+    """
+    处理上传的Excel文件，返回计算结果
+    """
+    days = params.get('days', 31)
+    
+    # 读取Excel
+    if hasattr(file, 'read'):
+        content = file.read()
+        file_obj = BytesIO(content)
+    else:
+        file_obj = file
+    
+    xl = pd.ExcelFile(file_obj)
+    
+    # 解析各sheet
+    sales_df = parse_sheet(xl, 'sales_data', skip=19)
+    master_df = parse_sheet(xl, 'sku_master', skip=18)
+    ads_df = parse_sheet(xl, 'ad_data', skip=18)
+    inv_df = parse_sheet(xl, 'inventory_data', skip=15)
+    fc_df = parse_sheet(xl, 'fixed_costs', skip=12)
+    
+    # 构建SKU信息映射
+    sku_info = {}
+    if master_df is not None and len(master_df) > 0:
+        for _, row in master_df.iterrows():
+            sku = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ''
+            if sku:
+                sku_info[sku] = {
+                    'name': str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else sku,
+                    'cat': str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else '未分类',
+                    'cost': safe_float(row.iloc[4]) if len(row) > 4 else 0,
+                    'freight': safe_float(row.iloc[5]) if len(row) > 5 else 0
+                }
+    
+    # 构建广告数据映射
+    ad_by_sku = {}
+    ad_by_asin = {}
+    if ads_df is not None and len(ads_df) > 0:
+        for _, row in ads_df.iterrows():
+            asin = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
+            sku = str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else ''
+            ad = {
+                'spend': safe_float(row.iloc[10]) if len(row) > 10 else 0,
+                'imp': safe_float(row.iloc[7]) if len(row) > 7 else 0,
+                'clk': safe_float(row.iloc[8]) if len(row) > 8 else 0,
+                'sales': safe_float(row.iloc[4]) if len(row) > 4 else 0
+            }
+            if sku:
+                if sku not in ad_by_sku:
+                    ad_by_sku[sku] = {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0}
+                ad_by_sku[sku]['spend'] += ad['spend']
+                ad_by_sku[sku]['imp'] += ad['imp']
+                ad_by_sku[sku]['clk'] += ad['clk']
+                ad_by_sku[sku]['sales'] += ad['sales']
+            elif asin:
+                key = asin.split('-')[0]
+                if key not in ad_by_asin:
+                    ad_by_asin[key] = {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0}
+                ad_by_asin[key]['spend'] += ad['spend']
+                ad_by_asin[key]['imp'] += ad['imp']
+                ad_by_asin[key]['clk'] += ad['clk']
+                ad_by_asin[key]['sales'] += ad['sales']
+    
+    # 构建库存映射
+    inv_by_sku = {}
+    if inv_df is not None and len(inv_df) > 0:
+        for _, row in inv_df.iterrows():
+            sku = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
+            if sku:
+                inv_by_sku[sku] = {
+                    'ful': safe_float(row.iloc[5]) if len(row) > 5 else 0,
+                    'inb': safe_float(row.iloc[6]) if len(row) > 6 else 0,
+                    'rsv': safe_float(row.iloc[7]) if len(row) > 7 else 0
+                }
+    
+    # 解析固定成本
+    mf_monthly = 0
+    if fc_df is not None and len(fc_df) > 0:
+        last_row = fc_df.iloc[-1]
+        labor = safe_float(last_row.iloc[1]) if len(last_row) > 1 else 0
+        rent = safe_float(last_row.iloc[2]) if len(last_row) > 2 else 0
+        sw = safe_float(last_row.iloc[3]) if len(last_row) > 3 else 0
+        other1 = safe_float(last_row.iloc[4]) if len(last_row) > 4 else 0
+        other2 = safe_float(last_row.iloc[5]) if len(last_row) > 5 else 0
+        mf_monthly = labor + rent + sw + other1 + other2
+    
+    mf_daily = mf_monthly / 30
+    mf_period = mf_daily * days
+    
+    # 处理销售数据
+    skus = []
+    if sales_df is not None and len(sales_df) > 0:
+        for _, row in sales_df.iterrows():
+            sku = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ''
+            asin = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ''
+            rev = safe_float(row.iloc[6]) if len(row) > 6 else 0
+            
+            if not sku or rev <= 0:
+                continue
+            
+            info = sku_info.get(sku, {'name': sku, 'cat': '未分类', 'cost': 0, 'freight': 0})
+            units = safe_float(row.iloc[5]) if len(row) > 5 else 0
+            rfm = abs(safe_float(row.iloc[8])) if len(row) > 8 else 0
+            ref = safe_float(row.iloc[9]) if len(row) > 9 else 0
+            fba = safe_float(row.iloc[10]) if len(row) > 10 else 0
+            
+            cogs = info['cost'] * units
+            frt = info['freight'] * units
+            pp = rev - ref - fba - cogs - frt - rfm
+            pm = pp / rev if rev > 0 else 0
+            
+            # 获取广告数据
+            ad = ad_by_sku.get(sku)
+            if not ad:
+                key = asin.split('-')[0] if asin else ''
+                ad = ad_by_asin.get(key, {'spend': 0, 'imp': 0, 'clk': 0, 'sales': 0})
+            
+            op = pp - ad['spend']
+            om = op / rev if rev > 0 else 0
+            ar = ad['spend'] / rev if rev > 0 else 0
+            
+            # 获取库存数据
+            iv = inv_by_sku.get(sku, {'ful': 0, 'inb': 0, 'rsv': 0})
+            du = units / days
+            
+            skus.append({
+                'sku': sku,
+                'asin': asin,
+                'name': info['name'],
+                'cat': info['cat'],
+                'units': round(units, 0),
+                'du': round(du, 1),
+                'rev': round(rev, 2),
+                'ref': round(ref, 2),
+                'fba': round(fba, 2),
+                'cogs': round(cogs, 2),
+                'frt': round(frt, 2),
+                'rfmFee': round(rfm, 2),
+                'pp': round(pp, 2),
+                'pm': round(pm, 4),
+                'adSpend': round(ad['spend'], 2),
+                'adImp': ad['imp'],
+                'adClk': ad['clk'],
+                'adSales': round(ad['sales'], 2),
+                'op': round(op, 2),
+                'om': round(om, 4),
+                'ar': round(ar, 4),
+                'acos': round(ad['spend'] / ad['sales'], 4) if ad['sales'] > 0 else 0,
+                'roas': round(ad['sales'] / ad['spend'], 2) if ad['spend'] > 0 else 0,
+                'ful': iv['ful'],
+                'inb': iv['inb'],
+                'rsv': iv['rsv']
+            })
+    
+    # 按经营利润排序
+    skus.sort(key=lambda x: x['op'], reverse=True)
+    
+    # 计算汇总
+    t = {
+        'rev': sum(s['rev'] for s in skus),
+        'units': sum(s['units'] for s in skus),
+        'ref': sum(s['ref'] for s in skus),
+        'fba': sum(s['fba'] for s in skus),
+        'cogs': sum(s['cogs'] for s in skus),
+        'frt': sum(s['frt'] for s in skus),
+        'rfmFee': sum(s['rfmFee'] for s in skus),
+        'pp': sum(s['pp'] for s in skus),
+        'adSpend': sum(s['adSpend'] for s in skus),
+        'op': sum(s['op'] for s in skus),
+        'imp': sum(s['adImp'] for s in skus),
+        'clk': sum(s['adClk'] for s in skus),
+        'adSales': sum(s['adSales'] for s in skus)
+    }
+    
+    d_rev = t['rev'] / days if days > 0 else 0
+    om = t['op'] / t['rev'] if t['rev'] > 0 else 0
+    np = t['op'] - mf_period
+    be = mf_daily / om if om > 0 else 0
+    
+    summary = {
+        **t,
+        'days': days,
+        'dRev': round(d_rev, 2),
+        'pm': round(t['pp'] / t['rev'], 4) if t['rev'] > 0 else 0,
+        'ar': round(t['adSpend'] / t['rev'], 4) if t['rev'] > 0 else 0,
+        'om': round(om, 4),
+        'mfMonthly': mf_monthly,
+        'mfDaily': round(mf_daily, 2),
+        'mfPeriod': round(mf_period, 2),
+        'np': round(np, 2),
+        'npm': round(np / t['rev'], 4) if t['rev'] > 0 else 0,
+        'ctr': round(t['clk'] / t['imp'], 4) if t['imp'] > 0 else 0,
+        'cpc': round(t['adSpend'] / t['clk'], 2) if t['clk'] > 0 else 0,
+        'acos': round(t['adSpend'] / t['adSales'], 4) if t['adSales'] > 0 else 0,
+        'roas': round(t['adSales'] / t['adSpend'], 2) if t['adSpend'] > 0 else 0,
+        'dailyBreakEven': round(be, 2)
+    }
+    
+    return {'summary': summary, 'skus': skus}
+
+
+def calc_inventory(skus, params):
+    """计算库存指标"""
+    lead_time = params.get('lead_time_days', 35)
+    safety_days = params.get('safety_days', 30)
+    target_cover = params.get('target_cover_days', 90)
+    low_threshold = params.get('low_stock_threshold', 7)
+    over_threshold = params.get('overstock_threshold', 120)
+    
+    result = []
+    for sku in skus:
+        ful = sku.get('ful', 0)
+        inb = sku.get('inb', 0)
+        rsv = sku.get('rsv', 0)
+        du = sku.get('du', 0)
+        
+        if du <= 0:
+            result.append({
+                'sku': sku['sku'],
+                'sellableDOS': None,
+                'totalDOS': None,
+                'stockoutGap': None,
+                'status': 'no-sales',
+                'overstockRisk': False,
+                'ropUnits': 0,
+                'targetUnits': 0,
+                'availableUnits': 0,
+                'orderQty': 0
+            })
+            continue
+        
+        sellable_dos = ful / du
+        total_dos = (ful + inb - rsv) / du
+        stockout_gap = max(0, lead_time - sellable_dos)
+        
+        if sellable_dos < low_threshold:
+            status = 'critical'
+        elif sellable_dos < lead_time:
+            status = 'reorder-now'
+        elif sellable_dos < 15:
+            status = 'watch'
+        else:
+            status = 'healthy'
+        
+        overstock_risk = total_dos > over_threshold
+        rop_units = (lead_time + safety_days) * du
+        target_units = target_cover * du
+        available_units = ful + inb - rsv
+        order_qty = max(0, target_units - available_units)
+        
+        result.append({
+            'sku': sku['sku'],
+            'sellableDOS': round(sellable_dos, 1),
+            'totalDOS': round(total_dos, 1),
+            'stockoutGap': round(stockout_gap, 1),
+            'status': status,
+            'overstockRisk': overstock_risk,
+            'ropUnits': round(rop_units, 0),
+            'targetUnits': round(target_units, 0),
+            'availableUnits': round(available_units, 0),
+            'orderQty': round(order_qty, 0)
+        })
+    
+    return result
+
+
+def generate_diagnostics(skus, params):
+    """生成SKU诊断建议"""
+    lead_time = params.get('lead_time_days', 35)
+    low_threshold = params.get('low_stock_threshold', 7)
+    
+    diagnostics = []
+    for sku in skus:
+        issues = []
+        actions = []
+        stop_loss = []
+        is_healthy = True
+        
+        # 计算库存指标
+        du = sku.get('du', 0)
+        ful = sku.get('ful', 0)
+        sellable_dos = ful / du if du > 0 else None
+        
+        # 库存风险
+        if sellable_dos is not None and sellable_dos < low_threshold:
+            issues.append({'type': 'critical', 'text': f"可售库存仅{sellable_dos:.1f}天，低于{low_threshold}天阈值"})
+            actions.append({'priority': 0, 'text': '【紧急】立即补货或调拨', 'condition': '库存恢复前不做其他优化'})
+            is_healthy = False
+        
+        # 定价毛利问题
+        if sku['pm'] < 0:
+            issues.append({'type': 'critical', 'text': f"定价毛利为负({sku['pm']*100:.1f}%)"})
+            is_healthy = False
+            actions.append({'priority': 1, 'text': '【诊断】检查成本结构', 'condition': '定位主要成本问题'})
+        
+        # 广告占比问题
+        if sku['ar'] > sku['pm'] and sku['adSpend'] > 0:
+            issues.append({'type': 'critical', 'text': f"广告占比({sku['ar']*100:.1f}%)超过毛利率({sku['pm']*100:.1f}%)"})
+            is_healthy = False
+            actions.append({'priority': 1, 'text': '【立即】执行Phase1砍无意义消耗', 'condition': '先砍ACOS>200%的词'})
+        
+        # 广告贡献
+        ad_contrib = sku['adSales'] * sku['pm'] - sku['adSpend']
+        if ad_contrib < 0 and sku['adSpend'] > 50:
+            issues.append({'type': 'warning', 'text': f"广告贡献利润为负(${ad_contrib:.0f})"})
+            actions.append({'priority': 2, 'text': '【优化】否定ACOS>50%词，降长尾竞价20%', 'condition': '2周后复盘效果'})
+        
+        # 四象限分类
+        if sku['pm'] > 0 and ad_contrib >= 0:
+            quadrant = 'star'
+        elif sku['pm'] > 0 and ad_contrib < 0:
+            quadrant = 'dog'
+        elif sku['pm'] <= 0 and ad_contrib >= 0:
+            quadrant = 'question'
+        else:
+            quadrant = 'eliminate'
+        
+        if quadrant == 'eliminate':
+            actions.append({'priority': 1, 'text': '【启动退出】定价亏+广告亏，双重问题', 'condition': '除非有战略价值'})
+            stop_loss.append('立即停止补货')
+            is_healthy = False
+        
+        actions.sort(key=lambda x: x['priority'])
+        
+        diagnostics.append({
+            'sku': sku['sku'],
+            'quadrant': quadrant,
+            'adContrib': round(ad_contrib, 2),
+            'issues': issues,
+            'actions': actions,
+            'stopLoss': stop_loss,
+            'isHealthy': is_healthy
+        })
+    
+    return diagnostics
+
+
+def parse_sheet(xl, name, skip):
+    """解析Excel工作表"""
+    if name not in xl.sheet_names:
+        return None
+    df = pd.read_excel(xl, sheet_name=name, header=None)
+    return df.iloc[skip:] if len(df) > skip else df
+
+
+def safe_float(val):
+    """安全转换为浮点数"""
+    try:
+        if pd.isna(val):
+            return 0
+        return float(val)
+    except:
+        return 0
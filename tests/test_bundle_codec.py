@@ -0,0 +1,119 @@
+"""
+bundle_codec 往返：int/float类型、NaN、-0.0、None、混合类型列、空表原样还原；
+zlib回退；格式版本/压缩算法/校验失败时拒绝
+"""
+import math
+import struct
+
+import pytest
+
+import bundle_codec
+from sku_table import SkuTable
+
+MIXED = [
+    {'sku': 'A', 'units': 3, 'rev': 10.5, 'op': 0.0, 'ratio': None, 'flag': True, 'mixed': 1, 'issues': []},
+    {'sku': 'B', 'units': 0, 'rev': 2.0, 'op': -0.0, 'ratio': 0.1234567891, 'flag': False, 'mixed': 'x',
+     'issues': [{'type': 'critical', 'text': '库存'}]},
+    {'sku': 'C', 'units': None, 'rev': 1e300, 'op': -12.25, 'ratio': 2 ** 60, 'flag': True, 'mixed': None,
+     'issues': None},
+]
+
+
+def typed(value):
+    """值 → (类型, 值)，NaN与-0.0按位区分"""
+    if isinstance(value, dict):
+        return {k: typed(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [typed(v) for v in value]
+    if isinstance(value, float):
+        return 'float', struct.pack('>d', value)
+    return type(value).__name__, value
+
+
+def round_trip(tables):
+    return bundle_codec.decode(bundle_codec.encode(tables))
+
+
+def test_round_trip_keeps_types():
+    assert typed(round_trip({'skus': MIXED})) == typed({'skus': MIXED})
+
+
+@pytest.mark.parametrize('values', [
+    [1, 2, 3],                        # 全int
+    [1.0, 2.0, 3.0],                  # 整数值float不变成int
+    [1, 2.0, None, 3],                # int/float/None混合
+    [0.1, 0.25, -3.125, None],        # 定点
+    [math.pi, math.e, 1 / 3],         # 无法定点，原样float64
+    [-0.0, 0.0, 1.5],                 # 负零
+    [float('nan'), 1.0, None],        # NaN
+    [float('inf'), -float('inf'), 0], # 无穷
+    [2 ** 53, 1],                     # 超出float64精确整数范围
+    [True, False, True],              # bool
+    [True, 1, 0.0],                   # bool与数值混合
+    ['a', None, 'b'],                 # 文本
+    [None, None],                     # 全空
+])
+def test_column_round_trip(values):
+    records = [{'v': v} for v in values]
+    assert typed(round_trip({'t': records})['t']) == typed(records)
+
+
+def test_empty_tables():
+    decoded = bundle_codec.decode_columns(bundle_codec.encode({'skus': [], 'inventory': SkuTable(0, {})}))
+    assert decoded == {'skus': (0, {}), 'inventory': (0, {})}
+
+
+def test_sku_table_and_ref_columns():
+    skus = SkuTable.from_records(MIXED)
+    inventory = [{'sku': r['sku'], 'status': 'healthy'} for r in MIXED]
+    blob = bundle_codec.encode({'skus': skus, 'inventory': inventory})
+    assert typed(bundle_codec.decode(blob)) == typed({'skus': MIXED, 'inventory': inventory})
+    # 只解码部分表/字段 (库存的sku列为对SKU表的引用)
+    assert bundle_codec.decode_columns(blob, ('inventory',), ('sku',)) == {'inventory': (3, {'sku': ['A', 'B', 'C']})}
+
+
+def test_zlib_fallback_without_zstd(monkeypatch):
+    monkeypatch.setattr(bundle_codec, 'zstandard', None)
+    blob = bundle_codec.encode({'skus': MIXED})
+    assert blob[5] == bundle_codec.CODEC_ZLIB
+    assert typed(bundle_codec.decode(blob)) == typed({'skus': MIXED})
+
+
+@pytest.mark.skipif(bundle_codec.zstandard is None, reason='未安装 zstandard')
+def test_zstd_blob_needs_zstd(monkeypatch):
+    blob = bundle_codec.encode({'skus': MIXED})
+    assert blob[5] == bundle_codec.CODEC_ZSTD
+    monkeypatch.setattr(bundle_codec, 'zstandard', None)
+    with pytest.raises(ValueError, match='zstandard'):
+        bundle_codec.decode(blob)
+
+
+def with_header(blob, version=None, codec=None):
+    magic, v, c, reserved = bundle_codec.HEADER.unpack_from(blob)
+    header = bundle_codec.HEADER.pack(magic, v if version is None else version, c if codec is None else codec, reserved)
+    return header + blob[bundle_codec.HEADER.size:]
+
+
+@pytest.mark.parametrize('version', [0, bundle_codec.FORMAT_VERSION + 1])
+def test_rejects_unknown_version(version):
+    with pytest.raises(ValueError, match='版本'):
+        bundle_codec.decode(with_header(bundle_codec.encode({'skus': MIXED}), version=version))
+
+
+def test_rejects_unknown_codec():
+    with pytest.raises(ValueError, match='压缩算法'):
+        bundle_codec.decode(with_header(bundle_codec.encode({'skus': MIXED}), codec=9))
+
+
+@pytest.mark.parametrize('blob', [b'', b'LGRB', b'JSON' + bytes(8)])
+def test_rejects_foreign_data(blob):
+    with pytest.raises(ValueError, match='不是ResultBundle'):
+        bundle_codec.decode(blob)
+
+
+def test_rejects_corrupted_payload():
+    blob = bytearray(bundle_codec.encode({'skus': MIXED * 50}))
+    # 压缩数据末尾为校验和 (zlib adler32 / zstd帧校验和)
+    blob[-2] ^= 0xFF
+    with pytest.raises(ValueError, match='损坏'):
+        bundle_codec.decode(bytes(blob))
@@ -0,0 +1,66 @@
+"""
+增量上传：只含部分SKU的sheet合并到最近一次run，派生run的SKU表/summary/checksum与上传合并后的完整工作簿一致；
+没有可合并的run时拒绝
+"""
+import io
+import json
+
+import pytest
+
+from app import app, root_demand
+from conftest import assert_stored_equal, read_sheets, upload, workbook_bytes, write_sheets
+from excel_reader import SHEET_LAYOUT
+from pipeline import run_pipeline
+from result_cache import ResultCache
+
+# sheet → SKU所在列
+SKU_COLUMN = {'sales_data': 2, 'ad_data': 2, 'inventory_data': 1}
+
+
+def subset(rows, name):
+    """只保留约一半SKU (编号为偶数) 的数据行"""
+    skip, col = SHEET_LAYOUT[name][0], SKU_COLUMN[name]
+    return rows[:skip] + [r for r in rows[skip:] if r[col] and int(r[col][-1]) % 2 == 0]
+
+
+def delta_upload(client, raw, name='delta.xlsx'):
+    return client.post('/api/runs/upload', data={'file': (io.BytesIO(raw), name), 'delta': '1'},
+                       content_type='multipart/form-data')
+
+
+@pytest.mark.parametrize('sheet, recomputed', [
+    ('inventory_data', ['inventory', 'diagnostics']),
+    ('ad_data', ['aggregate', 'roles', 'ads', 'inventory', 'diagnostics']),
+    ('sales_data', ['aggregate', 'roles', 'ads', 'inventory', 'diagnostics']),
+])
+def test_delta_matches_combined_workbook(client, conn, tmp_path, sheet, recomputed):
+    base_raw = workbook_bytes(seed=51)
+    base_id = upload(client, base_raw, 'base.xlsx')['run_id']
+    delta = subset(read_sheets(workbook_bytes(seed=52))[sheet], sheet)
+    result = delta_upload(client, write_sheets({sheet: delta})).json
+    assert (result['parent_run_id'], result['sheets']) == (base_id, [sheet])
+    assert sorted(result['recomputed']) == sorted(recomputed)
+
+    # 合并后的完整工作簿：基准工作簿的该sheet整体换成增量sheet
+    combined = write_sheets({**read_sheets(base_raw), sheet: delta})
+    base = conn.execute('SELECT * FROM runs WHERE id = ?', (base_id,)).fetchone()
+    run = conn.execute('SELECT * FROM runs WHERE id = ?', (result['run_id'],)).fetchone()
+    fresh = run_pipeline(io.BytesIO(combined), json.loads(run['params_json']),
+                         cache=ResultCache(str(tmp_path)), demand=root_demand(conn, base, base['user_id']))
+    assert_stored_equal(conn, result['run_id'], fresh)
+    assert (run['checksum_rev'], run['checksum_op']) == (fresh['summary']['rev'], fresh['summary']['op'])
+    assert client.get(f"/api/runs/{result['run_id']}/verify").json['is_consistent']
+
+
+def test_delta_without_prior_run_is_rejected():
+    client = app.test_client()
+    assert client.post('/api/auth/register', json={'username': 'delta-new', 'password': 'secret1'}).status_code == 200
+    raw = write_sheets({'inventory_data': read_sheets(workbook_bytes(n_skus=20, seed=53))['inventory_data']})
+    response = delta_upload(client, raw)
+    assert response.status_code == 409 and '完整工作簿' in response.json['error']
+    assert client.get('/api/runs').json['runs'] == []
+
+
+def test_delta_without_known_sheets_is_rejected(client):
+    response = delta_upload(client, write_sheets({'notes': [['hello']]}))
+    assert response.status_code == 400
@@ -0,0 +1,63 @@
+"""
+诊断：未指定角色时与原逐行实现 (legacy_processor.generate_diagnostics) 一致；
+角色问题只对已指定角色的SKU生成，止损建议与 calc_role_plan 的预算一致
+"""
+import io
+
+import pytest
+
+import legacy_processor
+from benchmark import write_workbook
+from data_processor import SKU_ROLE_CONFIG
+from diagnostics import BELOW_ROLE_ALLOWED, FLAGS, ROLE_FLAGS, ROLE_STOP_LOSS, expand, render
+from pipeline import run_pipeline
+from result_cache import ResultCache
+
+PARAMS = {'days': 31, 'lead_time_days': 35, 'safety_days': 30, 'target_cover_days': 90,
+          'low_stock_threshold': 7, 'overstock_threshold': 120}
+
+
+@pytest.fixture(scope='module')
+def workbook():
+    buf = io.BytesIO()
+    write_workbook(buf, 500, seed=0)
+    return buf.getvalue()
+
+
+def compute(workbook, tmp_path, params):
+    return run_pipeline(io.BytesIO(workbook), params, cache=ResultCache(str(tmp_path)), demand={})
+
+
+def test_no_roles_match_legacy(workbook, tmp_path):
+    bundle = compute(workbook, tmp_path, PARAMS)
+    # 默认盈利款经营毛利为负时角色计划仍触发止损 (只影响广告预算)
+    assert any(bundle['roles'].values('stopLossTriggered'))
+    legacy = legacy_processor.generate_diagnostics(bundle['skus'].to_records(), PARAMS)
+    new = expand(bundle['skus'], bundle['diagnostics'], PARAMS, bundle['roles'])
+    assert [{k: r[k] for k in old} for r, old in zip(new, legacy)] == legacy
+    assert not any(flags & ROLE_FLAGS for flags in bundle['diagnostics'].values('flags'))
+
+
+def test_role_flags_only_for_assigned_roles(workbook, tmp_path):
+    skus = compute(workbook, tmp_path / 'base', PARAMS)['skus']
+    losing = [s for s, om in zip(skus.values('sku'), skus.values('om')) if om < -0.5]
+    assert len(losing) >= 3
+    sku_roles = {losing[0]: ['traffic', 0], losing[1]: ['test', 0]}
+    bundle = compute(workbook, tmp_path / 'roles', {**PARAMS, 'sku_roles': sku_roles})
+    flags = dict(zip(bundle['diagnostics'].values('sku'), bundle['diagnostics'].values('flags')))
+    for sku in losing[:2]:
+        assert flags[sku] & BELOW_ROLE_ALLOWED and flags[sku] & ROLE_STOP_LOSS
+    assert not flags[losing[2]] & ROLE_FLAGS
+    # 未指定角色的SKU仍按盈利款控制预算
+    cut = dict(zip(bundle['roles'].values('sku'), bundle['roles'].values('budgetCut')))
+    spend = dict(zip(skus.values('sku'), skus.values('adSpend')))
+    assert any(cut[s] > 0 for s in losing[2:] if spend[s] > 0)
+
+
+@pytest.mark.parametrize('role, advice', [('traffic', '启动退出流程'), ('defense', '启动退出流程'),
+                                          ('test', '降级为profit款'), ('profit', '广告预算降至不亏损')])
+def test_stop_loss_advice_matches_role_plan(role, advice):
+    sku = {'sku': 'A', 'du': 1, 'ful': 100, 'pm': 0.1, 'ar': 0.05, 'om': -0.6, 'adSales': 10, 'adSpend': 5}
+    diag = {'flags': FLAGS['belowRoleAllowed'] | FLAGS['roleStopLoss'], 'quadrant': 'star'}
+    text = render(sku, diag, {'role': role, 'adBudget': 0, 'budgetCut': 5})['stopLoss']
+    assert text == [f"{SKU_ROLE_CONFIG[role]['name']}止损线已触发，建议：{advice}"]
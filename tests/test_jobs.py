@@ -0,0 +1,102 @@
+"""
+任务队列：claim_job 只认领一次；重启时 recover_jobs 重新提交排队任务、重启批量协调线程、
+长时间无进度的running任务标记失败；恢复后的批量任务可完整执行
+"""
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import batch
+import jobs
+from conftest import PARAMS, workbook_bytes
+
+
+class Recorder:
+    """记录提交的任务 (代替进程池，不执行)"""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+
+@pytest.fixture
+def user_id(conn):
+    return conn.execute("SELECT id FROM users WHERE username = 'demo'").fetchone()[0]
+
+
+def add_job(conn, user_id, status='queued', age_minutes=0, batch_id=None, file_path=None):
+    job_id = 'job_' + uuid.uuid4().hex[:12]
+    conn.execute('INSERT INTO jobs (id, user_id, file_name, file_path, params_json, status, batch_id, updated_at) '
+                 "VALUES (?, ?, 'test.xlsx', ?, ?, ?, ?, datetime('now', ?))",
+                 (job_id, user_id, file_path, json.dumps(PARAMS), status, batch_id, f'-{age_minutes} minutes'))
+    conn.commit()
+    return job_id
+
+
+def status(conn, job_id):
+    return tuple(conn.execute('SELECT status, error FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def test_claim_job_once(conn, user_id):
+    job_id = add_job(conn, user_id)
+    job = jobs.claim_job(conn, job_id)
+    assert (job['id'], job['status']) == (job_id, 'running')
+    assert jobs.claim_job(conn, job_id) is None
+    assert jobs.claim_job(conn, 'job_missing') is None
+
+
+@pytest.mark.parametrize('state', ['done', 'failed'])
+def test_claim_job_skips_finished(conn, user_id, state):
+    job_id = add_job(conn, user_id, status=state)
+    assert jobs.claim_job(conn, job_id) is None
+    assert status(conn, job_id)[0] == state
+
+
+def test_recover_jobs(conn, user_id, monkeypatch):
+    started = []
+    monkeypatch.setattr(batch, 'start_batch', lambda db_path, job_id: started.append(job_id))
+    queued = add_job(conn, user_id)
+    queued_batch = add_job(conn, user_id, batch_id='batch_recover')
+    stale = add_job(conn, user_id, status='running', age_minutes=jobs.JOB_STALE_MINUTES + 5)
+    active = add_job(conn, user_id, status='running', age_minutes=1)
+
+    executor = Recorder()
+    jobs.recover_jobs(os.environ['DATABASE_PATH'], executor)
+    assert (jobs.run_job, (os.environ['DATABASE_PATH'], queued)) in executor.calls
+    assert all(args[1] != queued_batch for _, args in executor.calls)
+    assert started == [queued_batch]
+    assert status(conn, stale) == ('failed', '任务执行中断')
+    assert status(conn, active) == ('running', None)
+    # 排队任务不改状态，由工作进程认领
+    assert status(conn, queued)[0] == status(conn, queued_batch)[0] == 'queued'
+
+
+def test_recovered_batch_completes(conn, user_id, tmp_path):
+    """重启前已写入队列的批量任务：恢复后协调线程认领并合并各文件的run"""
+    work_dir = tmp_path / 'batch'
+    work_dir.mkdir()
+    uploads = []
+    for seed in (41, 42):
+        path = work_dir / f'{seed}.xlsx'
+        path.write_bytes(workbook_bytes(n_skus=50, seed=seed))
+        uploads.append((f'shop{seed}.xlsx', str(path)))
+    (work_dir / batch.MANIFEST).write_text(json.dumps(uploads))
+    job_id = add_job(conn, user_id, batch_id='batch_restart', file_path=str(work_dir))
+
+    with ThreadPoolExecutor(2) as executor:
+        result = batch.run_batch(os.environ['DATABASE_PATH'], job_id, executor)
+        # 已被认领的任务不会重复执行
+        assert batch.run_batch(os.environ['DATABASE_PATH'], job_id, executor) is None
+
+    assert [r['file_name'] for r in result['runs']] == ['shop41.xlsx', 'shop42.xlsx']
+    assert all('run_id' in r for r in result['runs'])
+    job = jobs.get_job(conn, job_id, user_id)
+    assert (job['status'], job['run_id'], job['result']) == ('done', result['portfolio_run_id'], result)
+    batch_runs = conn.execute('SELECT id FROM runs WHERE batch_id = ?', ('batch_restart',)).fetchall()
+    assert len(batch_runs) == 3
+    assert not work_dir.exists()
@@ -0,0 +1,69 @@
+"""
+阶段依赖与缓存失效：改某个参数只使读取它的阶段 (及下游) 的键变化；
+PATCH params 只重算这些阶段，派生run与按新参数完整计算的结果一致
+"""
+import io
+
+import pytest
+
+from app import root_demand
+from conftest import PARAMS, assert_stored_equal, upload, workbook_bytes
+from pipeline import PIPELINE, PIPELINE_PARAMS, run_pipeline, stage_keys
+from result_cache import ResultCache
+
+# 参数 → 应重算的阶段
+DEPENDENT_STAGES = {
+    'days': {'aggregate', 'roles', 'ads', 'inventory', 'diagnostics'},
+    'sku_roles': {'roles', 'ads', 'diagnostics'},
+    'lead_time_days': {'inventory'},
+    'safety_days': {'inventory'},
+    'target_cover_days': {'inventory'},
+    'overstock_threshold': {'inventory'},
+    'category_lead_times': {'inventory'},
+    'low_stock_threshold': {'inventory', 'diagnostics'},
+}
+CHANGED = {'days': 30, 'sku_roles': {'BM-000001': ['traffic', 1]}, 'lead_time_days': 50, 'safety_days': 20,
+           'target_cover_days': 60, 'overstock_threshold': 90, 'category_lead_times': {'Kitchen': 60},
+           'low_stock_threshold': 14}
+
+
+def test_dependency_table_covers_all_params():
+    assert set(DEPENDENT_STAGES) == set(PIPELINE_PARAMS)
+
+
+@pytest.mark.parametrize('param', sorted(DEPENDENT_STAGES))
+def test_param_invalidates_only_dependent_stages(param):
+    before = stage_keys('hash', PARAMS)
+    after = stage_keys('hash', {**PARAMS, param: CHANGED[param]})
+    changed = {stage.name for stage in PIPELINE if before[stage.outputs[0]] != after[stage.outputs[0]]}
+    assert changed == DEPENDENT_STAGES[param]
+
+
+@pytest.fixture(scope='module')
+def base(client):
+    raw = workbook_bytes(seed=21)
+    return raw, upload(client, raw, 'patch.xlsx')['run_id']
+
+
+@pytest.mark.parametrize('change, recomputed', [
+    ({'lead_time_days': 50}, ['inventory']),
+    ({'low_stock_threshold': 14}, ['inventory', 'diagnostics']),
+    ({'safety_days': 20, 'target_cover_days': 60}, ['inventory']),
+    ({'days': 30}, ['aggregate', 'roles', 'ads', 'inventory', 'diagnostics']),
+])
+def test_patch_matches_full_run(client, conn, base, tmp_path, change, recomputed):
+    raw, run_id = base
+    result = client.patch(f'/api/runs/{run_id}/params', json=change).json
+    assert result['parent_run_id'] == run_id
+    assert sorted(result['recomputed']) == sorted(recomputed)
+
+    run = conn.execute('SELECT * FROM runs WHERE id = ?', (result['run_id'],)).fetchone()
+    fresh = run_pipeline(io.BytesIO(raw), result['params'], cache=ResultCache(str(tmp_path)),
+                         demand=root_demand(conn, run, run['user_id']))
+    assert_stored_equal(conn, result['run_id'], fresh)
+
+
+def test_patch_without_changes_keeps_run(client, base):
+    _, run_id = base
+    result = client.patch(f'/api/runs/{run_id}/params', json={'lead_time_days': PARAMS['lead_time_days']}).json
+    assert (result['run_id'], result['recomputed']) == (run_id, [])
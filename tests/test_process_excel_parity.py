@@ -0,0 +1,162 @@
+"""
+process_excel_file 向量化前后一致性：内存中构造工作簿，summary/skus 与冻结的逐行实现 (legacy_processor)
+逐字段比较值与类型 (int 0 与 0.0 视为不同，序列化结果和落库编码均依赖类型)
+"""
+import io
+
+import pytest
+from openpyxl import Workbook
+
+import legacy_processor
+from benchmark import write_workbook
+from data_processor import calc_inventory, process_excel_file
+from excel_reader import SHEET_LAYOUT
+
+PARAMS = {'days': 31, 'lead_time_days': 35, 'safety_days': 30, 'target_cover_days': 90,
+          'low_stock_threshold': 7, 'overstock_threshold': 120}
+
+# {sheet名: [{列序号: 值}]}，表头行数取自 SHEET_LAYOUT
+EDGE_CASES = {
+    'sales_data': [
+        {1: 'B001', 2: 'A-1', 5: 10, 6: 200.5, 8: -30, 9: 5, 10: 20},
+        # 文本数字 / 无法转换的文本
+        {1: 'B002-US', 2: 'A-2', 5: '7', 6: '150.25', 8: '-12.5', 9: None, 10: 'x'},
+        # 缺失单元格
+        {1: 'B003', 2: 'A-3', 5: None, 6: 99.99, 8: None, 9: None, 10: None},
+        # 重复SKU
+        {1: 'B001', 2: 'A-1', 5: 3, 6: 60, 8: -9, 9: 0, 10: 6},
+        # 销售额为0 / 无SKU：过滤
+        {1: 'B004', 2: 'A-4', 5: 2, 6: 0, 8: 0, 9: 0, 10: 0},
+        {1: 'B005', 2: None, 5: 2, 6: 10},
+        # 数字SKU
+        {1: 'B006', 2: 1001, 5: 4, 6: 44},
+        # 无库存行
+        {1: 'B007', 2: 'A-7', 5: 30, 6: 300, 8: -40, 9: 1, 10: 2},
+        {1: 'B008', 2: 'A-8', 5: 5, 6: 50},
+    ],
+    'sku_master': [
+        {0: 'A-1', 2: 'Widget', 3: 'Kitchen', 4: 5, 5: 1},
+        {0: 'A-2', 2: None, 3: None, 4: '3.5', 5: None},
+        # 重复SKU以最后一行为准
+        {0: 'A-1', 2: 'Widget v2', 3: 'Home', 4: 6, 5: 1.5},
+        {0: 1001, 2: 'Numeric', 3: 'Toys', 4: 2, 5: 0.5},
+    ],
+    'ad_data': [
+        {1: 'B001', 2: 'A-1', 4: 50, 7: 1000, 8: 20, 10: 25.5},
+        {1: 'B001', 2: ' A-1 ', 4: '10', 7: 100, 8: 2, 10: '4.5'},
+        # 只有ASIN的行按ASIN前缀归属
+        {1: 'B002-US', 2: None, 4: 0, 7: 300, 8: 9, 10: 35},
+        {1: 'B002-DE', 2: None, 4: 5, 7: 30, 8: 1, 10: 3},
+        {1: 'B003', 2: None, 4: None, 7: None, 8: None, 10: None},
+        # 有SKU但花费/销售缺失：不回退到ASIN匹配
+        {1: 'B008', 2: 'A-8', 4: None, 7: 5, 8: None, 10: None},
+        {1: 'B008', 2: None, 4: 9, 7: 5, 8: 1, 10: 2},
+    ],
+    'inventory_data': [
+        {1: 'A-1', 5: 100, 6: 20, 7: 5},
+        {1: 'A-2', 5: '8', 6: None, 7: None},
+        {1: 1001, 5: 9, 6: 1, 7: 0},
+    ],
+    'fixed_costs': [
+        {0: '2026-01', 1: 8000, 2: 3000, 3: 500, 4: 200, 5: 100},
+        {0: '2026-02', 1: 8200, 2: None, 3: '500', 4: 200, 5: 100},
+    ],
+}
+
+
+def build_workbook(sheets):
+    """按上传格式在内存中生成工作簿"""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        skip, cols = SHEET_LAYOUT[name]
+        ws = wb.create_sheet(name)
+        width = max(cols) + 1
+        for i in range(skip):
+            ws.append([f'{name} 说明 {i + 1}'] + [None] * (width - 1))
+        for values in rows:
+            cells = [None] * width
+            for idx, value in values.items():
+                cells[idx] = value
+            ws.append(cells)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def typed(value):
+    """值 → 带类型的结构，用于逐字段比较类型"""
+    if isinstance(value, dict):
+        return {k: typed(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [typed(v) for v in value]
+    return type(value).__name__, value
+
+
+def run_both(raw):
+    old = legacy_processor.process_excel_file(io.BytesIO(raw), PARAMS)
+    new = process_excel_file(io.BytesIO(raw), PARAMS)
+    return old, {'summary': new['summary'], 'skus': new['skus'].to_records()}
+
+
+def assert_same(old, new):
+    assert typed(new['summary']) == typed(old['summary'])
+    assert [r['sku'] for r in new['skus']] == [r['sku'] for r in old['skus']]
+    for old_row, new_row in zip(old['skus'], new['skus']):
+        assert typed(new_row) == typed(old_row), old_row['sku']
+
+
+def test_edge_cases_match_legacy():
+    old, new = run_both(build_workbook(EDGE_CASES))
+    assert len(new['skus']) == 7
+    assert_same(old, new)
+
+
+def test_missing_sheets_match_legacy():
+    sheets = {name: EDGE_CASES[name] for name in ('sales_data', 'fixed_costs')}
+    assert_same(*run_both(build_workbook(sheets)))
+
+
+def test_no_sales_rows_match_legacy():
+    sheets = {**EDGE_CASES, 'sales_data': [{1: 'B004', 2: 'A-4', 5: 2, 6: 0}]}
+    assert_same(*run_both(build_workbook(sheets)))
+
+
+def test_numeric_sku_columns_with_blanks_match_legacy():
+    """整列为数字SKU且含空单元格时仍按 '1001' join 主数据与库存"""
+    sheets = {
+        'sales_data': [{1: 'B1', 2: 1001, 5: 4, 6: 44}, {1: 'B2', 2: None, 5: 1, 6: 10},
+                       {1: 'B3', 2: 1002.5, 5: 2, 6: 20}],
+        'sku_master': [{0: 1001, 2: 'Numeric', 3: 'Toys', 4: 2, 5: 0.5}, {0: None, 2: 'Blank'}],
+        'ad_data': [{1: 'B1', 2: 1001, 4: 10, 7: 50, 8: 3, 10: 4}, {1: 'B3', 2: None, 4: 1, 7: 5, 8: 1, 10: 1}],
+        'inventory_data': [{1: 1001, 5: 9, 6: 1, 7: 0}, {1: None, 5: 3}],
+    }
+    skus = {r['sku']: r for r in process_excel_file(io.BytesIO(build_workbook(sheets)), PARAMS)['skus']}
+    assert sorted(skus) == ['1001', '1002.5']
+    assert (skus['1001']['name'], skus['1001']['cogs'], skus['1001']['ful']) == ('Numeric', 8.0, 9.0)
+    assert (skus['1001']['adSpend'], skus['1002.5']['adSpend']) == (4.0, 1.0)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_synthetic_workbook_matches_legacy(seed):
+    buf = io.BytesIO()
+    write_workbook(buf, 500, seed=seed)
+    assert_same(*run_both(buf.getvalue()))
+
+
+def test_inventory_matches_legacy():
+    old, _ = run_both(build_workbook(EDGE_CASES))
+    new = process_excel_file(io.BytesIO(build_workbook(EDGE_CASES)), PARAMS)
+    legacy = legacy_processor.calc_inventory(old['skus'], PARAMS)
+    inventory = calc_inventory(new['skus'], PARAMS).to_records()
+    for old_row, new_row in zip(legacy, inventory):
+        assert typed({k: new_row[k] for k in old_row}) == typed(old_row), old_row['sku']
+
+
+def test_no_inventory_row_reports_int_zero_available_units():
+    new = process_excel_file(io.BytesIO(build_workbook(EDGE_CASES)), PARAMS)
+    inventory = {r['sku']: r for r in calc_inventory(new['skus'], PARAMS).to_records()}
+    assert inventory['A-7']['status'] != 'no-sales'
+    assert inventory['A-7']['availableUnits'] == 0
+    assert type(inventory['A-7']['availableUnits']) is int
+    assert type(inventory['A-1']['availableUnits']) is float
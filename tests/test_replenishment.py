@@ -0,0 +1,109 @@
+"""
+补货：历史日均按期EWMA平滑 (同一内容重复上传只算一期，重算已有run时同一秒的run按写入顺序)、
+类目头程覆盖；没有历史也没有覆盖时与原逐行实现 (legacy_processor.calc_inventory) 一致
+"""
+import io
+import uuid
+
+import pytest
+
+import legacy_processor
+from conftest import PARAMS, workbook_bytes
+from pipeline import run_pipeline
+from replenishment import DEMAND_EWMA_ALPHA, DEMAND_EWMA_RUNS, demand_prior, demand_rates, plan_replenishment
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def user_id(conn):
+    """没有历史run的新用户"""
+    cur = conn.execute("INSERT INTO users (username, password_hash) VALUES (?, 'x')", (uuid.uuid4().hex,))
+    conn.commit()
+    return cur.lastrowid
+
+
+def add_run(conn, user_id, units, created_at, source_hash=None, days=31):
+    """直接写入一期run与其SKU趋势点 {sku: 销量}"""
+    run_id = 'run_' + uuid.uuid4().hex[:12]
+    conn.execute('INSERT INTO runs (id, user_id, created_at, days, source_hash) VALUES (?, ?, ?, ?, ?)',
+                 (run_id, user_id, created_at, days, source_hash or run_id))
+    conn.executemany('INSERT INTO sku_trend (user_id, sku, created_at, run_id, units) VALUES (?, ?, ?, ?, ?)',
+                     ((user_id, sku, created_at, run_id, u) for sku, u in units.items()))
+    conn.commit()
+    return run_id
+
+
+def ewma(rates):
+    """逐期日均 (None为该期未出现) → EWMA，首次出现之前的期不计"""
+    smoothed = None
+    for rate in rates:
+        if smoothed is None:
+            smoothed = rate
+        else:
+            smoothed = DEMAND_EWMA_ALPHA * (rate or 0) + (1 - DEMAND_EWMA_ALPHA) * smoothed
+    return smoothed
+
+
+def test_ewma_smoothing(conn, user_id):
+    add_run(conn, user_id, {'A': 31, 'B': 0}, '2026-01-01 00:00:00')
+    add_run(conn, user_id, {'A': 62, 'B': 62}, '2026-02-01 00:00:00')
+    add_run(conn, user_id, {'A': 45, 'C': 15}, '2026-03-01 00:00:00', days=15)
+    prior = demand_prior(conn, user_id)
+    assert prior == pytest.approx({'A': ewma([1, 2, 3]), 'B': ewma([0, 2, None]), 'C': 1})
+
+
+def test_only_recent_runs(conn, user_id):
+    for month in range(1, DEMAND_EWMA_RUNS + 3):
+        # 窗口之外的期销量极大，不应影响结果
+        add_run(conn, user_id, {'A': 31000 if month <= 2 else 31 * month}, f'2026-{month:02d}-01 00:00:00')
+    assert demand_prior(conn, user_id)['A'] == pytest.approx(ewma(range(3, DEMAND_EWMA_RUNS + 3)))
+
+
+def test_duplicate_source_hash_counts_once(conn, user_id):
+    add_run(conn, user_id, {'A': 31}, '2026-01-01 00:00:00', source_hash='h1')
+    add_run(conn, user_id, {'A': 62}, '2026-02-01 00:00:00', source_hash='h2')
+    # 同一工作簿再次上传：只取最近一次
+    add_run(conn, user_id, {'A': 124}, '2026-03-01 00:00:00', source_hash='h2')
+    assert demand_prior(conn, user_id) == pytest.approx({'A': ewma([1, 4])})
+
+
+def test_before_run_orders_same_second(conn, user_id):
+    created_at = '2026-04-01 00:00:00'
+    first, second, third = (add_run(conn, user_id, {'A': 31 * i}, created_at) for i in (1, 2, 3))
+    assert demand_prior(conn, user_id, before_run=first) == {}
+    assert demand_prior(conn, user_id, before_run=second) == pytest.approx({'A': 1})
+    assert demand_prior(conn, user_id, before_run=third) == pytest.approx({'A': ewma([1, 2])})
+    # 只按时间截止时同一秒的run全部排除
+    assert demand_prior(conn, user_id, before=created_at) == {}
+
+
+def test_demand_rates_blend_prior():
+    skus = [{'sku': 'A', 'du': 3.0}, {'sku': 'B', 'du': 2.0}, {'sku': 'C', 'du': 0}]
+    rates = demand_rates(skus, {'A': 1.0, 'C': 0.333})
+    assert rates.tolist() == [round(DEMAND_EWMA_ALPHA * 3 + (1 - DEMAND_EWMA_ALPHA) * 1, 2), 2.0,
+                              round((1 - DEMAND_EWMA_ALPHA) * 0.333, 2)]
+    assert demand_rates(skus, {}).tolist() == [3.0, 2.0, 0]
+
+
+def test_category_lead_time_overrides():
+    skus = [{'sku': 'K', 'cat': 'Kitchen', 'du': 1.0, 'ful': 40, 'inb': 0, 'rsv': 0},
+            {'sku': 'H', 'cat': 'Home', 'du': 1.0, 'ful': 40, 'inb': 0, 'rsv': 0},
+            {'sku': 'T', 'cat': 'Toys', 'du': 2.0, 'ful': 20, 'inb': 0, 'rsv': 0}]
+    params = {**PARAMS, 'category_lead_times': {'Kitchen': 60, 'Toys': 5}}
+    inventory = plan_replenishment(skus, params).to_records()
+    assert [r['leadTime'] for r in inventory] == [60, PARAMS['lead_time_days'], 5]
+    assert [r['status'] for r in inventory] == ['reorder-now', 'healthy', 'watch']
+    assert [r['stockoutGap'] for r in inventory] == [20.0, 0, 0]
+    assert [r['ropUnits'] for r in inventory] == [60 + PARAMS['safety_days'], PARAMS['lead_time_days'] +
+                                                  PARAMS['safety_days'], 2 * (5 + PARAMS['safety_days'])]
+
+
+@pytest.mark.parametrize('seed', [0, 3])
+def test_no_prior_no_overrides_match_legacy(tmp_path, seed):
+    bundle = run_pipeline(io.BytesIO(workbook_bytes(n_skus=500, seed=seed)), {**PARAMS, 'category_lead_times': {}},
+                          cache=ResultCache(str(tmp_path)), demand={})
+    skus = bundle['skus'].to_records()
+    legacy = legacy_processor.calc_inventory(skus, PARAMS)
+    for inventory in (bundle['inventory'].to_records(), plan_replenishment(skus, PARAMS, {}).to_records()):
+        assert [{k: r[k] for k in old} for r, old in zip(inventory, legacy)] == legacy
+        assert [r['demandRate'] for r in inventory] == [s['du'] for s in skus]
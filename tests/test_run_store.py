@@ -0,0 +1,196 @@
+"""
+run_store：逐SKU关键指标行 (run_skus) 与blob一致，跨run查询走索引，迁移可为旧run补建；
+游标分页稳定、非法游标返回400；诊断倒排索引与直接按问题位列筛选一致
+"""
+import io
+import os
+
+import pytest
+
+import diagnostics
+import run_store
+from conftest import PARAMS, upload, workbook_bytes
+
+
+@pytest.fixture(scope='module')
+def runs(client):
+    """同一批SKU的三期上传 (SKU编号相同、数值不同)"""
+    return [upload(client, workbook_bytes(seed=seed), f'period{seed}.xlsx')['run_id'] for seed in (11, 12, 13)]
+
+
+def test_sku_rows_match_blob(conn, runs):
+    tables = run_store.load_tables(conn, runs[0])
+    rows = conn.execute('SELECT * FROM run_skus WHERE run_id = ? ORDER BY pos', (runs[0],)).fetchall()
+    assert len(rows) == len(tables['skus'])
+    for row in rows:
+        for table, key, col in run_store.SKU_ROW_COLUMNS:
+            assert row[col] == tables[table][row['pos']].get(key), (row['pos'], key)
+
+
+def test_sku_runs_across_runs(client, conn, runs):
+    sku = conn.execute('SELECT sku FROM run_skus WHERE run_id = ? ORDER BY pos LIMIT 1', (runs[0],)).fetchone()[0]
+    result = client.get(f'/api/skus/{sku}/runs?limit=3').json['runs']
+    # 同一秒上传时按 id 倒序 (与 list_runs 相同)
+    expected = [r[0] for r in conn.execute('SELECT id FROM runs WHERE id IN (?, ?, ?) ORDER BY created_at DESC, id DESC',
+                                           runs)]
+    assert [r['run_id'] for r in result] == expected
+    for r in result:
+        skus = run_store.load_tables(conn, r['run_id'], ('skus',))['skus']
+        assert skus[r['pos']]['sku'] == sku
+        assert (r['rev'], r['op']) == (skus[r['pos']]['rev'], skus[r['pos']]['op'])
+    assert len(client.get(f'/api/skus/{sku}/runs?limit=1').json['runs']) == 1
+    plan = ' '.join(r[-1] for r in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT run_id, pos FROM run_skus WHERE sku = ?', (sku,)))
+    assert 'idx_run_skus_sku_run' in plan
+
+
+def test_migration_rebuilds_sku_rows(conn, runs):
+    count = conn.execute('SELECT COUNT(*) FROM run_skus').fetchone()[0]
+    conn.execute('DROP TABLE run_skus')
+    conn.execute('PRAGMA user_version = 7')
+    assert set(runs) <= {run_id for run_id in run_store.index_sku_rows(conn.cursor())}
+    conn.execute(f'PRAGMA user_version = {run_store.MIGRATIONS[-1][0]}')
+    conn.commit()
+    assert conn.execute('SELECT COUNT(*) FROM run_skus').fetchone()[0] == count
+
+
+def test_delete_run_removes_sku_rows(client, conn):
+    run_id = upload(client, workbook_bytes(seed=14))['run_id']
+    assert conn.execute('SELECT COUNT(*) FROM run_skus WHERE run_id = ?', (run_id,)).fetchone()[0] > 0
+    client.delete(f'/api/runs/{run_id}')
+    assert conn.execute('SELECT COUNT(*) FROM run_skus WHERE run_id = ?', (run_id,)).fetchone()[0] == 0
+
+
+# ==================== 游标分页 ====================
+def walk(client, url, key, limit):
+    """按 next_cursor 翻到最后一页 → (全部记录, 每页的total)"""
+    items, totals, cursor = [], [], None
+    while True:
+        page = client.get(url + f'&limit={limit}' + (f'&cursor={cursor}' if cursor else '')).json
+        items += page[key]
+        totals.append(page.get('total'))
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items, totals
+
+
+def test_list_runs_pages_cover_all_runs(client, runs):
+    everything = client.get('/api/runs?limit=200').json['runs']
+    # 同一秒创建的run按 id 断开并列
+    paged, _ = walk(client, '/api/runs?', 'runs', 2)
+    assert [r['id'] for r in paged] == [r['id'] for r in everything]
+    assert len({r['id'] for r in paged}) == len(paged)
+
+
+@pytest.mark.parametrize('query', [
+    'sort=acos&order=desc',                       # 大量并列的0
+    'sort=acos&order=asc',
+    'sort=sellableDOS&order=asc&status=critical',
+    'sort=rev&order=desc&min_rev=500',
+    'sort=priority&order=asc&quadrant=star',
+])
+def test_query_skus_pages_are_stable(client, runs, query):
+    url = f'/api/runs/{runs[0]}/skus?fields=sku,rev&{query}'
+    everything = client.get(url + '&limit=1000').json
+    paged, totals = walk(client, url, 'skus', 7)
+    assert paged == everything['skus']
+    assert set(totals) == {everything['total']} and len(paged) == everything['total']
+    assert len({r['sku'] for r in paged}) == len(paged)
+
+
+def test_query_skus_exact_last_page(client, runs):
+    url = f'/api/runs/{runs[0]}/skus?fields=sku&sort=op'
+    total = client.get(url + '&limit=1').json['total']
+    assert client.get(url + f'&limit={total}').json['next_cursor'] is None
+    first = client.get(url + f'&limit={total - 1}').json
+    last = client.get(url + f"&limit={total}&cursor={first['next_cursor']}").json
+    assert len(last['skus']) == 1 and last['next_cursor'] is None
+
+
+BAD_CURSORS = ['not-base64!!', run_store.encode_cursor({'a': 1}), run_store.encode_cursor([1, 2, 3])]
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS + [run_store.encode_cursor([1, 2]),
+                                                  run_store.encode_cursor(['2024-01-01', None])])
+def test_list_runs_rejects_bad_cursor(client, cursor):
+    assert client.get(f'/api/runs?cursor={cursor}').status_code == 400
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS + [run_store.encode_cursor(v) for v in (
+    ['x', 1], [1, 'a'], [1, -1], [1, 1.5], [True, 1], [1, False], [None, 1])])
+@pytest.mark.parametrize('path', ['skus?sort=op', 'inventory?limit=5'])
+def test_query_skus_rejects_bad_cursor(client, runs, path, cursor):
+    assert client.get(f'/api/runs/{runs[0]}/{path}&cursor={cursor}').status_code == 400
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS + [run_store.encode_cursor(v) for v in (
+    [None, 'a'], [None, -1], [None, 2.5], [None, True], [1, 2])])
+def test_query_diagnostics_rejects_bad_cursor(client, runs, cursor):
+    assert client.get(f'/api/runs/{runs[0]}/diagnostics?cursor={cursor}').status_code == 400
+
+
+# ==================== 诊断倒排索引 ====================
+@pytest.fixture(scope='module')
+def role_run(client, tmp_path_factory):
+    """带角色快照的run (含角色问题位)：直接计算并落库，不修改用户的角色设置"""
+    import db
+    from data_processor import ALGO_VERSION
+    from pipeline import run_pipeline
+    from result_cache import ResultCache
+
+    raw = workbook_bytes(seed=31)
+    base = run_pipeline(io.BytesIO(raw), PARAMS, cache=ResultCache(str(tmp_path_factory.mktemp('cache'))), demand={})
+    losing = [s for s, om in zip(base['skus'].values('sku'), base['skus'].values('om')) if om < 0]
+    roles = ('traffic', 'defense', 'test')
+    params = {**PARAMS, 'sku_roles': {sku: [roles[i % 3], i % 12] for i, sku in enumerate(losing[:30])}}
+    bundle = run_pipeline(io.BytesIO(raw), params, cache=ResultCache(str(tmp_path_factory.mktemp('cache'))), demand={})
+    connection = db.connect(os.environ['DATABASE_PATH'])
+    db.transaction(connection, run_store.save_run, 'run_roleindex', 1, 'roles.xlsx', params, bundle, ALGO_VERSION,
+                   trend=False)
+    yield 'run_roleindex', bundle['diagnostics'].to_records()
+    connection.close()
+
+
+def matching(records, quadrant=None, flags=(), min_critical=None):
+    """直接按 flags/quadrant/criticalCount 列筛选 (对照倒排索引)"""
+    bits = sum(diagnostics.FLAGS[f] for f in flags)
+    return [r['sku'] for r in records
+            if r['flags'] & bits == bits and (quadrant is None or r['quadrant'] == quadrant)
+            and (min_critical is None or r['criticalCount'] >= min_critical)]
+
+
+def indexed(conn, run_id, limit=10000, **query):
+    items, total, _ = run_store.query_diagnostics(conn, run_id, limit=limit, **query)
+    assert total == len(items)
+    return [item['sku'] for item in items]
+
+
+def test_index_postings_match_flag_column(conn, role_run):
+    run_id, records = role_run
+    for name in diagnostics.FLAGS:
+        assert indexed(conn, run_id, flags=[name]) == matching(records, flags=[name]), name
+    for quadrant in diagnostics.QUADRANTS:
+        assert indexed(conn, run_id, quadrant=quadrant) == matching(records, quadrant=quadrant), quadrant
+    for k in range(1, diagnostics.MAX_CRITICAL + 1):
+        assert indexed(conn, run_id, min_critical=k) == matching(records, min_critical=k), k
+    # 角色问题位、低库存等都应出现
+    assert all(matching(records, flags=[name]) for name in ('lowStock', 'belowRoleAllowed', 'roleStopLoss'))
+
+
+@pytest.mark.parametrize('query', [
+    {'flags': ['belowRoleAllowed', 'roleBudgetCut']},
+    {'flags': ['adOverMargin'], 'quadrant': 'dog'},
+    {'flags': ['negativeMargin'], 'min_critical': 2},
+    {'quadrant': 'eliminate', 'min_critical': 1},
+    {'flags': ['lowStock', 'roleStopLoss'], 'quadrant': 'eliminate', 'min_critical': 3},
+])
+def test_index_intersections_match_flag_column(conn, role_run, query):
+    run_id, records = role_run
+    assert indexed(conn, run_id, **query) == matching(records, **query)
+
+
+def test_diagnostics_cursor_pages(client, role_run):
+    run_id, records = role_run
+    paged, totals = walk(client, f'/api/runs/{run_id}/diagnostics?flag=belowRoleAllowed', 'diagnostics', 4)
+    assert [r['sku'] for r in paged] == matching(records, flags=['belowRoleAllowed'])
+    assert set(totals) == {len(paged)}
@@ -0,0 +1,87 @@
+"""
+What-if扫描：矩阵中每个场景的指标与 rerun_with_params 按同样参数完整重算的结果一致
+(含类目头程覆盖与已指定角色；target_ad_ratio 不是计算参数，只对比默认目标占比)
+"""
+import io
+import os
+from collections import Counter
+
+import pytest
+
+import diagnostics
+import run_store
+from app import stored_loader
+from conftest import PARAMS, workbook_bytes
+from pipeline import rerun_with_params, run_pipeline
+from result_cache import ResultCache
+
+BASE_PARAMS = {**PARAMS, 'category_lead_times': {'Kitchen': 60, 'Toys': 20},
+               'sku_roles': {f'BM-{i:06d}': [('traffic', 'defense', 'test')[i % 3], i % 12] for i in range(0, 200, 5)}}
+GRID = [
+    {},
+    {'lead_time_days': 20},
+    {'lead_time_days': 50, 'safety_days': 10},
+    {'target_cover_days': 45, 'overstock_threshold': 60},
+    {'low_stock_threshold': 3},
+    {'low_stock_threshold': 20, 'overstock_threshold': 200, 'lead_time_days': 40},
+]
+
+
+@pytest.fixture(scope='module')
+def scenario_run(client, tmp_path_factory):
+    """带角色/类目头程快照的run：直接计算并落库，不修改用户设置"""
+    import db
+    from data_processor import ALGO_VERSION
+
+    bundle = run_pipeline(io.BytesIO(workbook_bytes(seed=61)), BASE_PARAMS,
+                          cache=ResultCache(str(tmp_path_factory.mktemp('cache'))), demand={})
+    connection = db.connect(os.environ['DATABASE_PATH'])
+    db.transaction(connection, run_store.save_run, 'run_scenarios', 1, 'scenarios.xlsx', BASE_PARAMS, bundle,
+                   ALGO_VERSION, trend=False)
+    connection.close()
+    return 'run_scenarios', bundle['source_hash']
+
+
+def engine_metrics(bundle):
+    """完整重算结果 → 与扫描矩阵同名的指标"""
+    inventory = bundle['inventory'].to_records()
+    diags = bundle['diagnostics'].to_records()
+    ads = bundle['ads']
+    status = Counter(r['status'] for r in inventory)
+    plan = ads['phase2']['plan']
+    return {
+        'targetAdRatio': round(ads['targetAdRatio'], 4),
+        'gap': round(ads['gap'], 4),
+        'finalAdRatio': plan[-1]['target_ad_ratio'] if plan else round(ads['phase1']['afterRatio'], 4),
+        'phase2Weeks': ads['phase2']['weeksNeeded'],
+        'salesImpactModerate': ads['impact']['totalPct']['moderate'],
+        'hasNonlinearRisk': ads['hasNonlinearRisk'],
+        'critical': status['critical'],
+        'reorderNow': status['reorder-now'],
+        'watch': status['watch'],
+        'healthy': status['healthy'],
+        'noSales': status['no-sales'],
+        'overstock': sum(r['overstockRisk'] for r in inventory),
+        'stockoutSkus': sum(1 for r in inventory if r['stockoutGap']),
+        'ropUnits': sum(r['ropUnits'] for r in inventory),
+        'orderUnits': sum(r['orderQty'] for r in inventory),
+        'lowStockIssues': sum(1 for r in diags if r['flags'] & diagnostics.LOW_STOCK),
+        'unhealthy': sum(1 for r in diags if not r['isHealthy']),
+    }
+
+
+def test_grid_matches_rerun(client, conn, scenario_run, tmp_path):
+    run_id, source_hash = scenario_run
+    result = client.post(f'/api/runs/{run_id}/scenarios', json={'scenarios': GRID}).json
+    run = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+    recomputed = set()
+    for scenario, row in zip(result['scenarios'], result['matrix']):
+        params = {**BASE_PARAMS, **{k: v for k, v in scenario.items() if k != 'target_ad_ratio'}}
+        bundle, executed = rerun_with_params(source_hash, BASE_PARAMS, params, stored_loader(conn, run),
+                                             cache=ResultCache(str(tmp_path)), demand={})
+        recomputed.update(executed)
+        assert dict(zip(result['metrics'], row)) == engine_metrics(bundle), scenario
+    # 扫描参数只影响库存/诊断阶段
+    assert recomputed == {'inventory', 'diagnostics'}
+    # 网格确实覆盖了不同的库存/诊断结果
+    assert len({tuple(row) for row in result['matrix']}) == len(GRID)
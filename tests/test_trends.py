@@ -0,0 +1,54 @@
+"""
+趋势点：同一SKU多行 (不同ASIN) 时按合并后的SKU写入，店铺整体可售天数不重复计入库存；
+迁移按合并后的SKU重写旧版趋势点
+"""
+import pytest
+
+import run_store
+from conftest import read_sheets, upload, workbook_bytes, write_sheets
+from excel_reader import SHEET_LAYOUT
+
+
+@pytest.fixture(scope='module')
+def duplicate_run(client):
+    """销售sheet中前20个SKU各多一行 (另一个ASIN)"""
+    sheets = read_sheets(workbook_bytes(seed=71))
+    skip = SHEET_LAYOUT['sales_data'][0]
+    rows = sheets['sales_data']
+    extra = [[cell + 'X' if i == 1 else cell for i, cell in enumerate(row)] for row in rows[skip:skip + 20]]
+    sheets['sales_data'] = rows + extra
+    return upload(client, write_sheets(sheets), 'duplicates.xlsx')['run_id']
+
+
+def expected_point(conn, run_id):
+    """合并后的SKU：日均为各行之和，库存按SKU只计一次 → (可售天数, SKU数)"""
+    tables = run_store.load_tables(conn, run_id, ('skus', 'inventory'))
+    per_sku = {}
+    for sku, ful, rate in zip(tables['skus'].values('sku'), tables['skus'].values('ful'),
+                              tables['inventory'].values('demandRate')):
+        du, _ = per_sku.get(sku, (0, ful))
+        per_sku[sku] = (du + rate, ful)
+    selling = [(du, ful) for du, ful in per_sku.values() if du > 0]
+    assert len(per_sku) < len(tables['skus'])
+    return round(sum(ful for _, ful in selling) / sum(du for du, _ in selling), 1), len(per_sku)
+
+
+def portfolio_point(conn, run_id):
+    return tuple(conn.execute('SELECT sellable_dos, sku_count FROM portfolio_trend WHERE run_id = ?',
+                              (run_id,)).fetchone())
+
+
+def test_portfolio_uses_merged_skus(conn, duplicate_run):
+    assert portfolio_point(conn, duplicate_run) == expected_point(conn, duplicate_run)
+
+
+def test_migration_recounts_portfolio(client, conn, duplicate_run):
+    plain_run = upload(client, workbook_bytes(seed=72))['run_id']
+    plain = portfolio_point(conn, plain_run)
+    conn.execute('UPDATE portfolio_trend SET sellable_dos = 0 WHERE run_id = ?', (duplicate_run,))
+    migrated = run_store.recount_portfolio_trends(conn.cursor())
+    conn.commit()
+    # 只重写含重复SKU的run
+    assert duplicate_run in migrated and plain_run not in migrated
+    assert portfolio_point(conn, duplicate_run) == expected_point(conn, duplicate_run)
+    assert portfolio_point(conn, plain_run) == plain
@@ -0,0 +1,149 @@
+"""
+LGURT Dashboard v5.1 - Trends
+跨run趋势：写入run时增量维护 SKU/店铺 汇总表，查询只走主键范围扫描
+"""
+import json
+
+import sku_table
+
+TRENDS_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS sku_trend (
+    user_id INTEGER NOT NULL,
+    sku TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    run_id TEXT NOT NULL,
+    rev REAL,
+    units REAL,
+    op REAL,
+    pm REAL,
+    ar REAL,
+    acos REAL,
+    sellable_dos REAL,
+    PRIMARY KEY (user_id, sku, created_at, run_id)
+) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS portfolio_trend (
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    run_id TEXT NOT NULL,
+    rev REAL,
+    op REAL,
+    np REAL,
+    pm REAL,
+    ar REAL,
+    acos REAL,
+    sellable_dos REAL,
+    sku_count INTEGER,
+    PRIMARY KEY (user_id, created_at, run_id)
+) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_sku_trend_run ON sku_trend (run_id)',
+    'CREATE INDEX IF NOT EXISTS idx_portfolio_trend_run ON portfolio_trend (run_id)',
+)
+
+SERIES_FIELDS = ('rev', 'units', 'op', 'pm', 'ar', 'acos', 'sellable_dos')
+PORTFOLIO_FIELDS = ('rev', 'op', 'np', 'pm', 'ar', 'acos', 'sellable_dos', 'sku_count')
+# 表列名 → API字段名 (与ResultBundle命名一致)
+OUTPUT_KEYS = {'sellable_dos': 'sellableDOS', 'sku_count': 'skuCount'}
+
+# 代表一期的run (r为runs表别名)：不含派生run (改参数/增量上传/刷新角色)；批量上传有组合run时只取组合run，
+# 没有组合run的批 (只有一个文件成功、命令行回填) 中各run各自代表一期。趋势点与历史日均只取这些run
+CANONICAL_RUN_SQL = ("r.parent_run_id IS NULL AND (r.batch_id IS NULL OR r.source_hash LIKE 'portfolio:%' "
+                     "OR NOT EXISTS (SELECT 1 FROM runs p WHERE p.batch_id = r.batch_id "
+                     "AND p.source_hash LIKE 'portfolio:%'))")
+
+
+def record_run(cur, run_id, user_id, summary, skus, rates=None):
+    """
+    代表一期的run写入后追加趋势点 (同一SKU多行时合并)
+    rates: 逐SKU日均 (库存表的 demandRate，可售天数与补货/诊断一致)，缺省为本期日均 (无历史平滑的旧run)
+    """
+    created_at = cur.execute("SELECT created_at FROM runs WHERE id = ?", (run_id,)).fetchone()[0]
+
+    cols = {k: sku_table.values(skus, k) for k in ('sku', 'rev', 'units', 'op', 'pp', 'adSpend', 'adSales', 'du', 'ful')}
+    if rates is not None:
+        cols['du'] = rates
+    per_sku = {}
+    for sku, rev, units, op, pp, spend, sales, du, ful in zip(*cols.values()):
+        a = per_sku.get(sku)
+        if a is None:
+            per_sku[sku] = {'rev': rev, 'units': units, 'op': op, 'pp': pp,
+                            'spend': spend, 'sales': sales, 'du': du, 'ful': ful}
+        else:
+            a['rev'] += rev
+            a['units'] += units
+            a['op'] += op
+            a['pp'] += pp
+            a['spend'] += spend
+            a['sales'] += sales
+            a['du'] += du
+
+    cur.executemany(
+        "INSERT OR REPLACE INTO sku_trend (user_id, sku, created_at, run_id, rev, units, op, pm, ar, acos, sellable_dos) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((user_id, sku, created_at, run_id, round(a['rev'], 2), a['units'], round(a['op'], 2),
+          ratio(a['pp'], a['rev'], 4), ratio(a['spend'], a['rev'], 4), ratio(a['spend'], a['sales'], 4),
+          round(a['ful'] / a['du'], 1) if a['du'] > 0 else None)
+         for sku, a in per_sku.items()))
+
+    # 整体可售天数按合并后的SKU (同一SKU多行的库存只计一次)
+    selling = [(a['du'], a['ful']) for a in per_sku.values() if a['du'] > 0]
+    total_du = sum(du for du, _ in selling)
+    cur.execute(
+        "INSERT OR REPLACE INTO portfolio_trend (user_id, created_at, run_id, rev, op, np, pm, ar, acos, sellable_dos, sku_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, created_at, run_id, summary.get('rev'), summary.get('op'), summary.get('np'),
+         summary.get('pm'), summary.get('ar'), summary.get('acos'),
+         round(sum(ful for _, ful in selling) / total_du, 1) if total_du > 0 else None, len(per_sku)))
+
+
+def remove_run(cur, run_id):
+    cur.execute("DELETE FROM sku_trend WHERE run_id = ?", (run_id,))
+    cur.execute("DELETE FROM portfolio_trend WHERE run_id = ?", (run_id,))
+
+
+def sku_history(conn, user_id, sku, limit=None):
+    """单个SKU的时间序列 (按时间升序，limit取最近N个点)"""
+    cols = ', '.join(SERIES_FIELDS)
+    rows = conn.execute(
+        f"SELECT run_id, created_at, {cols} FROM sku_trend WHERE user_id = ? AND sku = ? "
+        f"ORDER BY created_at DESC, run_id DESC LIMIT ?", (user_id, sku, limit or -1)).fetchall()
+    return [series_point(r, SERIES_FIELDS) for r in reversed(rows)]
+
+
+def portfolio_history(conn, user_id, limit=None):
+    """店铺整体时间序列"""
+    cols = ', '.join(PORTFOLIO_FIELDS)
+    rows = conn.execute(
+        f"SELECT run_id, created_at, {cols} FROM portfolio_trend WHERE user_id = ? "
+        f"ORDER BY created_at DESC, run_id DESC LIMIT ?", (user_id, limit or -1)).fetchall()
+    return [series_point(r, PORTFOLIO_FIELDS) for r in reversed(rows)]
+
+
+def series_point(row, fields):
+    point = {'run_id': row['run_id'], 'created_at': row['created_at']}
+    for f in fields:
+        point[OUTPUT_KEYS.get(f, f)] = row[f]
+    return point
+
+
+def ratio(a, b, digits):
+    return round(a / b, digits) if b > 0 else 0
+
+
+def backfill(cur, load_skus):
+    """为已有run补建趋势点，load_skus(cur, run_id) 返回该run的SKU记录；返回补建的run_id"""
+    runs = cur.execute(f"SELECT r.id, r.user_id, rr.summary_json FROM runs r "
+                       f"JOIN run_results rr ON rr.run_id = r.id WHERE {CANONICAL_RUN_SQL} ORDER BY r.created_at").fetchall()
+    for run_id, user_id, summary_json in runs:
+        record_run(cur, run_id, user_id, json.loads(summary_json) if summary_json else {}, load_skus(cur, run_id))
+    return [run_id for run_id, _, _ in runs]
+
+
+def prune(cur):
+    """删除不代表一期的run的趋势点 (旧版本对派生run、批量上传的各文件run也写了趋势点)，返回涉及的run_id"""
+    run_ids = [row[0] for row in cur.execute(
+        f"SELECT r.id FROM runs r WHERE NOT ({CANONICAL_RUN_SQL}) AND "
+        f"(EXISTS (SELECT 1 FROM portfolio_trend t WHERE t.run_id = r.id) "
+        f"OR EXISTS (SELECT 1 FROM sku_trend t WHERE t.run_id = r.id))").fetchall()]
+    for run_id in run_ids:
+        remove_run(cur, run_id)
+    return run_ids